@@ -1,19 +1,77 @@
 import logging
 import os
-from collections import defaultdict
-from itertools import islice
+from itertools import chain
 
+import numpy as np
 import sqlparse
 
 from django.db import connection, transaction
-from schematools.contrib.django.models import Dataset
 
 from dso_import import settings
-from dso_import.batch import batch, csv, geo
-from dso_import.batch.objectstore import download_file
+from dso_import.batch import (
+    batch,
+    columncache,
+    csv,
+    ewkb,
+    hashdiff,
+    indexes,
+    jobstate,
+    ledger,
+    pgcopy,
+    pipeline,
+    rejects,
+    schema,
+    sharding,
+    swap,
+    writer,
+)
+from dso_import.batch.refindex import ReferenceIndex
+from dso_import.batch.relations import RelationSink
+from dso_import.batch.objectstore import download_file, downloaded_etag, prefetch
 
 GOB_SHAPE_ENCODING = "utf-8"
 
+LOADER_COPY = "copy"
+LOADER_INSERT = "insert"
+# Former name of the insert loader, which used bulk_create
+LOADER_ORM = "orm"
+
+# References are checked per row against in-memory indexes ...
+VALIDATION_MEMORY = "memory"
+# ... or afterwards in the database, with anti-joins against the staging table
+VALIDATION_DATABASE = "database"
+
+# Changes are merged into the live tables ...
+PUBLISH_MERGE = "merge"
+# ... or new tables are built and swapped in
+PUBLISH_SWAP = "swap"
+
+# Date checks cover all staged rows ...
+DATE_CHECKS_ALL = "all"
+# ... or only the identificaties with a new or changed row
+DATE_CHECKS_TOUCHED = "touched"
+# Maximum number of examples that the date checks log
+DATE_CHECK_SAMPLE = 20
+
+# CSV rows are processed one by one (dicts) ...
+ENGINE_ROWS = "rows"
+# ... or vectorized, in batches of columns
+ENGINE_COLUMNAR = "columnar"
+
+# CSV column prefix of the references to other tables
+REFERENCE_FIELDS = {
+    "gemeente": "ligtIn:BRK.GME",
+    "stadsdeel": "ligtIn:GBD.SDL",
+    "ggw_gebied": "ligtIn:GBD.GGW",
+    "wijk": "ligtIn:GBD.WIJK",
+    "buurt": "ligtIn:GBD.BRT",
+    "woonplaats": "ligtIn:BAG.WPS",
+    "openbare_ruimte": "ligtAan:BAG.ORE",
+    "ligplaats": "adresseert:BAG.LPS",
+    "standplaats": "adresseert:BAG.SPS",
+    "verblijfsobject": "adresseert:BAG.VOT",
+}
+
 log = logging.getLogger(__name__)
 
 
@@ -21,6 +79,15 @@ def create_id(identificatie, volgnummer):
     return f"{identificatie}_{volgnummer:03}" if identificatie else None
 
 
+def create_id_column(identificaties, volgnummers):
+    """Vectorized create_id; returns an object array with None for empty identificaties"""
+    identificaties = np.asarray(identificaties, dtype=str)
+    volgnummers = np.char.zfill(np.asarray(volgnummers).astype(str), 3)
+    ids = np.char.add(np.char.add(identificaties, "_"), volgnummers).astype(object)
+    ids[identificaties == ""] = None
+    return ids
+
+
 def create_ids(row, naam_identificatie, naam_volgnummer):
     identificaties = row[naam_identificatie] or None
     result = []
@@ -39,117 +106,869 @@ def int_or_none(value):
         return None
 
 
+def int_or_none_column(column):
+    """Vectorized int_or_none"""
+    text = np.asarray(column, dtype=str)
+    digits = np.char.isdigit(text)
+    result = np.full(len(text), None, dtype=object)
+    result[digits] = text[digits].astype(np.int64).tolist()
+    return result
+
+
+def none_if_empty(value):
+    return value or None
+
+
+def none_if_empty_column(column):
+    return np.where(column == "", None, column)
+
+
+class Column:
+    """
+    Extra field with the (converted) value of a CSV column. Like the lambdas it
+    can be called with a row; the columnar engine converts a whole batch at once.
+
+    :param name: name of the CSV column
+    :param convert: function to convert a single value
+    :param convert_column: vectorized version of ``convert``
+    """
+
+    def __init__(self, name, convert=None, convert_column=None):
+        self.name = name
+        self.convert = convert
+        self.convert_column = convert_column
+
+    def __call__(self, r):
+        value = r[self.name]
+        return self.convert(value) if self.convert else value
+
+    def column(self, columns):
+        column = columns[self.name]
+        if self.convert_column:
+            return self.convert_column(column)
+        if self.convert:
+            return csv.object_column([self.convert(value) for value in column])
+        return column
+
+
+VERBLIJFSOBJECT_FIELDS = {
+    "oppervlakte": Column("oppervlakte", int_or_none, int_or_none_column),
+    "verdieping_toegang": Column("verdiepingToegang", int_or_none, int_or_none_column),
+    "hoogste_bouwlaag": Column("hoogsteBouwlaag", int_or_none, int_or_none_column),
+    "laagste_bouwlaag": Column("laagsteBouwlaag", int_or_none, int_or_none_column),
+    "aantal_kamers": Column("aantalKamers", int_or_none, int_or_none_column),
+    "eigendomsverhouding": Column("eigendomsverhouding"),
+    "gebruiksdoel": Column("gebruiksdoel", lambda v: v.split("|")),
+    "gebruiksdoel_woonfunctie": Column(
+        "gebruiksdoelWoonfunctie", none_if_empty, none_if_empty_column
+    ),
+    "gebruiksdoel_gezondheidszorgfunctie": Column(
+        "gebruiksdoelGezondheidszorgfunctie", none_if_empty, none_if_empty_column
+    ),
+    "toegang": Column("toegang", lambda v: v.split("|") if v else []),
+    "redenopvoer": Column("redenopvoer", none_if_empty, none_if_empty_column),
+    "redenafvoer": lambda r: r["redenopvoer"] or None,
+    "heeftin_hoofdadres_id": lambda r: create_id(
+        r["heeftIn:BAG.NAG.identificatieHoofdadres"],
+        int_or_none(r["heeftIn:BAG.NAG.volgnummerHoofdadres"]),
+    ),
+    "heeftin_nevenadres_id": lambda r: create_ids(
+        r,
+        "heeftIn:BAG.NAG.identificatieNevenadres",
+        "heeftIn:BAG.NAG.volgnummerNevenadres",
+    ),
+}
+
+NUMMERAANDUIDING_FIELDS = {
+    "huisnummer": Column("huisnummer"),
+    "huisletter": Column("huisletter", none_if_empty, none_if_empty_column),
+    "huisnummer_toevoeging": Column(
+        "huisnummertoevoeging", none_if_empty, none_if_empty_column
+    ),
+    "postcode": Column("postcode"),
+    "type_adres": Column("typeAdres"),
+}
+
+
 class ImportBagHTask(batch.BasicTask):
     dataset = "bagh"
 
     def __init__(self, *args, **kwargs):
         self.table = f"{self.__class__.dataset}_{self.__class__.name}"
         self.temp_table = f"{self.__class__.dataset}_temp"
+        self.diff_table = f"{self.__class__.dataset}_diff_temp"
         self.path = kwargs.get("path")
+        # False: use the files that are in path, e.g. generated by run_benchmark
+        self.download = kwargs.get("download", True)
         self.models = kwargs["models"]
-        self.model = self.models[self.__class__.name]
         self.gob_path = kwargs.get("gob_path", "bag")
         self.gob_id = {"bag": "BAG", "gebieden": "GBD"}[self.gob_path]
 
         self.filename = f"{self.gob_id}_{self.__class__.name}_ActueelEnHistorie.csv"
         self.source_path = f"{self.gob_path}/CSV_ActueelEnHistorie"
+        self.source_file = os.path.join(self.source_path, self.filename)
         self.reference_models = {
-            model_name: set() for model_name in kwargs.get("references", [])
+            model_name: ReferenceIndex() for model_name in kwargs.get("references", [])
         }
+        self.depends_on = list(self.reference_models) + kwargs.get("use", [])
         self.geotype = kwargs.get("geotype", "multipolygon")
         self.extra_fields = kwargs.get("extra_fields")
+        self.loader = kwargs.get("loader", settings.IMPORT_LOADER)
+        if self.loader == LOADER_ORM:
+            self.loader = LOADER_INSERT
+        self.copy_format = kwargs.get("copy_format", settings.IMPORT_COPY_FORMAT)
+        self.processes = kwargs.get("processes", settings.IMPORT_PROCESSES)
+        self.validation = kwargs.get("validation", settings.IMPORT_VALIDATION)
+        self.engine = kwargs.get("engine", settings.IMPORT_ENGINE)
+        self.publish = kwargs.get("publish", settings.IMPORT_PUBLISH)
+        self.date_checks = kwargs.get("date_checks", settings.IMPORT_DATE_CHECKS)
+        self.column_cache = kwargs.get("column_cache", settings.IMPORT_COLUMN_CACHE)
+        self.column_cache_dir = kwargs.get("column_cache_dir", settings.IMPORT_COLUMN_CACHE_DIR)
+        self.pipeline_depth = kwargs.get("pipeline_depth", settings.IMPORT_PIPELINE_DEPTH)
+        self.pipelining = False
+        # Stage the rows in shards, each in its own process
+        self.shards = kwargs.get("shards", settings.IMPORT_SHARDS)
+        self.sharded = self.shards > 1 and bool(self.path)
+        self.cached = None
+        self.worker = False
+        self.incremental = bool(
+            self.path and kwargs.get("incremental", settings.IMPORT_INCREMENTAL)
+        )
+        self.unchanged = False
+        self.checkpointing = False
+        self.resume_offset = None
+        self.checksum = None
+        self.size = None
+        self.etag = None
+        self.previous_hashes = None
+        self.row_hashes = {}
+        self.seen_ids = set()
+        # Only the description of the table is needed, not the model
+        table = self.models.table(self.__class__.name)
+        self.fields = table.fields
+        self.pk = table.pk
+        self.srid = table.srid
         self.count_no_ref = 0
 
     def get_non_pk_fields(self):
-        return [x.attname for x in self.model._meta.get_fields() if not x.primary_key]
+        return [attname for attname, _ in self.fields if attname != self.pk]
 
     def before(self):
+        # A sharded import has no byte offsets to resume at, it starts over
+        self.checkpointing = self.job_state is not None and bool(self.path) and not self.sharded
+        if self.checkpointing or self.sharded:
+            # Not temporary, so the staged rows survive an interruption,
+            # and the connections of the shards can write them
+            self.temp_table = f"{self.table}_staging"
+        # Worker processes already parse ahead of the writes
+        self.pipelining = self.pipeline_depth > 0 and self.processes <= 1 and not self.sharded
+
+        if self.path and self.download:
+            with self.metrics.stage("download"):
+                download_file(self.source_file, target_root=self.path)
+
         cursor = connection.cursor()
-        cursor.execute(f"DROP TABLE IF EXISTS {self.temp_table}")
-        cursor.execute(
-            f"CREATE TEMPORARY TABLE {self.temp_table} AS TABLE {self.table} WITH NO DATA"
+        if self.checkpointing:
+            self.resume_offset = self.resume_point(cursor)
+        if self.resume_offset is None:
+            self.create_staging_tables(cursor)
+        self.writer = self.table_writer(self.temp_table)
+
+        if self.incremental:
+            self.check_ledger(cursor)
+            if self.unchanged:
+                cursor.close()
+                return
+            if self.resume_offset is not None:
+                self.replay(cursor)
+
+        if self.validation == VALIDATION_DATABASE:
+            rejects.clear(cursor, self.table)
+        else:
+            self.load_references()
+        cursor.close()
+
+        # Worker processes parse the file themselves
+        columnar = self.engine == ENGINE_COLUMNAR and self.processes <= 1 and not self.sharded
+        if self.path and self.column_cache and columnar:
+            self.cached = self.load_column_cache()
+
+    def table_writer(self, target):
+        """Writer for the rows of the task to ``target``, e.g. the staging table"""
+        return writer.TableWriter.for_table(
+            self.models.table(self.__class__.name),
+            target,
+            method=writer.WRITE_COPY if self.loader == LOADER_COPY else writer.WRITE_INSERT,
+            copy_format=self.copy_format,
+            metrics=self.metrics,
+            on_batch=self.batch_written,
         )
-        self.model._meta.db_table = self.temp_table
 
-        if self.path:
-            download_file(os.path.join(self.source_path, self.filename))
+    def batch_written(self):
+        """Called after every batch of rows, when no statement runs on the connection"""
+        pass
 
-        for model_name in self.reference_models.keys():
-            # cursor.execute(f"SELECT id from {self.models[model_name]._meta.db_table}")
-            # self.reference_models[model_name] = set(chain.from_iterable(cursor.fetchall()))
-            self.reference_models[model_name] = set(
-                self.models[model_name].objects.values_list("id", flat=True)
+    def staging_tables(self):
+        """The ``(staging table, table)`` pairs the rows of the task are staged in"""
+        return [(self.temp_table, self.table)]
+
+    def create_staging_tables(self, cursor):
+        kind = "UNLOGGED" if self.checkpointing or self.sharded else "TEMPORARY"
+        for staging_table, table in self.staging_tables():
+            cursor.execute(f"DROP TABLE IF EXISTS {staging_table}")
+            cursor.execute(f"CREATE {kind} TABLE {staging_table} AS TABLE {table} WITH NO DATA")
+
+    def source_version(self):
+        stat = os.stat(os.path.join(self.path, self.filename))
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def resume_point(self, cursor):
+        """
+        Returns the byte offset up to which the rows of the source file were
+        staged by an interrupted run, or None when staging has to start over
+        """
+        state = self.job_state.get(self.name)
+        version = self.source_version()
+        if (
+            state is not None
+            and state.status == jobstate.RUNNING
+            and state.source_version == version
+            and state.byte_offset is not None
+        ):
+            staging_tables = [staging_table for staging_table, _ in self.staging_tables()]
+            cursor.execute(
+                "SELECT bool_and(to_regclass(t) IS NOT NULL) FROM unnest(%s::text[]) t",
+                [staging_tables],
             )
-        cursor.close()
+            (exists,) = cursor.fetchone()
+            # Unlogged tables are emptied when the server crashes
+            if exists and self.staged_rows(cursor) == state.row_count:
+                self.count = state.row_count
+                log.info(
+                    f"{self.name.title()}: resuming at byte {state.byte_offset},"
+                    f" {state.row_count} rows staged"
+                )
+                return state.byte_offset
+        self.job_state.start(self.name, version)
+        return None
+
+    def staged_rows(self, cursor):
+        cursor.execute(f"SELECT count(*) FROM {self.temp_table}")
+        (count,) = cursor.fetchone()
+        return count
+
+    def replay(self, cursor):
+        """
+        Restores the ids and row hashes of the rows that were staged before
+        the interruption, without staging them again
+        """
+        for _ in csv.process_csv_ranges(
+            self.path, self.filename, self.replay_row, stop=self.resume_offset
+        ):
+            pass
+        # Rejected rows are not recorded, so they are retried next time
+        cursor.execute(f"SELECT id FROM {self.temp_table}")
+        staged = {id for (id,) in cursor.fetchall()}
+        self.row_hashes = {id: h for id, h in self.row_hashes.items() if id in staged}
+
+    def replay_row(self, r):
+        id1 = create_id(r["identificatie"], int(r["volgnummer"]))
+        row_hash = ledger.row_hash(r)
+        self.seen_ids.add(id1)
+        if not self.previous_hashes or self.previous_hashes.get(id1) != row_hash:
+            self.row_hashes[id1] = row_hash
+
+    def load_column_cache(self):
+        """Returns the cached columns of the source file, which are written when needed"""
+        if not columncache.available():
+            raise ValueError("The column cache needs pyarrow, which is not installed")
+        # Not the etag of a file that was replaced after its download
+        key = downloaded_etag(self.source_file, target_root=self.path) or self.source_version()
+        with self.metrics.stage("cache"):
+            cached = columncache.cached_columns(
+                self.column_cache_dir, self.path, self.filename, key
+            )
+        if self.resume_offset is not None and self.resume_offset not in cached.ends():
+            # Checkpointed by a run that parsed the file in other ranges
+            log.info(f"{self.name.title()}: resume offset is not in the column cache")
+            return None
+        return cached
+
+    def load_references(self):
+        for model_name in self.reference_models.keys():
+            self.reference_models[model_name] = self.load_reference_index(model_name)
+
+    def load_reference_index(self, model_name):
+        with self.metrics.stage("references"), connection.chunked_cursor() as cursor:
+            index = ReferenceIndex.load(cursor, self.models.table(model_name).db_table)
+        log.debug(f"Loaded {len(index)} {model_name} ids ({index.nbytes} bytes)")
+        return index
+
+    def check_ledger(self, cursor):
+        """
+        Compares the source file with the last import. An unchanged file is skipped,
+        for a changed file only the added or changed rows are staged.
+        """
+        entry = ledger.get_entry(cursor, self.filename)
+        # None when the file changed since it was downloaded, e.g. with --skip-download;
+        # the checksum decides then
+        self.etag = downloaded_etag(self.source_file, target_root=self.path)
+        if entry is not None and self.etag and entry.etag == self.etag:
+            log.info(f"{self.filename} etag unchanged since {entry.imported_at}; skipping")
+            self.unchanged = True
+            return
+
+        self.checksum, self.size = ledger.file_checksum(
+            os.path.join(self.path, self.filename)
+        )
+        if entry is None:
+            return
+        if entry.checksum == self.checksum and entry.size == self.size:
+            log.info(f"{self.filename} unchanged since {entry.imported_at}; skipping")
+            self.unchanged = True
+        else:
+            self.previous_hashes = ledger.get_row_hashes(cursor, self.filename)
 
     def after(self):
+        if not self.unchanged:
+            with self.metrics.stage("validate"):
+                if self.validation == VALIDATION_DATABASE:
+                    with connection.cursor() as cursor:
+                        self.reject_orphans(cursor)
+                self.validate()
+            with self.metrics.stage("merge"):
+                if self.publish == PUBLISH_SWAP:
+                    self.publish_swap()
+                else:
+                    with transaction.atomic(), connection.cursor() as cursor:
+                        self.merge(cursor)
+                        if self.incremental:
+                            self.save_ledger(cursor)
+        self.cleanup()
+
+    def publish_swap(self):
+        """Builds new tables and swaps them in, instead of merging into the live tables"""
+        with connection.cursor() as cursor:
+            definitions = self.build_tables(cursor)
+        with transaction.atomic(), connection.cursor() as cursor:
+            for definition in definitions:
+                swap.swap(cursor, definition, swap.new_name(definition.table))
+            hashdiff.save_hashes(cursor, self.table, self.diff_table)
+            if self.incremental:
+                self.save_ledger(cursor)
+        with connection.cursor() as cursor:
+            for definition in definitions:
+                swap.validate_foreign_keys(cursor, definition)
+
+    def build_tables(self, cursor):
+        return [self.build_table(cursor, self.table, self.temp_table)]
+
+    def build_table(self, cursor, table, staging_table, **kwargs):
+        """
+        Builds the complete new version of a table next to the live table
+
+        :param kwargs: passed on to ``swap.fill``
+        """
+        definition = swap.describe(cursor, table)
+        new_table = swap.new_name(table)
+        swap.create_like(cursor, table, new_table)
+        swap.fill(cursor, table, new_table, staging_table, **kwargs)
+        swap.create_indexes(cursor, definition, new_table)
+        return definition
+
+    def reject_orphans(self, cursor):
+        """Deletes staged rows with an invalid reference and records them as rejects"""
+        for model_name in self.reference_models.keys():
+            rejected = rejects.reject_orphans(
+                cursor,
+                self.table,
+                self.temp_table,
+                f"{model_name}_id",
+                self.models.table(model_name).db_table,
+            )
+            if rejected:
+                log.error(
+                    f"{self.name.title()}: {len(rejected)} rows with invalid id for"
+                    f" {model_name}; see {rejects.REJECT_TABLE}"
+                )
+            self.count_no_ref += len(rejected)
+            for id in rejected:
+                # Not recorded in the ledger, so they are retried next time
+                self.row_hashes.pop(id, None)
+
+    def validate(self):
         cursor = connection.cursor()
-        cursor.execute(f"ALTER TABLE {self.temp_table} ADD PRIMARY KEY(id)")
-        cursor.execute(f"CREATE INDEX ON {self.temp_table}(identificatie)")
+        # Like the deferred indexes of a full load, built after the rows are loaded
+        with indexes.using_maintenance_work_mem(cursor, settings.IMPORT_MAINTENANCE_WORK_MEM):
+            # IF NOT EXISTS: a resumed import can validate a staging table again
+            indexes.build(
+                cursor,
+                f"CREATE UNIQUE INDEX IF NOT EXISTS {self.temp_table}_id ON {self.temp_table}(id)",
+            )
+            indexes.build(
+                cursor,
+                f"CREATE INDEX IF NOT EXISTS {self.temp_table}_identificatie"
+                f" ON {self.temp_table}(identificatie)",
+            )
+
+        # Classify the staged rows in one pass: new, changed or deleted
+        counts = hashdiff.diff(
+            cursor,
+            self.table,
+            self.temp_table,
+            self.diff_table,
+            complete=self.previous_hashes is None,
+        )
+        log.info(
+            f"{self.table}: {counts[hashdiff.INSERT]} new, {counts[hashdiff.UPDATE]} changed,"
+            f" {counts[hashdiff.DELETE]} deleted"
+        )
 
         fail = False
-        if self.do_date_checks() > 0:
+        with self.metrics.stage("date_checks"):
+            invalid = self.do_date_checks()
+        if invalid > 0:
             log.error(f"Data invalid. Skip table {self.table}")
             fail = True
 
         # validate_geometry(models.Stadsdeel)
 
         # Check rows to delete. In history database there should be no rows to delete
-        cursor.execute(
-            f"""
-            SELECT COUNT(e.*) FROM {self.table} e
-            LEFT JOIN  {self.temp_table} t ON e.id = t.id
-            WHERE t.id IS NULL
-            """
-        )
-        (count,) = cursor.fetchone()
+        if self.previous_hashes is not None:
+            # Only changed rows are staged, so compare with the previous import
+            count = len(self.previous_hashes.keys() - self.seen_ids)
+        else:
+            count = counts[hashdiff.DELETE]
         if count > 0:
             log.error(f"Rows deleted. Data invalid. Skip table {self.table}")
             fail = True
+        cursor.close()
         if fail:
             raise ValueError("Stopped import. Do not continue because of errors")
-        with transaction.atomic():
-            cursor.execute(
-                f"""
-                INSERT INTO  {self.table}
-                SELECT t.* FROM {self.temp_table} t
-                LEFT JOIN  {self.table} e ON t.id = e.id
-                WHERE e.id IS NULL
-                """
-            )
-            log.info(f"Inserted into {self.table} : {cursor.rowcount}")
-            setters = map(lambda x: f"{x} = t.{x}", self.get_non_pk_fields())
-            # No
-            cursor.execute(
-                f"""
-                UPDATE {self.table} e SET {",".join(setters)}
-                FROM {self.temp_table} t
-                WHERE e.id = t.id AND t IS DISTINCT FROM e
-                """
-            )
-            log.info(f"Updated {self.table} : {cursor.rowcount}")
 
-        cursor.execute(f"DROP TABLE {self.temp_table}")
-        self.model._meta.db_table = self.table
+    def merge(self, cursor):
+        hashdiff.merge(
+            cursor, self.table, self.temp_table, self.diff_table, self.get_non_pk_fields()
+        )
+
+    def save_ledger(self, cursor):
+        ledger.save(
+            cursor,
+            self.filename,
+            self.checksum,
+            self.size,
+            len(self.seen_ids),
+            self.row_hashes,
+            replace=self.previous_hashes is None,
+            etag=self.etag,
+        )
+
+    def cleanup(self):
+        cursor = connection.cursor()
+        for staging_table, _ in self.staging_tables():
+            cursor.execute(f"DROP TABLE IF EXISTS {staging_table}")
+        cursor.execute(f"DROP TABLE IF EXISTS {self.diff_table}")
+        if self.publish == PUBLISH_SWAP:
+            # Left behind when the import failed before the swap
+            cursor.execute(f"DROP TABLE IF EXISTS {swap.new_name(self.table)}")
+        self.writer = None
         self.reference_models.clear()
+        self.cached = None
+        self.previous_hashes = None
+        self.row_hashes = {}
+        self.seen_ids = set()
         cursor.close()
+        self.metrics.rejected = self.count_no_ref
         if self.count_no_ref:
             log.info(f"Skipped no valid reference: {self.count_no_ref}")
 
     def process(self):
-        entries = csv.process_csv(self.path, self.filename, self.process_row)
-        while True:
-            slice = list(islice(entries, batch.BATCH_SIZE))
-            if not slice:
-                break
-            self.model.objects.bulk_create(slice)
+        if self.unchanged:
+            return
+        self.metrics.bytes_read += (
+            os.path.getsize(os.path.join(self.path, self.filename)) - (self.resume_offset or 0)
+        )
+        if self.sharded:
+            self.process_sharded()
+            return
+        if self.checkpointing:
+            self.process_checkpointed()
+            return
+        if self.processes > 1:
+            entries = self.process_csv_parallel()
+        elif self.engine == ENGINE_COLUMNAR:
+            entries = csv.process_csv_columns(
+                self.path, self.filename, self.process_batch, cached=self.cached
+            )
+        else:
+            entries = csv.process_csv(self.path, self.filename, self.process_row)
+        if self.pipelining:
+            chunks = self.pipelined(pipeline.chunks(entries))
+            entries = chain.from_iterable(chunk for chunk, _ in chunks)
+        else:
+            # Time spent producing the entries is parse (and transform) time, not write time
+            entries = self.metrics.timed(entries, "parse")
+        with self.metrics.stage("write"):
+            self.write_entries(entries)
 
-    def process_row(self, r):
-        values = self.process_row_common(r)
-        if values:
-            return self.model(**values)
+    def write_entries(self, entries):
+        self.writer.write(entries)
+
+    def process_checkpointed(self):
+        """
+        Stages the rows per byte range of the source file. Every range is
+        committed together with a checkpoint of its end offset, where an
+        interrupted import resumes.
+        """
+        columnar = self.engine == ENGINE_COLUMNAR and self.processes <= 1
+        callback = self.process_batch if columnar else self.process_row
+        ranges = csv.process_csv_ranges(
+            self.path,
+            self.filename,
+            callback,
+            start=self.resume_offset,
+            processes=self.processes,
+            columnar=columnar,
+            cached=self.cached,
+            init_worker=self.init_worker,
+            pop_state=self.pop_worker_state,
+            merge_state=self.merge_worker_state,
+        )
+        if self.pipelining:
+            staged = self.pipelined(ranges)
         else:
-            return None
+            staged = ((item, self.count) for item in self.metrics.timed(ranges, "parse"))
+        for (end, entries), count in staged:
+            with self.metrics.stage("write"), transaction.atomic():
+                self.write_entries(iter(entries))
+                self.save_related()
+                self.job_state.checkpoint(self.name, end, count)
+
+    def process_sharded(self):
+        """
+        Stages the rows in ``shards`` worker processes, each with its own
+        connection and its own unlogged staging tables, and combines the
+        shards in the staging tables. The rows are partitioned by
+        identificatie, so all versions of an object are in the same shard.
+        """
+        with connection.cursor() as cursor:
+            for staging_table, table in self.staging_tables():
+                for shard in range(self.shards):
+                    shard_table = sharding.shard_table(staging_table, shard)
+                    cursor.execute(f"DROP TABLE IF EXISTS {shard_table}")
+                    cursor.execute(
+                        f"CREATE UNLOGGED TABLE {shard_table} AS TABLE {table} WITH NO DATA"
+                    )
+        # Forked processes must not share the connection of this thread
+        connection.close()
+        for state in sharding.run(self.load_shard, self.shards):
+            self.merge_worker_state(state)
+
+        with self.metrics.stage("write"), connection.cursor() as cursor:
+            for staging_table, _ in self.staging_tables():
+                shard_tables = [
+                    sharding.shard_table(staging_table, shard) for shard in range(self.shards)
+                ]
+                cursor.execute(
+                    f"INSERT INTO {staging_table} "
+                    + " UNION ALL ".join(f"SELECT * FROM {t}" for t in shard_tables)
+                )
+                for shard_table in shard_tables:
+                    cursor.execute(f"DROP TABLE {shard_table}")
+
+    def load_shard(self, shard):
+        """Stages the rows of a shard, in a worker process; returns the state for the parent"""
+        self.init_shard(shard)
+        entries = csv.process_csv_shard(
+            self.path,
+            self.filename,
+            self.process_batch if self.engine == ENGINE_COLUMNAR else self.process_row,
+            shard,
+            self.shards,
+            columnar=self.engine == ENGINE_COLUMNAR,
+        )
+        try:
+            with self.metrics.stage("write"):
+                self.write_entries(self.metrics.timed(entries, "parse"))
+            self.save_related()
+        finally:
+            connection.close()
+        return self.pop_worker_state()
+
+    def init_shard(self, shard):
+        """Prepares a worker process to write to the tables of ``shard``"""
+        self.init_worker()
+        self.writer = self.table_writer(sharding.shard_table(self.temp_table, shard))
+
+    def pipelined(self, items):
+        """
+        Produces ``items`` (parsed and transformed) in a thread, ahead of the
+        writes in this thread; see ``pipeline``. Yields ``(item, count)`` with
+        the number of rows processed up to and including the item. The rows
+        collected besides an item (see ``pop_related``) are passed on with it.
+        """
+
+        def produce():
+            for item in self.metrics.timed(items, "parse"):
+                yield item, self.count, self.pop_related()
+
+        produced = pipeline.pipelined(produce(), self.pipeline_depth, name=f"{self.name}-pipeline")
+        try:
+            # Time spent waiting for the pipeline thread
+            for item, count, related in self.metrics.timed(produced, "wait"):
+                self.push_related(related)
+                yield item, count
+        finally:
+            produced.close()
+
+    def pop_related(self):
+        """Returns and forgets the rows collected besides the entries, in the pipeline thread"""
+        return None
+
+    def push_related(self, related):
+        """Adds the rows returned by ``pop_related``, in the thread that writes"""
+        pass
+
+    def save_related(self):
+        """Saves the rows that are collected besides the entries, e.g. relations"""
+        pass
+
+    def process_csv_parallel(self):
+        """Parses and transforms the rows in worker processes"""
+        return csv.process_csv_parallel(
+            self.path,
+            self.filename,
+            self.process_row,
+            self.processes,
+            init_worker=self.init_worker,
+            pop_state=self.pop_worker_state,
+            merge_state=self.merge_worker_state,
+        )
+
+    def add_relations(self, sink, id, identificaties, volgnummers, index, field):
+        """
+        Adds the relations of object ``id`` in a multi-valued reference to
+        ``sink``; identificaties and volgnummers are separated by |. With memory
+        validation references that are not in ``index`` are skipped.
+        """
+        if not identificaties:
+            return
+        identificaties = identificaties.split("|")
+        volgnummers = volgnummers.split("|")
+        for identificatie, volgnummer in zip(identificaties, volgnummers):
+            volgnummer = int(volgnummer)
+            reference_id = create_id(identificatie, volgnummer)
+            if self.validation == VALIDATION_MEMORY and not index.contains(identificatie, volgnummer):
+                log.error(f"{self.name.title()} {id} has invalid {field} {reference_id} ; skipping")
+            else:
+                sink.add(id, reference_id)
+
+    def init_worker(self):
+        self.worker = True
+        # Only what this worker collects is passed on to the parent, not the
+        # state it inherited, e.g. the count of a resumed import
+        self.metrics.reset()
+        self.count = 0
+        self.count_no_ref = 0
+        self.row_hashes = {}
+        self.seen_ids = set()
+
+    def pop_worker_state(self):
+        """Returns and resets the state collected by a worker process"""
+        state = {
+            "count": self.count,
+            "count_no_ref": self.count_no_ref,
+            "row_hashes": self.row_hashes,
+            "seen_ids": self.seen_ids,
+            "seconds": self.metrics.pop_seconds(),
+        }
+        self.count = 0
+        self.count_no_ref = 0
+        self.row_hashes = {}
+        self.seen_ids = set()
+        return state
+
+    def merge_worker_state(self, state):
+        self.count += state["count"]
+        self.count_no_ref += state["count_no_ref"]
+        self.row_hashes.update(state["row_hashes"])
+        self.seen_ids.update(state["seen_ids"])
+        # Transform times of the workers add up, they run at the same time
+        self.metrics.add_seconds(state["seconds"])
+
+    def process_row(self, r):
+        self.metrics.start("transform")
+        try:
+            if self.incremental:
+                id1 = create_id(r["identificatie"], int(r["volgnummer"]))
+                row_hash = ledger.row_hash(r)
+                self.seen_ids.add(id1)
+                if self.previous_hashes and self.previous_hashes.get(id1) == row_hash:
+                    return None  # Unchanged since the last import
+            values = self.process_row_common(r)
+            if not values:
+                return None
+            if self.incremental:
+                # Rejected rows are not recorded, so they are retried next time
+                self.row_hashes[id1] = row_hash
+            return self.as_row(values)
+        finally:
+            self.metrics.stop()
+
+    def as_row(self, values):
+        """The values of a row as a tuple for the writer, in the order of the columns"""
+        return tuple(values.get(attname) for attname, _ in self.fields)
+
+    def process_batch(self, columns):
+        """
+        Columnar variant of ``process_row``: returns the rows for the loader
+        of a batch of columns.
+        """
+        self.metrics.start("transform")
+        try:
+            if self.incremental:
+                columns, hashes = self.filter_unchanged(columns)
+            values = self.process_columns(columns)
+            ids = values["id"].tolist()
+            if self.incremental:
+                # Rejected rows are not recorded, so they are retried next time
+                self.row_hashes.update(zip(ids, hashes[self.valid].tolist()))
+
+            empty = [None] * len(ids)
+            return list(
+                zip(
+                    *(
+                        values[attname].tolist() if attname in values else empty
+                        for attname, _ in self.fields
+                    )
+                )
+            )
+        finally:
+            self.metrics.stop()
+
+    def filter_unchanged(self, columns):
+        """Removes the rows that did not change since the last import"""
+        ids = create_id_column(columns["identificatie"], columns["volgnummer"].astype(np.int64))
+        hashes = np.array(
+            [ledger.row_hash(row) for row in zip(*columns.values())], dtype=np.int64
+        )
+        self.seen_ids.update(ids.tolist())
+        if self.previous_hashes:
+            changed = np.array(
+                [
+                    self.previous_hashes.get(id) != h
+                    for id, h in zip(ids.tolist(), hashes.tolist())
+                ],
+                dtype=bool,
+            )
+            columns = {name: column[changed] for name, column in columns.items()}
+            hashes = hashes[changed]
+        return columns, hashes
+
+    def process_columns(self, columns):  # noqa: C901
+        """
+        Vectorized ``process_row_common`` for a batch of columns. Returns the
+        value columns of the valid rows; ``self.valid`` is the mask of those rows.
+        """
+        identificatie = columns["identificatie"]
+        volgnummer = columns["volgnummer"].astype(np.int64)
+        ids = create_id_column(identificatie, volgnummer)
+        begin_geldigheid = csv.parse_date_column(columns["beginGeldigheid"])
+        eind_geldigheid = csv.parse_date_column(columns["eindGeldigheid"])
+        valid = ~(begin_geldigheid > eind_geldigheid)
+        for i in np.flatnonzero(~valid):
+            log.error(
+                f"{self.name.title()} {ids[i]} has invalid geldigheid {begin_geldigheid[i].tolist()} {eind_geldigheid[i].tolist()}; skipping"  # noqa: E501
+            )
+
+        values = {
+            "id": ids,
+            "identificatie": identificatie,
+            "volgnummer": volgnummer,
+            "begin_geldigheid": begin_geldigheid,
+            "eind_geldigheid": eind_geldigheid,
+            "registratiedatum": csv.parse_date_time_column(columns["registratiedatum"]),
+        }
+
+        if "geometrie" in columns:
+            wkt_geometrie = columns["geometrie"]
+            geometrie, rejected = ewkb.from_wkt_column(
+                wkt_geometrie, self.geotype, self.srid, mask=valid
+            )
+            for i in np.flatnonzero(rejected):
+                log.error(f"{self.name.title()} {ids[i]} has no valid geometry; skipping")
+            # Only log when is is the current entity
+            no_geometrie = ~wkt_geometrie.astype(bool)  # Empty or missing (None)
+            for i in np.flatnonzero(valid & no_geometrie & np.isnat(eind_geldigheid)):
+                log.warning(f"{self.name.title()} {ids[i]} has no geometry")
+            valid &= ~rejected
+            values["geometrie"] = geometrie
+
+        if "naam" in columns:
+            values["naam"] = columns["naam"]
+        if "code" in columns:
+            values["code"] = columns["code"]
+        if "documentdatum" in columns:
+            values["documentdatum"] = csv.parse_date_column(columns["documentdatum"])
+            values["documentnummer"] = columns["documentnummer"]
+
+        if "aanduidingInOnderzoek" in columns:
+            values["aanduiding_in_onderzoek"] = csv.parse_yesno_boolean_column(
+                columns["aanduidingInOnderzoek"]
+            )
+        if "geconstateerd" in columns:
+            values["geconstateerd"] = csv.parse_yesno_boolean_column(
+                columns["geconstateerd"]
+            )
+        if "status" in columns:
+            values["status"] = columns["status"]
+        if "type" in columns:
+            values["type"] = columns["type"]
+
+        if self.extra_fields:
+            rows = None
+            for k, l in self.extra_fields.items():
+                if isinstance(l, Column):
+                    values[k] = l.column(columns)
+                    continue
+                # Other functions need a row, like in process_row_common
+                if rows is None:
+                    names = list(columns)
+                    rows = {
+                        i: dict(zip(names, (columns[name][i] for name in names)))
+                        for i in np.flatnonzero(valid)
+                    }
+                values[k] = csv.object_column(
+                    [l(rows[i]) if i in rows else None for i in range(len(ids))]
+                )
+
+        for model_name in self.reference_models.keys():
+            fname = REFERENCE_FIELDS[model_name]
+            ref_identificatie = columns[f"{fname}.identificatie"]
+            ref_volgnummer = columns[f"{fname}.volgnummer"]
+            ref_volgnummer = np.where(ref_volgnummer == "", "1", ref_volgnummer).astype(
+                np.int64
+            )
+            id_rel = create_id_column(ref_identificatie, ref_volgnummer)
+            if self.validation == VALIDATION_MEMORY:
+                invalid = (
+                    valid
+                    & (ref_identificatie != "")
+                    & ~self.reference_models[model_name].contains_many(
+                        ref_identificatie, ref_volgnummer
+                    )
+                )
+                for i in np.flatnonzero(invalid):
+                    log.error(
+                        f"{self.name.title()} {ids[i]} has invalid id {id_rel[i]} for {model_name} ; skipping"  # noqa: E501
+                    )
+                self.count_no_ref += int(invalid.sum())
+                valid &= ~invalid
+            values[f"{model_name}_id"] = id_rel
+
+        self.log_progress(int(valid.sum()))
+        self.valid = valid
+        return {name: column[valid] for name, column in values.items()}
 
     def process_row_common(self, r):  # noqa: C901
         identificatie = r["identificatie"]
@@ -175,7 +994,8 @@ class ImportBagHTask(batch.BasicTask):
         if "geometrie" in r:
             wkt_geometrie = r["geometrie"]
             if wkt_geometrie:
-                geometrie = geo.get_geotype(wkt_geometrie, self.geotype)
+                # Straight to EWKB, without a GEOS geometry
+                geometrie = ewkb.from_wkt(wkt_geometrie, self.geotype, self.srid)
                 if not geometrie:
                     log.error(
                         f"{self.name.title()} {id1} has no valid geometry; skipping"
@@ -211,24 +1031,16 @@ class ImportBagHTask(batch.BasicTask):
             for k, l in self.extra_fields.items():
                 values[k] = l(r)
 
-        model_field_map = {
-            "gemeente": "ligtIn:BRK.GME",
-            "stadsdeel": "ligtIn:GBD.SDL",
-            "ggw_gebied": "ligtIn:GBD.GGW",
-            "wijk": "ligtIn:GBD.WIJK",
-            "buurt": "ligtIn:GBD.BRT",
-            "woonplaats": "ligtIn:BAG.WPS",
-            "openbare_ruimte": "ligtAan:BAG.ORE",
-            "ligplaats": "adresseert:BAG.LPS",
-            "standplaats": "adresseert:BAG.SPS",
-            "verblijfsobject": "adresseert:BAG.VOT",
-        }
         for model_name in self.reference_models.keys():
-            fname = model_field_map[model_name]
+            fname = REFERENCE_FIELDS[model_name]
             identificatie = r[f"{fname}.identificatie"]
-            volgnummer = r[f"{fname}.volgnummer"] or "1"
-            id_rel = create_id(identificatie, int(volgnummer))
-            if id_rel and id_rel not in self.reference_models[model_name]:
+            volgnummer = int(r[f"{fname}.volgnummer"] or "1")
+            id_rel = create_id(identificatie, volgnummer)
+            if (
+                id_rel
+                and self.validation == VALIDATION_MEMORY
+                and not self.reference_models[model_name].contains(identificatie, volgnummer)
+            ):
                 log.error(
                     f"{self.name.title()} {id1} has invalid id {id_rel} for {model_name} ; skipping"
                 )
@@ -239,43 +1051,109 @@ class ImportBagHTask(batch.BasicTask):
         self.log_progress()
         return values
 
+    def date_check_rows(self):
+        """
+        Query of the rows for the date checks: all staged rows, or (DATE_CHECKS_TOUCHED)
+        only the versions of the identificaties with a new or changed row. An incremental
+        import stages only the changed rows, the other versions are read from the table.
+        """
+        if self.date_checks != DATE_CHECKS_TOUCHED:
+            if self.previous_hashes is None:
+                return f"SELECT id, identificatie, begin_geldigheid, eind_geldigheid FROM {self.temp_table}"
+            checked = f"SELECT DISTINCT identificatie FROM {self.temp_table}"
+        else:
+            checked = f"""
+                SELECT DISTINCT t.identificatie FROM {self.temp_table} t
+                JOIN {self.diff_table} d ON d.id = t.id
+            """
+        rows = f"""
+            WITH checked AS ({checked})
+            SELECT t.id, t.identificatie, t.begin_geldigheid, t.eind_geldigheid
+            FROM {self.temp_table} t JOIN checked USING (identificatie)
+        """
+        if self.previous_hashes is not None:
+            # Only changed rows are staged; the other versions are in the table
+            rows += f"""
+            UNION ALL
+            SELECT e.id, e.identificatie, e.begin_geldigheid, e.eind_geldigheid
+            FROM {self.table} e JOIN checked USING (identificatie)
+            WHERE NOT EXISTS (SELECT 1 FROM {self.temp_table} t WHERE t.id = e.id)
+            """
+        return rows
+
     def do_date_checks(self):
         cursor = connection.cursor()
+        rows = self.date_check_rows()
         cursor.execute(
             f"""
-        SELECT identificatie, count(*)
-        FROM {self.temp_table}
-        WHERE eind_geldigheid IS NULL
-        GROUP BY identificatie HAVING count(*) > 1
-        """
+            SELECT identificatie, open, count(*) OVER ()
+            FROM (
+                SELECT identificatie, count(*) AS open
+                FROM ({rows}) r
+                WHERE eind_geldigheid IS NULL
+                GROUP BY identificatie HAVING count(*) > 1
+            ) m
+            ORDER BY identificatie
+            LIMIT {DATE_CHECK_SAMPLE}
+            """
         )
         multiple_endranges = cursor.fetchall()
         if len(multiple_endranges) > 0:
-            log.error(f"Multiple open eind_geldigheid for: {multiple_endranges}")
+            total = multiple_endranges[0][2]
+            sample = [(identificatie, open) for identificatie, open, _ in multiple_endranges]
+            log.error(f"Multiple open eind_geldigheid for {total} identificaties, e.g.: {sample}")
             return 1
 
-        # When checking for overlapping ranges we do not check for start_dates that are
-        # the same because that happens quite often
-        # the same because that happens quite often
+        # A version overlaps when it begins before the end of a version that began
+        # earlier. Versions that begin on the same day are not checked, because
+        # that happens quite often.
         cursor.execute(
-            f"""SELECT w1.id, w2.id FROM {self.temp_table} w1
-        JOIN {self.temp_table} w2 ON w1.identificatie = w2.identificatie
-        WHERE w1.volgnummer <> w2.volgnummer
-        AND  w1.begin_geldigheid > w2.begin_geldigheid
-        AND  (w1.begin_geldigheid < w2.eind_geldigheid OR w2.eind_geldigheid IS NULL)
-        """
+            f"""
+            SELECT id, begin_geldigheid, previous_eind, count(*) OVER ()
+            FROM (
+                SELECT id, begin_geldigheid, max(coalesce(eind_geldigheid, 'infinity'))
+                    OVER (
+                        PARTITION BY identificatie ORDER BY begin_geldigheid
+                        RANGE BETWEEN UNBOUNDED PRECEDING AND '1 day' PRECEDING
+                    ) AS previous_eind
+                FROM ({rows}) r
+                WHERE begin_geldigheid IS NOT NULL
+            ) w
+            WHERE begin_geldigheid < previous_eind
+            ORDER BY id
+            LIMIT {DATE_CHECK_SAMPLE}
+            """
         )
         overlapping_ranges = cursor.fetchall()
         if len(overlapping_ranges) > 0:
-            log.error(f"Overlapping date ranges for: {overlapping_ranges}")
+            total = overlapping_ranges[0][3]
+            sample = [(id, str(begin), str(eind)) for id, begin, eind, _ in overlapping_ranges]
+            log.error(f"Overlapping date ranges for {total} versions, e.g.: {sample}")
             # For now only notify
             return 0
         return 0
 
 
+def create_state_tables(cursor):
+    """
+    Creates the tables the import keeps its state in, when they do not exist.
+    Called once before the tasks run: CREATE TABLE IF NOT EXISTS is not safe
+    when tasks run it at the same time (--workers), it can fail with a unique
+    violation in pg_type.
+    """
+    ledger.create_tables(cursor)
+    hashdiff.create_table(cursor)
+    rejects.create_table(cursor)
+    indexes.create_table(cursor)
+
+
 class CreateBagHTables(batch.BasicTask):
     name = "create_tables"
 
+    def __init__(self, *args, **kwargs):
+        self.models = kwargs["models"]
+        self.defer_indexes = kwargs.get("defer_indexes", settings.IMPORT_DEFER_INDEXES)
+
     def process(self):
         processed = 0
         with open("dso_import/bagh/bagh_create.sql", "r") as sql_file:
@@ -284,9 +1162,30 @@ class CreateBagHTables(batch.BasicTask):
                     if sql and not sql.isspace():
                         c.execute(sql)
                         processed += 1
+                # The tables are empty now, so nothing has been imported
+                ledger.clear(c)
+                hashdiff.clear(c)
+                if self.defer_indexes:
+                    # Rebuilt by RebuildIndexesTask, after all rows are loaded
+                    indexes.defer(c, [table.db_table for table in self.models.tables()])
         log.info(f"Processed {processed} statements")
 
 
+class RebuildIndexesTask(batch.BasicTask):
+    """
+    Rebuilds the indexes and foreign keys that CreateBagHTables deferred, also
+    those left by a failed import
+    """
+
+    name = "rebuild_indexes"
+
+    def __init__(self, *args, **kwargs):
+        self.index_workers = kwargs.get("index_workers", settings.IMPORT_INDEX_WORKERS)
+
+    def process(self):
+        indexes.rebuild(self.index_workers, settings.IMPORT_MAINTENANCE_WORK_MEM)
+
+
 class ImportGemeenteTask(ImportBagHTask):
     """
     Gemeente is not delivered by GOB. So we hardcode gemeente Amsterdam data
@@ -302,19 +1201,26 @@ class ImportGemeenteTask(ImportBagHTask):
 
     def process(self):
         gemeentes = [
-            self.model(
-                id=f"{r[0]}_{r[1]:03}",
-                identificatie=r[0],
-                volgnummer=r[1],
-                registratiedatum=r[2],
-                begin_geldigheid=r[3],
-                eind_geldigheid=r[4] or None,
-                naam=r[5],
-                verzorgingsgebied=r[6] == "J",
+            self.as_row(
+                dict(
+                    id=f"{r[0]}_{r[1]:03}",
+                    identificatie=r[0],
+                    volgnummer=r[1],
+                    registratiedatum=r[2],
+                    begin_geldigheid=r[3],
+                    eind_geldigheid=r[4] or None,
+                    naam=r[5],
+                    verzorgingsgebied=r[6] == "J",
+                )
             )
             for r in self.data
         ]
-        self.model.objects.bulk_create(gemeentes, batch_size=100)
+        # The dates are strings, which INSERT converts (binary COPY would not)
+        gemeente_writer = writer.TableWriter.for_table(
+            self.models.table(self.name), self.temp_table, method=writer.WRITE_INSERT
+        )
+        with self.metrics.stage("write"):
+            gemeente_writer.write(gemeentes)
 
 
 class ImportWoonplaatsTask(ImportBagHTask):
@@ -366,70 +1272,161 @@ class ImportVerblijfsobjectTask(ImportBagHTask):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.pandrelatiemodel = self.models["verblijfsobjectpandrelatie"]
-        self.pandrelatie_table = self.pandrelatiemodel._meta.db_table
+        self.pandrelatie_table = self.models.table("verblijfsobjectpandrelatie").db_table
         self.pandrelatie_temp_table = f"{self.__class__.dataset}_pr_temp"
-        self.pandrelatie = defaultdict(list)
-        self.pandrelatie_count = 0
-        self.panden = set()
+        self.pandrelaties = None
+        # Sink the relations are added to while the rows are transformed
+        self.collected_pandrelaties = None
+        self.panden = ReferenceIndex()
 
     def before(self):
+        if self.job_state is not None or self.sharded:
+            self.pandrelatie_temp_table = f"{self.pandrelatie_table}_staging"
         super().before()
-        self.panden = set(self.models["pand"].objects.values_list("id", flat=True))
-        cursor = connection.cursor()
-        cursor.execute(f"DROP TABLE IF EXISTS {self.pandrelatie_temp_table}")
-        cursor.execute(
-            f"CREATE TEMPORARY TABLE {self.pandrelatie_temp_table} AS TABLE {self.pandrelatie_table} WITH NO DATA"
+        if not self.unchanged and self.validation == VALIDATION_MEMORY:
+            self.panden = self.load_reference_index("pand")
+        # When checkpointing they are written with the range they belong to
+        self.pandrelaties = RelationSink(
+            self.pandrelatie_temp_table,
+            "verblijfsobject_id",
+            "pand_id",
+            auto_flush=not self.checkpointing,
+            metrics=self.metrics,
         )
-        self.pandrelatiemodel._meta.db_table = self.pandrelatie_temp_table
+        self.collected_pandrelaties = self.pandrelaties
+        if self.pipelining:
+            # The pipeline thread only collects them; they are passed on with the rows
+            self.collected_pandrelaties = RelationSink(
+                self.pandrelatie_temp_table, "verblijfsobject_id", "pand_id", auto_flush=False
+            )
+
+    def staging_tables(self):
+        return super().staging_tables() + [(self.pandrelatie_temp_table, self.pandrelatie_table)]
 
     def after(self):
-        self.save_pandrelatie()
+        self.pandrelaties.flush()
         super().after()
-        cursor = connection.cursor()
-        with transaction.atomic():
+
+    def reject_orphans(self, cursor):
+        super().reject_orphans(cursor)
+        # Relations of rejected verblijfsobjecten
+        cursor.execute(
+            f"""
+            DELETE FROM {self.pandrelatie_temp_table} r
+            WHERE NOT EXISTS (SELECT 1 FROM {self.temp_table} t WHERE t.id = r.verblijfsobject_id)
+            """
+        )
+        rejected = rejects.reject_orphans(
+            cursor,
+            self.pandrelatie_table,
+            self.pandrelatie_temp_table,
+            "pand_id",
+            self.models.table("pand").db_table,
+        )
+        if rejected:
+            log.error(
+                f"{self.name.title()}: {len(rejected)} relations with invalid pand_id;"
+                f" see {rejects.REJECT_TABLE}"
+            )
+
+    def merge(self, cursor):
+        super().merge(cursor)
+        if self.previous_hashes is not None:
+            # Only the relations of the staged verblijfsobjecten are replaced
+            cursor.execute(
+                f"""
+                DELETE FROM {self.pandrelatie_table}
+                WHERE verblijfsobject_id IN (SELECT id FROM {self.temp_table})
+                """
+            )
+        else:
             cursor.execute(f"TRUNCATE {self.pandrelatie_table}")
-            cursor.execute(f"INSERT INTO  {self.pandrelatie_table} SELECT * FROM {self.pandrelatie_temp_table}")
-        self.pandrelatiemodel._meta.db_table = self.pandrelatie_table
+        cursor.execute(f"INSERT INTO  {self.pandrelatie_table} SELECT * FROM {self.pandrelatie_temp_table}")
+
+    def build_tables(self, cursor):
+        definitions = super().build_tables(cursor)
+        definitions.append(
+            self.build_table(
+                cursor,
+                self.pandrelatie_table,
+                self.pandrelatie_temp_table,
+                key="verblijfsobject_id",
+                replaced=f"SELECT id FROM {self.temp_table}",
+                # Like merge: only the relations of the staged verblijfsobjecten are replaced
+                keep_existing=self.previous_hashes is not None,
+            )
+        )
+        return definitions
+
+    def cleanup(self):
+        super().cleanup()
+        if self.publish == PUBLISH_SWAP:
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {swap.new_name(self.pandrelatie_table)}")
+        if self.pandrelaties is not None:
+            log.info(f"{self.name.title()}: {self.pandrelaties.count} pandrelaties")
+            self.pandrelaties = None
+            self.collected_pandrelaties = None
         self.panden.clear()
 
-    def gen_pand_vbo_objects(self):
-            for pand_id, vbo_ids in self.pandrelatie.items():
-                for vbo_id in vbo_ids:
-                    id1 = f"{vbo_id}_{pand_id}"
-                    yield self.pandrelatiemodel(id=id1, verblijfsobject_id=vbo_id, pand_id=pand_id)
+    def batch_written(self):
+        self.pandrelaties.flush_full()
 
-    def save_pandrelatie(self):
-        entries = self.gen_pand_vbo_objects()
-        self.pandrelatiemodel.objects.bulk_create(entries, batch_size=batch.BATCH_SIZE)
-        self.pandrelatie.clear()
-        self.pandrelatie_count = 0
+    def save_related(self):
+        self.pandrelaties.flush()
 
-    def process_row(self, r):
-        result = super().process_row(r)
+    def process_row_common(self, r):
+        result = super().process_row_common(r)
         if result:
-            id = result.id
-            pand_identificaties = r["ligtIn:BAG.PND.identificatie"] or None
-            if pand_identificaties:
-                pand_identificaties = pand_identificaties.split("|")
-                pand_volgnummers = r["ligtIn:BAG.PND.volgnummer"].split("|")
-                for i in range(len(pand_identificaties)):
-                    pand_id = create_id(
-                        pand_identificaties[i], int(pand_volgnummers[i])
-                    )
-                    if pand_id not in self.panden:
-                        log.error(
-                            f"{self.name.title()} {id} has invalid pand_id {pand_id} ; skipping"
-                        )
-                    else:
-                        self.pandrelatie[pand_id].append(id)
-                        self.pandrelatie_count += 1
-                        if self.pandrelatie_count >= batch.BATCH_SIZE:
-                            self.save_pandrelatie()
-                            log.info("saving pandrelaties")
-
+            self.add_pandrelaties(
+                result["id"], r["ligtIn:BAG.PND.identificatie"], r["ligtIn:BAG.PND.volgnummer"]
+            )
         return result
 
+    def process_columns(self, columns):
+        values = super().process_columns(columns)
+        for id, pand_identificaties, pand_volgnummers in zip(
+            values["id"].tolist(),
+            columns["ligtIn:BAG.PND.identificatie"][self.valid].tolist(),
+            columns["ligtIn:BAG.PND.volgnummer"][self.valid].tolist(),
+        ):
+            self.add_pandrelaties(id, pand_identificaties, pand_volgnummers)
+        return values
+
+    def add_pandrelaties(self, id, pand_identificaties, pand_volgnummers):
+        self.add_relations(
+            self.collected_pandrelaties, id, pand_identificaties, pand_volgnummers, self.panden, "pand_id"
+        )
+
+    def init_shard(self, shard):
+        super().init_shard(shard)
+        self.pandrelaties = self.collected_pandrelaties = RelationSink(
+            sharding.shard_table(self.pandrelatie_temp_table, shard),
+            "verblijfsobject_id",
+            "pand_id",
+            metrics=self.metrics,
+        )
+
+    def pop_related(self):
+        return self.collected_pandrelaties.pop()
+
+    def push_related(self, related):
+        self.pandrelaties.extend(related)
+
+    def init_worker(self):
+        super().init_worker()
+        self.pandrelaties.auto_flush = False
+        self.pandrelaties.pop()
+
+    def pop_worker_state(self):
+        state = super().pop_worker_state()
+        state["pandrelaties"] = self.pandrelaties.pop()
+        return state
+
+    def merge_worker_state(self, state):
+        super().merge_worker_state(state)
+        self.pandrelaties.extend(state["pandrelaties"])
+
 
 class ImportNummeraanduidingTask(ImportBagHTask):
     name = "nummeraanduiding"
@@ -439,7 +1436,7 @@ class ImportBagHJob(batch.BasicJob):
     name = "Import BAGH"
 
     def __init__(self, **kwargs):
-        data_dir = settings.DATA_DIR
+        data_dir = kwargs.get("data_dir", settings.DATA_DIR)
         if not os.path.exists(data_dir):
             raise ValueError("DATA_DIR not found: {}".format(data_dir))
 
@@ -448,66 +1445,92 @@ class ImportBagHJob(batch.BasicJob):
         # noqa: E501 See : https://gis.stackexchange.com/questions/195862/preserving-special-chars-using-osgeo-ogr-driver-to-shapefile-in-python
         os.environ["SHAPE_ENCODING"] = "utf-8"
 
-        dataset = Dataset.objects.get(name="bagh")
-        self.models = {
-            model._meta.model_name: model for model in dataset.create_models()
-        }
+        # Options passed on to every task, e.g. processes
+        self.options = kwargs
+
+        self.models = schema.DatasetModels("bagh", settings.IMPORT_SCHEMA_CACHE_DIR)
 
     def __del__(self):
         os.environ.pop("SHAPE_ENCODING", None)
 
+    def prepare(self, tasks):
+        """
+        Downloads the source files of all tasks in the background, so the
+        download of the next task overlaps the current one (see ``pipeline``)
+        """
+        with connection.cursor() as cursor:
+            create_state_tables(cursor)
+        workers = self.options.get("prefetch_workers", settings.IMPORT_PREFETCH_WORKERS)
+        source_files = [
+            task.source_file
+            for task in tasks
+            if isinstance(task, ImportBagHTask) and task.path and task.download
+        ]
+        if workers and source_files:
+            prefetch(source_files, workers, target_root=self.data_dir)
+
     def tasks(self):
         return [
-            CreateBagHTables(),
+            CreateBagHTables(models=self.models, **self.options),
             # no-dependencies.
-            ImportGemeenteTask(models=self.models),
+            ImportGemeenteTask(models=self.models, **self.options),
             ImportWoonplaatsTask(
-                path=self.data_dir, models=self.models, use=["gemeente"]
+                path=self.data_dir,
+                models=self.models,
+                use=["gemeente"],
+                **self.options,
             ),
             ImportStadsdeelTask(
                 path=self.data_dir,
                 models=self.models,
                 gob_path="gebieden",
                 references=["gemeente"],
+                **self.options,
             ),
             ImportGgwGebied(
                 path=self.data_dir,
                 models=self.models,
                 gob_path="gebieden",
                 references=["stadsdeel"],
+                **self.options,
             ),
             ImportGgwPraktijkGebied(
                 path=self.data_dir,
                 models=self.models,
                 gob_path="gebieden",
                 references=["stadsdeel"],
+                **self.options,
             ),
             ImportWijkTask(
                 path=self.data_dir,
                 models=self.models,
                 gob_path="gebieden",
                 references=["stadsdeel", "ggw_gebied"],
-                extra_fields={"cbs_code": lambda r: r["cbsCode"], },
+                extra_fields={"cbs_code": Column("cbsCode")},
+                **self.options,
             ),
             ImportBuurtTask(
                 path=self.data_dir,
                 models=self.models,
                 gob_path="gebieden",
                 references=["wijk", "ggw_gebied", "stadsdeel"],
-                extra_fields={"cbs_code": lambda r: r["cbsCode"], },
+                extra_fields={"cbs_code": Column("cbsCode")},
+                **self.options,
             ),
             ImportBouwblokTask(
                 path=self.data_dir,
                 models=self.models,
                 gob_path="gebieden",
                 references=["buurt"],
+                **self.options,
             ),
             ImportOpenbareRuimteTask(
                 path=self.data_dir,
                 models=self.models,
                 gob_path="bag",
                 references=["woonplaats"],
-                extra_fields={"naam_nen": lambda r: r["naamNEN"], },
+                extra_fields={"naam_nen": Column("naamNEN")},
+                **self.options,
             ),
             ImportLigplaatsTask(
                 path=self.data_dir,
@@ -515,6 +1538,7 @@ class ImportBagHJob(batch.BasicJob):
                 gob_path="bag",
                 geotype="polygon",
                 references=["buurt"],
+                **self.options,
             ),
             ImportStandplaatsTask(
                 path=self.data_dir,
@@ -522,12 +1546,14 @@ class ImportBagHJob(batch.BasicJob):
                 gob_path="bag",
                 geotype="polygon",
                 references=["buurt"],
+                **self.options,
             ),
             ImportPandTask(
                 path=self.data_dir,
                 models=self.models,
                 gob_path="bag",
                 geotype="polygon",
+                **self.options,
             ),
             ImportVerblijfsobjectTask(
                 path=self.data_dir,
@@ -535,39 +1561,9 @@ class ImportBagHJob(batch.BasicJob):
                 gob_path="bag",
                 geotype="point",
                 references=["buurt"],
-                extra_fields={
-                    "oppervlakte": lambda r: int_or_none(r["oppervlakte"]),
-                    "verdieping_toegang": lambda r: int_or_none(
-                        r["verdiepingToegang"]
-                    ),
-                    "hoogste_bouwlaag": lambda r: int_or_none(r["hoogsteBouwlaag"]),
-                    "laagste_bouwlaag": lambda r: int_or_none(r["laagsteBouwlaag"]),
-                    "aantal_kamers": lambda r: int_or_none(r["aantalKamers"]),
-                    "eigendomsverhouding": lambda r: r["eigendomsverhouding"],
-                    "gebruiksdoel": lambda r: r["gebruiksdoel"].split("|"),
-                    "gebruiksdoel_woonfunctie": lambda r: r[
-                                                              "gebruiksdoelWoonfunctie"
-                                                          ]
-                                                          or None,
-                    "gebruiksdoel_gezondheidszorgfunctie": lambda r: r[
-                                                                         "gebruiksdoelGezondheidszorgfunctie"
-                                                                     ]
-                                                                     or None,
-                    "toegang": lambda r: r["toegang"].split("|")
-                    if r["toegang"]
-                    else [],
-                    "redenopvoer": lambda r: r["redenopvoer"] or None,
-                    "redenafvoer": lambda r: r["redenopvoer"] or None,
-                    "heeftin_hoofdadres_id": lambda r: create_id(
-                        r["heeftIn:BAG.NAG.identificatieHoofdadres"],
-                        int_or_none(r["heeftIn:BAG.NAG.volgnummerHoofdadres"]),
-                    ),
-                    "heeftin_nevenadres_id": lambda r: create_ids(
-                        r,
-                        "heeftIn:BAG.NAG.identificatieNevenadres",
-                        "heeftIn:BAG.NAG.volgnummerNevenadres",
-                    ),
-                },
+                use=["pand"],
+                extra_fields=VERBLIJFSOBJECT_FIELDS,
+                **self.options,
             ),
             # large. 500.000
             ImportNummeraanduidingTask(
@@ -580,13 +1576,8 @@ class ImportBagHJob(batch.BasicJob):
                     "verblijfsobject",
                     "openbare_ruimte",
                 ],
-                extra_fields={
-                    "huisnummer": lambda r: r["huisnummer"],
-                    "huisletter": lambda r: r["huisletter"] or None,
-                    "huisnummer_toevoeging": lambda r: r["huisnummertoevoeging"]
-                                                       or None,
-                    "postcode": lambda r: r["postcode"],
-                    "type_adres": lambda r: r["typeAdres"],
-                },
+                extra_fields=NUMMERAANDUIDING_FIELDS,
+                **self.options,
             ),
+            RebuildIndexesTask(**self.options),
         ]
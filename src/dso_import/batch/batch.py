@@ -1,10 +1,14 @@
-import gc
+import json
 import logging
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
 
-log = logging.getLogger(__name__)
+from django.db import connection
+
+from dso_import.batch import jobstate, metrics, profiling
 
-BATCH_SIZE = 50000
+log = logging.getLogger(__name__)
 
 
 class BasicJob:
@@ -15,8 +19,34 @@ class BasicJob:
     def tasks(self) -> list:
         pass
 
+    def prepare(self, tasks: list):
+        """Called with the tasks that are going to be executed, before the first one starts"""
+        pass
+
 
-def execute(job: BasicJob, start: str = None):
+def execute(
+    job: BasicJob,
+    start: str = None,
+    workers: int = 1,
+    checkpoint: bool = False,
+    resume: bool = False,
+    metrics_file: str = None,
+    metrics_textfile: str = None,
+    profiler: profiling.Profiler = None,
+):
+    """
+    Executes the tasks of a job, from the task named ``start``.
+
+    :param checkpoint: record finished tasks, and the progress of tasks that
+        support it, in ``import_job_state``
+    :param resume: skip the tasks that finished in an earlier, interrupted run;
+        otherwise the state of that run is discarded
+    :param metrics_file: path to write the metrics report to, as JSON
+    :param metrics_textfile: path to write the metrics to in the Prometheus
+        textfile format
+    :param profiler: profiles the tasks it selects, see ``profiling.Profiler``
+    :return: the metrics report, see ``metrics.report``
+    """
     log.info("Starting job: %s [%s]", job.name, job.__class__.__name__)
     tasks = job.tasks()
     if start:
@@ -24,13 +54,116 @@ def execute(job: BasicJob, start: str = None):
         start_index = start_indices[start]
         tasks = tasks[start_index:]
 
-    for task in tasks:
-        _execute_task(task)
-
+    state = None
+    if checkpoint:
+        state = jobstate.JobState(job.name)
+        if resume:
+            finished = state.finished_tasks()
+            if finished:
+                log.info("Resuming job, finished before: %s", ", ".join(sorted(finished)))
+            tasks = [task for task in tasks if _task_name(task) not in finished]
+        else:
+            state.clear()
+        for task in tasks:
+            if isinstance(task, BasicTask):
+                task.job_state = state
+    if profiler is not None:
+        for task in tasks:
+            if isinstance(task, BasicTask) and profiler.profiles(task.name):
+                task.profiler = profiler
+
+    started = time.perf_counter()
+    status = "failed"
+    try:
+        job.prepare(tasks)
+        if workers > 1:
+            _execute_parallel(tasks, workers, state)
+        else:
+            for task in tasks:
+                _execute_task(task, state)
+        status = "finished"
+    finally:
+        report = _report(
+            job, tasks, time.perf_counter() - started, status, metrics_file, metrics_textfile
+        )
+
+    if state is not None:
+        state.clear()
     log.info("Finished job: %s: [%s]", job.name, job.__class__.__name__)
+    return report
+
+
+def _report(job, tasks, elapsed, status, metrics_file, metrics_textfile):
+    task_metrics = [task.metrics for task in tasks if getattr(task, "metrics", None)]
+    report = metrics.report(job.name, task_metrics, elapsed, status)
+    log.info("Metrics: %s", json.dumps(report))
+    if metrics_file:
+        metrics.write_json(report, metrics_file)
+    if metrics_textfile:
+        metrics.write_textfile(report, metrics_textfile)
+    return report
 
 
-def _execute_task(task):
+def _task_name(task):
+    return getattr(task, "name", None) or task.__name__
+
+
+def _dependencies(tasks):
+    """
+    Returns for every task the set of indices of the tasks it has to wait for.
+
+    A task that declares ``depends_on`` waits for the named tasks that precede it
+    in the list. Names that are not in the list (e.g. skipped with ``start``)
+    are considered done. A task without ``depends_on`` acts as a barrier:
+    it waits for all preceding tasks, and all following tasks wait for it.
+    """
+    result = []
+    indices = {}
+    barrier = None
+    for i, task in enumerate(tasks):
+        depends_on = getattr(task, "depends_on", None)
+        if depends_on is None:
+            result.append(set(range(i)))
+            barrier = i
+        else:
+            dependencies = {indices[name] for name in depends_on if name in indices}
+            if barrier is not None:
+                dependencies.add(barrier)
+            result.append(dependencies)
+        indices[_task_name(task)] = i
+    return result
+
+
+def _execute_parallel(tasks, workers, state=None):
+    """
+    Runs tasks on a pool of worker threads, starting every task as soon
+    as all of its dependencies are finished.
+    """
+    dependencies = _dependencies(tasks)
+    pending = dict(enumerate(tasks))
+    running = {}
+    done = set()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            for i in sorted(pending):
+                if len(running) < workers and dependencies[i] <= done:
+                    running[pool.submit(_execute_task_in_thread, pending.pop(i), state)] = i
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                i = running.pop(future)
+                future.result()  # Stop scheduling when a task failed
+                done.add(i)
+
+
+def _execute_task_in_thread(task, state=None):
+    try:
+        _execute_task(task, state)
+    finally:
+        # Every worker thread has its own database connection
+        connection.close()
+
+
+def _execute_task(task, state=None):
 
     if callable(task):
         task_name = task.__name__
@@ -42,6 +175,8 @@ def _execute_task(task):
     log.debug("Starting task: %s", task_name)
 
     execute_func()
+    if state is not None:
+        state.finish(_task_name(task))
 
 
 class BasicTask:
@@ -55,21 +190,45 @@ class BasicTask:
     """
 
     name = "Basic Task"
+    # Names of the tasks that have to be finished before this one can start.
+    # None means: all preceding tasks of the job (see ``execute``).
+    depends_on = None
     count = 0
-    prev_time = time.time()
+    prev_time = None
+    _metrics = None
+    # JobState of the running job, when it is checkpointed (see ``execute``)
+    job_state = None
+    profiler = None
+
+    @property
+    def metrics(self) -> metrics.TaskMetrics:
+        if self._metrics is None:
+            self._metrics = metrics.TaskMetrics(self.name)
+        return self._metrics
 
     def execute(self):
-        self.before()
-        self.process()
-        self.after()
-        gc.collect()
-
-    def log_progress(self):
-        self.count += 1
+        with self.metrics.task_timer(), self.profiled():
+            self.before()
+            self.process()
+            self.after()
+        self.metrics.rows = self.count
+
+    def profiled(self):
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.profile(self.name, self.metrics)
+
+    def log_progress(self, count=1):
+        self.count += count
         now_time = time.time()
-        if now_time - self.prev_time > 10.0:  # Report every 10 seconds
+        if self.prev_time is None:
+            self.prev_time = now_time
+        elif now_time - self.prev_time > 10.0:  # Report every 10 seconds
             self.prev_time = now_time
-            log.debug(f"{self.name} processed {self.count}...")
+            log.debug(
+                f"{self.name} processed {self.count}"
+                f" ({self.count / self.metrics.running_seconds():.0f} rows/s)..."
+            )
 
     def before(self):
         pass
@@ -0,0 +1,62 @@
+"""
+Batch sizes that adapt to the rows being written.
+
+A fixed number of rows per batch is too much for tables with large polygons
+and needlessly small for tables with a few short columns. ``BatchSize``
+sizes the next batch from what the earlier batches of the same table
+measured: the average size of a row, so a batch stays within a byte budget,
+and the rows written per second, so a batch takes about ``target_seconds``.
+"""
+from dso_import import settings
+
+MIN_ROWS = 1000
+MAX_ROWS = 500000
+INITIAL_ROWS = MIN_ROWS
+# Weight of the last batch in the moving averages
+SMOOTHING = 0.3
+# A batch is at most this many times larger than the one before
+MAX_GROWTH = 2
+
+
+class BatchSize:
+    """
+    :param budget_bytes: upper bound for the encoded size of a batch
+    :param target_seconds: time a batch should take to write
+    """
+
+    def __init__(
+        self,
+        budget_bytes=None,
+        target_seconds=None,
+        min_rows=MIN_ROWS,
+        max_rows=MAX_ROWS,
+        initial_rows=INITIAL_ROWS,
+    ):
+        self.budget_bytes = budget_bytes or settings.IMPORT_BATCH_BYTES
+        self.target_seconds = target_seconds or settings.IMPORT_BATCH_SECONDS
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.rows = initial_rows
+        self.row_bytes = None
+        self.rows_per_second = None
+
+    def record(self, rows, nbytes, seconds):
+        """Records a written batch and sizes the next one"""
+        if not rows:
+            return
+        self.row_bytes = _average(self.row_bytes, nbytes / rows)
+        if seconds > 0:
+            self.rows_per_second = _average(self.rows_per_second, rows / seconds)
+        size = self.max_rows
+        if self.row_bytes:
+            size = min(size, self.budget_bytes / self.row_bytes)
+        if self.rows_per_second:
+            size = min(size, self.target_seconds * self.rows_per_second)
+        size = min(size, MAX_GROWTH * self.rows)
+        self.rows = max(self.min_rows, min(self.max_rows, int(size)))
+
+
+def _average(average, value):
+    if average is None:
+        return value
+    return SMOOTHING * value + (1 - SMOOTHING) * average
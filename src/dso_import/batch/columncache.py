@@ -0,0 +1,127 @@
+"""
+Local cache of the source CSV files in the Arrow IPC file format.
+
+A CSV file is parsed once into compressed record batches of string columns,
+keyed by the etag of the object it was downloaded from (or, for local files,
+its size and modification time). Later runs read the columns from the
+memory-mapped cache file instead of parsing the CSV again.
+
+Every record batch belongs to a byte range of the CSV file (see
+``csv.row_ranges``); the end offset of the range is stored in the column
+``END_COLUMN``, so checkpoints keep their byte offsets whether a file is read
+from the cache or not.
+
+Needs pyarrow; an import with the column cache fails without it.
+"""
+import glob
+import logging
+import os
+from itertools import groupby
+
+from dso_import.batch import csv
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+log = logging.getLogger(__name__)
+
+SUFFIX = ".arrow"
+COMPRESSION = "zstd"
+END_COLUMN = "__end__"
+
+
+def available():
+    return pa is not None
+
+
+def cache_key(value):
+    """A file name safe version of an etag or a source version"""
+    return "".join(c if c.isalnum() else "-" for c in value.strip('"'))
+
+
+class CachedColumns:
+    """The record batches of a cache file, memory-mapped"""
+
+    def __init__(self, path):
+        self.path = path
+        self.reader = pa.ipc.open_file(pa.memory_map(path))
+        self.names = [name for name in self.reader.schema.names if name != END_COLUMN]
+
+    def _batch(self, i):
+        batch = self.reader.get_batch(i)
+        columns = {
+            name: batch.column(name).to_numpy(zero_copy_only=False) for name in self.names
+        }
+        return batch.column(END_COLUMN)[0].as_py(), columns
+
+    def _batches(self):
+        return (self._batch(i) for i in range(self.reader.num_record_batches))
+
+    def ends(self):
+        """End offsets of the byte ranges; only their column is read"""
+        options = pa.ipc.IpcReadOptions(
+            included_fields=[self.reader.schema.get_field_index(END_COLUMN)]
+        )
+        reader = pa.ipc.open_file(pa.memory_map(self.path), options=options)
+        return {
+            reader.get_batch(i).column(0)[0].as_py() for i in range(reader.num_record_batches)
+        }
+
+    def batches(self):
+        """Batches of columns, like ``csv._column_batches``"""
+        return (columns for _, columns in self._batches())
+
+    def ranges(self, start=None):
+        """Yields ``(end offset, batches of columns)`` per byte range after ``start``"""
+        for end, batches in groupby(self._batches(), key=lambda item: item[0]):
+            if start is None or end > start:
+                yield end, [columns for _, columns in batches]
+
+
+def _write(source, path, quotechar, encoding, chunk_bytes, batch_size):
+    fieldnames = csv.header(source, quotechar, encoding)
+    schema = pa.schema(
+        [(name, pa.string()) for name in fieldnames] + [(END_COLUMN, pa.int64())]
+    )
+    options = pa.ipc.IpcWriteOptions(compression=COMPRESSION)
+    temp_path = f"{path}.tmp"
+    with pa.OSFile(temp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, schema, options=options) as writer:
+            for start, end in csv.row_ranges(source, chunk_bytes):
+                batches = csv.range_columns(
+                    source, start, end, fieldnames, quotechar, encoding, batch_size
+                )
+                for columns in batches:
+                    length = len(columns[fieldnames[0]])
+                    arrays = [pa.array(columns[name], type=pa.string()) for name in fieldnames]
+                    arrays.append(pa.repeat(pa.scalar(end, pa.int64()), length))
+                    writer.write_batch(pa.record_batch(arrays, schema=schema))
+    os.replace(temp_path, path)
+
+
+def cached_columns(
+    directory,
+    path,
+    file_name,
+    key,
+    quotechar='"',
+    encoding=csv.GOB_CSV_ENCODING,
+    chunk_bytes=csv.CHUNK_BYTES,
+    batch_size=csv.COLUMN_BATCH_SIZE,
+):
+    """
+    Returns the ``CachedColumns`` of a CSV file. The cache file is written
+    when there is none for ``key``; cache files of other versions are removed.
+    """
+    os.makedirs(directory, exist_ok=True)
+    cache_path = os.path.join(directory, f"{file_name}.{cache_key(key)}{SUFFIX}")
+    if not os.path.exists(cache_path):
+        for stale in glob.glob(os.path.join(directory, f"{glob.escape(file_name)}.*{SUFFIX}")):
+            os.remove(stale)
+        log.info(f"Caching the columns of {file_name} in {cache_path}")
+        _write(
+            os.path.join(path, file_name), cache_path, quotechar, encoding, chunk_bytes, batch_size
+        )
+    return CachedColumns(cache_path)
@@ -1,13 +1,29 @@
 import csv
 from datetime import datetime, date
+import io
 import logging
+import multiprocessing
 import os
+import threading
+from collections import deque
 from contextlib import contextmanager
+from itertools import chain, islice
+
+import numpy as np
+
+from dso_import.batch import sharding
 
 log = logging.getLogger(__name__)
 
 GOB_CSV_ENCODING = "utf-8-sig"
 
+CHUNK_BYTES = 8 * 1024 * 1024
+COLUMN_BATCH_SIZE = 50000
+
+# State for the worker processes of process_csv_parallel, inherited by fork
+_worker = {}
+_fork_lock = threading.Lock()
+
 
 def parse_date_time(s):
     if not s:
@@ -34,6 +50,51 @@ def is_valid_date_range(start, end):
     return end is None or start <= end
 
 
+def object_column(values):
+    """Numpy object array of arbitrary values (also lists) without broadcasting"""
+    column = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        column[i] = value
+    return column
+
+
+def parse_date_column(column):
+    """Vectorized ``parse_date``; returns a datetime64[D] array with NaT for empty values"""
+    column = np.asarray(column, dtype="U10")
+    return np.where(column == "", "NaT", column).astype("datetime64[D]")
+
+
+def parse_date_time_column(column):
+    """
+    Vectorized ``parse_date_time``; returns an object array of date / datetime values.
+    Values numpy can not parse (e.g. with a utc offset) are parsed one by one.
+    """
+    text = np.asarray(column, dtype=str)
+    with_offset = (
+        (np.char.find(text, "+", 10) >= 0)
+        | (np.char.rfind(text, "-") >= 10)
+        | np.char.endswith(text, "Z")
+    )
+    try:
+        if with_offset.any():
+            raise ValueError("datetime64 has no timezones")
+        parsed = np.where(text == "", "NaT", text).astype("datetime64[us]")
+    except ValueError:
+        return object_column([parse_date_time(s) for s in column])
+    result = object_column(parsed.tolist())
+    dates = np.char.str_len(text) == 10
+    result[dates] = parsed[dates].astype("datetime64[D]").tolist()
+    return result
+
+
+def parse_yesno_boolean_column(column):
+    """Vectorized ``parse_yesno_boolean``; returns an object array of True, False and None"""
+    column = np.asarray(column, dtype=object)
+    return np.select(
+        [(column == "J") | (column == "Y"), column == "N"], [True, False], None
+    ).astype(object)
+
+
 @contextmanager
 def _context_reader(
     source, quotechar=None, quoting=csv.QUOTE_NONE, encoding=GOB_CSV_ENCODING,
@@ -61,6 +122,59 @@ def logging_callback(source_path, original_callback):
     return result
 
 
+def _column_batches(rows, batch_size):
+    """Groups rows (lists) in batches of columns: a dict name -> numpy object array"""
+    header = next(rows)
+    width = len(header)
+    while True:
+        batch = [row for row in islice(rows, batch_size) if row]
+        if not batch:
+            break
+        if any(len(row) != width for row in batch):
+            # Same as csv.DictReader: missing values are None, extra values are ignored
+            batch = [(row + [None] * width)[:width] for row in batch]
+        yield {
+            name: np.array(values, dtype=object)
+            for name, values in zip(header, zip(*batch))
+        }
+
+
+def _file_columns(source, quotechar, encoding, batch_size):
+    with open(source, encoding=encoding) as f:
+        rows = csv.reader(f, delimiter=";", quotechar=quotechar, quoting=csv.QUOTE_MINIMAL)
+        yield from _column_batches(rows, batch_size)
+
+
+def process_csv_columns(
+    path,
+    file_name,
+    process_batch_callback,
+    quotechar='"',
+    encoding="utf-8-sig",
+    batch_size=COLUMN_BATCH_SIZE,
+    cached=None,
+):
+    """
+    Columnar variant of ``process_csv``: the callback gets batches of columns
+    (a dict of numpy object arrays keyed by the header names) and returns a
+    list of results, which are yielded one by one.
+
+    :param cached: ``columncache.CachedColumns`` of the file, read instead of the file
+    """
+    source = os.path.join(path, file_name)
+    if cached is not None:
+        batches = cached.batches()
+    else:
+        batches = _file_columns(source, quotechar, encoding, batch_size)
+    for columns in batches:
+        try:
+            results = process_batch_callback(columns)
+        except:  # noqa we reraise the exception.
+            log.error(f"Could not process batch while parsing {source}")
+            raise
+        yield from results
+
+
 def process_csv(
     path,
     file_name,
@@ -82,3 +196,271 @@ def process_csv(
             result = cb(row)
             if result:
                 yield result
+
+
+def _shard_rows(rows, fieldnames, key, shard, shards):
+    index = fieldnames.index(key)
+    for row in rows:
+        if row and sharding.shard_of(row[index], shards) == shard:
+            yield row
+
+
+def process_csv_shard(
+    path,
+    file_name,
+    process_callback,
+    shard,
+    shards,
+    key="identificatie",
+    columnar=False,
+    quotechar='"',
+    encoding="utf-8-sig",
+    batch_size=COLUMN_BATCH_SIZE,
+):
+    """
+    Like ``process_csv`` (or with ``columnar`` ``process_csv_columns``), for
+    the rows of a CSV file that are in ``shard`` of ``shards`` by their
+    ``key`` (see ``sharding.shard_of``). Every shard reads the whole file;
+    only the rows of the shard are converted to dicts or columns and processed.
+    """
+    source = os.path.join(path, file_name)
+    with open(source, encoding=encoding) as f:
+        reader = csv.reader(f, delimiter=";", quotechar=quotechar, quoting=csv.QUOTE_MINIMAL)
+        fieldnames = next(reader)
+        rows = _shard_rows(reader, fieldnames, key, shard, shards)
+        if columnar:
+            for columns in _column_batches(chain([fieldnames], rows), batch_size):
+                try:
+                    results = process_callback(columns)
+                except:  # noqa we reraise the exception.
+                    log.error(f"Could not process batch while parsing {source}")
+                    raise
+                yield from results
+            return
+
+        cb = logging_callback(source, process_callback)
+        width = len(fieldnames)
+        for row in rows:
+            if len(row) != width:
+                # Same as csv.DictReader: missing values are None, extra values are ignored
+                row = (row + [None] * width)[:width]
+            result = cb(dict(zip(fieldnames, row)))
+            if result:
+                yield result
+
+
+def row_ranges(source, chunk_bytes=CHUNK_BYTES, start=None, stop=None):
+    """
+    Splits the rows of a CSV file (after the header) in byte ranges of about
+    ``chunk_bytes``. A range always ends on a row boundary: a newline that
+    is preceded by an even number of quote characters within the range.
+
+    :param start: offset of a row boundary to start at, instead of after the header
+    :param stop: offset of a row boundary to stop at
+    """
+    with open(source, "rb") as f:
+        if start is None:
+            f.readline()
+        else:
+            f.seek(start)
+        offset = f.tell()
+        carry = b""
+        while stop is None or offset < stop:
+            block = f.read(chunk_bytes)
+            if not block:
+                break
+            region = carry + block
+            end = region.rfind(b"\n")
+            while end >= 0 and region.count(b'"', 0, end) % 2:
+                end = region.rfind(b"\n", 0, end)
+            if end < 0:
+                carry = region
+                continue
+            if stop is not None and offset + end + 1 >= stop:
+                yield offset, stop
+                return
+            yield offset, offset + end + 1
+            offset += end + 1
+            carry = region[end + 1:]
+        if carry and (stop is None or offset < stop):
+            end = offset + len(carry)
+            yield offset, end if stop is None else min(end, stop)
+
+
+def _read_range(source, start, end, encoding):
+    with open(source, "rb") as f:
+        f.seek(start)
+        return io.StringIO(f.read(end - start).decode(encoding), newline=None)
+
+
+def range_columns(
+    source, start, end, fieldnames, quotechar, encoding, batch_size=COLUMN_BATCH_SIZE
+):
+    """The rows of a byte range in batches of columns, like ``process_csv_columns``"""
+    text = _read_range(source, start, end, encoding)
+    rows = csv.reader(text, delimiter=";", quotechar=quotechar, quoting=csv.QUOTE_MINIMAL)
+    return _column_batches(chain([fieldnames], rows), batch_size)
+
+
+def header(source, quotechar='"', encoding=GOB_CSV_ENCODING):
+    with open(source, encoding=encoding) as f:
+        return next(csv.reader(f, delimiter=";", quotechar=quotechar))
+
+
+def _init_worker():
+    if _worker["init"]:
+        _worker["init"]()
+
+
+def _process_range(start, end):
+    rows = csv.DictReader(
+        _read_range(_worker["source"], start, end, _worker["encoding"]),
+        fieldnames=_worker["fieldnames"],
+        delimiter=";",
+        quotechar=_worker["quotechar"],
+        quoting=csv.QUOTE_MINIMAL,
+    )
+    cb = _worker["callback"]
+    results = [result for result in map(cb, rows) if result]
+    state = _worker["pop_state"]() if _worker["pop_state"] else None
+    return results, state
+
+
+def process_csv_parallel(
+    path,
+    file_name,
+    process_row_callback,
+    processes,
+    quotechar='"',
+    encoding="utf-8-sig",
+    chunk_bytes=CHUNK_BYTES,
+    init_worker=None,
+    pop_state=None,
+    merge_state=None,
+    start=None,
+    by_range=False,
+):
+    """
+    Same as ``process_csv``, but rows are processed by a pool of ``processes``
+    worker processes, each handling a byte range of the file. Results are
+    yielded in the same order as ``process_csv`` would.
+
+    Worker processes are forked, so the callback may be any callable and
+    shares the state of the parent at the moment the pool is created.
+    Results of the callback must be picklable.
+
+    :param init_worker: called once in every worker process
+    :param pop_state: called in the worker after each range; returns (and resets)
+        state that was collected as a side effect of the callback
+    :param merge_state: called in the parent with the state of each range, in order
+    :param start: byte offset of the row to start at (see ``process_csv_ranges``)
+    :param by_range: yield ``(end offset, results)`` per range instead of the results
+    """
+    source = os.path.join(path, file_name)
+    fieldnames = header(source, quotechar, encoding)
+
+    context = multiprocessing.get_context("fork")
+    with _fork_lock:
+        _worker.update(
+            source=source,
+            fieldnames=fieldnames,
+            encoding=encoding,
+            quotechar=quotechar,
+            callback=logging_callback(source, process_row_callback),
+            init=init_worker,
+            pop_state=pop_state,
+        )
+        pool = context.Pool(processes, initializer=_init_worker)
+
+    with pool:
+        # Bounded number of ranges in flight, so memory stays flat when
+        # the consumer is slower than the workers.
+        pending = deque()
+        ranges = row_ranges(source, chunk_bytes, start)
+        while True:
+            for range_start, end in ranges:
+                pending.append((end, pool.apply_async(_process_range, (range_start, end))))
+                if len(pending) >= 2 * processes:
+                    break
+            if not pending:
+                break
+            end, result = pending.popleft()
+            results, state = result.get()
+            if merge_state:
+                merge_state(state)
+            if by_range:
+                yield end, results
+            else:
+                yield from results
+
+
+def process_csv_ranges(
+    path,
+    file_name,
+    process_callback,
+    start=None,
+    stop=None,
+    processes=1,
+    columnar=False,
+    quotechar='"',
+    encoding="utf-8-sig",
+    chunk_bytes=CHUNK_BYTES,
+    cached=None,
+    **kwargs,
+):
+    """
+    Processes a CSV file per byte range (see ``row_ranges``) and yields
+    ``(end offset, results)`` for every range. A range can be committed
+    together with its end offset, so processing can be resumed at that offset.
+
+    :param process_callback: called per row (a dict), or with ``columnar`` per
+        batch of columns like in ``process_csv_columns``
+    :param start: byte offset to resume at, the end offset of an earlier range
+    :param stop: byte offset to stop at (only with one process)
+    :param processes: > 1 processes the ranges with ``process_csv_parallel``,
+        which gets the other keyword arguments
+    :param cached: with ``columnar``, ``columncache.CachedColumns`` of the file
+        to read the ranges from; ``start`` has to be one of their end offsets
+    """
+    if columnar and cached is not None and stop is None:
+        for end, batches in cached.ranges(start):
+            results = []
+            for columns in batches:
+                results.extend(process_callback(columns))
+            yield end, results
+        return
+
+    if processes > 1 and not columnar and stop is None:
+        yield from process_csv_parallel(
+            path,
+            file_name,
+            process_callback,
+            processes,
+            quotechar=quotechar,
+            encoding=encoding,
+            chunk_bytes=chunk_bytes,
+            start=start,
+            by_range=True,
+            **kwargs,
+        )
+        return
+
+    source = os.path.join(path, file_name)
+    fieldnames = header(source, quotechar, encoding)
+    cb = logging_callback(source, process_callback)
+    for range_start, end in row_ranges(source, chunk_bytes, start, stop):
+        if columnar:
+            results = []
+            for columns in range_columns(source, range_start, end, fieldnames, quotechar, encoding):
+                results.extend(process_callback(columns))
+        else:
+            text = _read_range(source, range_start, end, encoding)
+            rows = csv.DictReader(
+                text,
+                fieldnames=fieldnames,
+                delimiter=";",
+                quotechar=quotechar,
+                quoting=csv.QUOTE_MINIMAL,
+            )
+            results = [result for result in map(cb, rows) if result]
+        yield end, results
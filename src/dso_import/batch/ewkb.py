@@ -0,0 +1,250 @@
+"""
+Conversion of WKT straight into EWKB, without GEOS geometry objects.
+
+The WKT of a row is split into its rings with a regular expression, the
+coordinates of a ring are converted at once by numpy and the EWKB is assembled
+from the bytes. The result is what ``bytes(GEOSGeometry(wkt).ewkb)`` returns
+(little endian), so it can be passed to ``pgcopy.copy_rows`` as is.
+"""
+import re
+import struct
+
+import numpy as np
+
+WKB_POINT = 1
+WKB_LINESTRING = 2
+WKB_POLYGON = 3
+WKB_MULTIPOINT = 4
+WKB_MULTILINESTRING = 5
+WKB_MULTIPOLYGON = 6
+
+WKB_Z = 0x80000000
+WKB_SRID = 0x20000000
+
+_TYPES = {
+    "POINT": WKB_POINT,
+    "LINESTRING": WKB_LINESTRING,
+    "POLYGON": WKB_POLYGON,
+    "MULTIPOINT": WKB_MULTIPOINT,
+    "MULTILINESTRING": WKB_MULTILINESTRING,
+    "MULTIPOLYGON": WKB_MULTIPOLYGON,
+}
+
+# Nesting depth of the coordinate lists of a type
+_DEPTH = {
+    WKB_POINT: 1,
+    WKB_LINESTRING: 1,
+    WKB_POLYGON: 2,
+    WKB_MULTIPOINT: 2,
+    WKB_MULTILINESTRING: 2,
+    WKB_MULTIPOLYGON: 3,
+}
+
+# Accepted types per geotype of a task (see ``geo.get_geotype``), and the
+# multi type a single geometry is promoted to
+GEOTYPES = {
+    "multipolygon": ({WKB_POLYGON, WKB_MULTIPOLYGON}, WKB_MULTIPOLYGON),
+    "polygon": ({WKB_POLYGON}, None),
+    "point": ({WKB_POINT}, None),
+    "multiline": ({WKB_LINESTRING, WKB_MULTILINESTRING}, WKB_MULTILINESTRING),
+}
+
+_HEADER = re.compile(r"\s*(?:SRID=(\d+)\s*;)?\s*([A-Za-z]+)\s*(ZM|Z|M)?\s*", re.IGNORECASE)
+_TOKENS = re.compile(r"[()]|[^()]+")
+_UINT32 = struct.Struct("<I")
+_HEADER_SRID = struct.Struct("<BII")
+_HEADER_PLAIN = struct.Struct("<BI")
+
+
+def _coordinates(text, dims):
+    values = np.array(text.replace(",", " ").split(), dtype="<f8")
+    if not len(values) or len(values) % dims:
+        raise ValueError(f"Invalid coordinates in WKT: {text[:50]}")
+    return _UINT32.pack(len(values) // dims), values.tobytes()
+
+
+def _parse(tokens, position, depth, dims, parts):
+    """
+    Appends the WKB of a coordinate list of ``depth`` levels, starting at the
+    ``(`` at ``position``, to ``parts``. Returns the position after the ``)``.
+    """
+    if tokens[position] != "(":
+        raise ValueError("Invalid WKT: expected (")
+    position += 1
+    if depth == 1:
+        text = tokens[position]
+        count, data = _coordinates(text, dims)
+        parts.append(count)
+        parts.append(data)
+        position += 1
+    else:
+        count_position = len(parts)
+        parts.append(None)
+        count = 0
+        while True:
+            position = _parse(tokens, position, depth - 1, dims, parts)
+            count += 1
+            token = tokens[position].strip()
+            if token != ",":
+                break
+            position += 1
+        parts[count_position] = _UINT32.pack(count)
+    if tokens[position] != ")":
+        raise ValueError("Invalid WKT: expected )")
+    return position + 1
+
+
+def _point(text, dims):
+    count, data = _coordinates(text, dims)
+    if count != _UINT32.pack(1):
+        raise ValueError(f"Invalid point in WKT: {text[:50]}")
+    return data
+
+
+def _members(tokens, wkb_type, dims, flags):
+    """
+    Returns the number of members of a multi geometry and their parts; every
+    member has its own header, without SRID.
+    """
+    member_type = wkb_type - 3
+    member_header = _HEADER_PLAIN.pack(1, member_type | flags)
+    if tokens[0] != "(":
+        raise ValueError("Invalid WKT: expected (")
+    parts = []
+    if member_type == WKB_POINT and tokens[1] != "(":
+        # MULTIPOINT (1 2, 3 4), without parentheses around the points
+        points = tokens[1].split(",")
+        for point in points:
+            parts.append(member_header)
+            parts.append(_point(point, dims))
+        if tokens[2] != ")":
+            raise ValueError("Invalid WKT: expected )")
+        return len(points), parts, 3
+
+    position = 1
+    count = 0
+    while True:
+        parts.append(member_header)
+        if member_type == WKB_POINT:
+            if tokens[position] != "(" or tokens[position + 2] != ")":
+                raise ValueError("Invalid WKT: expected ( and )")
+            parts.append(_point(tokens[position + 1], dims))
+            position += 3
+        else:
+            position = _parse(tokens, position, _DEPTH[member_type], dims, parts)
+        count += 1
+        if tokens[position].strip() != ",":
+            break
+        position += 1
+    if tokens[position] != ")":
+        raise ValueError("Invalid WKT: expected )")
+    return count, parts, position + 1
+
+
+def from_wkt(wkt, geotype=None, srid=None):
+    """
+    Converts WKT into EWKB bytes
+
+    :param wkt: WKT text, optionally with an ``SRID=...;`` prefix
+    :param geotype: one of ``GEOTYPES``; single geometries are promoted to
+        the multi type. ``None`` accepts every type.
+    :param srid: SRID to set; overrides the SRID of the text
+    :return: EWKB, or None for empty text, empty geometries, another or an
+        unsupported type (e.g. GEOMETRYCOLLECTION) and invalid WKT
+    """
+    if not wkt:
+        return None
+    try:
+        return _from_wkt(wkt, geotype, srid)
+    except ValueError:
+        return None
+
+
+def _from_wkt(wkt, geotype, srid):
+    match = _HEADER.match(wkt)
+    if not match:
+        raise ValueError(f"Invalid WKT: {wkt[:50]}")
+    text_srid, name, dimension = match.groups()
+    wkb_type = _TYPES.get(name.upper())
+    if wkb_type is None:
+        # Not supported, like get_geotype: the row has no valid geometry
+        return None
+    dimension = (dimension or "").upper()
+    if dimension not in ("", "Z"):
+        raise ValueError(f"Unsupported dimension in WKT: {dimension}")
+    body = wkt[match.end():].strip()
+    if body.upper() == "EMPTY":
+        return None
+
+    promote = None
+    if geotype is not None:
+        accepted, multi_type = GEOTYPES[geotype]
+        if wkb_type not in accepted:
+            return None
+        if multi_type and wkb_type != multi_type:
+            promote = multi_type
+
+    if srid is None and text_srid:
+        srid = int(text_srid)
+    flags = 0
+    dims = 2
+    if dimension == "Z":
+        flags = WKB_Z
+        dims = 3
+    elif "(" in body:
+        # A third coordinate without the Z keyword, which GEOS accepts as well
+        first = body.lstrip("(").split(",", 1)[0].split(")", 1)[0].split()
+        if len(first) == 3:
+            flags = WKB_Z
+            dims = 3
+
+    tokens = [token for token in _TOKENS.findall(body) if not token.isspace()]
+    if not tokens or tokens[-1] != ")":
+        raise ValueError(f"Invalid WKT: {wkt[:50]}")
+    try:
+        if wkb_type >= WKB_MULTIPOINT:
+            count, parts, position = _members(tokens, wkb_type, dims, flags)
+            parts.insert(0, _UINT32.pack(count))
+        elif wkb_type == WKB_POINT:
+            # A point has no count, only the coordinates
+            if len(tokens) != 3 or tokens[0] != "(":
+                raise ValueError(f"Invalid WKT: {wkt[:50]}")
+            parts = [_point(tokens[1], dims)]
+            position = 3
+        else:
+            parts = []
+            position = _parse(tokens, 0, _DEPTH[wkb_type], dims, parts)
+    except IndexError:
+        raise ValueError(f"Invalid WKT: {wkt[:50]}")
+    if position != len(tokens):
+        raise ValueError(f"Invalid WKT: {wkt[:50]}")
+
+    if promote:
+        # A single geometry becomes the only member of a multi geometry
+        parts = [_UINT32.pack(1), _HEADER_PLAIN.pack(1, wkb_type | flags)] + parts
+        wkb_type = promote
+    if srid is None:
+        header = _HEADER_PLAIN.pack(1, wkb_type | flags)
+    else:
+        header = _HEADER_SRID.pack(1, wkb_type | flags | WKB_SRID, srid)
+    return header + b"".join(parts)
+
+
+def from_wkt_column(column, geotype=None, srid=None, mask=None):
+    """
+    Converts a column of WKT texts into EWKB
+
+    :param mask: optional boolean array; only these rows are converted
+    :return: numpy object array with the EWKB bytes or None, and a boolean array
+        of the rows that have a WKT text but no EWKB (empty, wrong type or invalid).
+        An empty text or None (the value is missing in a short row) is no geometry.
+    """
+    result = np.full(len(column), None, dtype=object)
+    rows = np.flatnonzero(np.asarray(column, dtype=object).astype(bool))
+    if mask is not None:
+        rows = rows[mask[rows]]
+    for i in rows:
+        result[i] = from_wkt(column[i], geotype, srid)
+    rejected = np.zeros(len(column), dtype=bool)
+    rejected[rows] = [result[i] is None for i in rows]
+    return result, rejected
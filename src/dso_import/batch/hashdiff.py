@@ -0,0 +1,140 @@
+"""
+Hash based comparison of a staging table with its target table.
+
+``import_row_hash`` holds a hash (``md5`` of the row as text) of every row
+of the target tables. The hashes of the staged rows are compared with it in
+one pass, which classifies every id as inserted, updated or deleted. Only those
+rows are written, so the cost of a merge depends on the number of changes,
+not on the size of the table. The staging table must have the columns of the
+target table, in the same order, so the row texts are comparable.
+"""
+import logging
+
+log = logging.getLogger(__name__)
+
+HASH_TABLE = "import_row_hash"
+
+INSERT = "I"
+UPDATE = "U"
+DELETE = "D"
+
+
+def create_table(cursor):
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {HASH_TABLE}
+        (
+            table_name text NOT NULL,
+            id text NOT NULL,
+            row_hash uuid NOT NULL,
+            PRIMARY KEY (table_name, id)
+        )
+        """
+    )
+
+
+def clear(cursor, table_name=None):
+    """Forget the hashes of a table, or of all tables"""
+    if table_name is None:
+        cursor.execute(f"TRUNCATE {HASH_TABLE}")
+    else:
+        cursor.execute(f"DELETE FROM {HASH_TABLE} WHERE table_name = %s", [table_name])
+
+
+def bootstrap(cursor, table_name):
+    """
+    Hashes the rows of a table that has no hashes yet, e.g. a table that was
+    loaded before hashes were kept. Returns the number of hashed rows.
+    """
+    cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {HASH_TABLE} WHERE table_name = %s)", [table_name])
+    (exists,) = cursor.fetchone()
+    if exists:
+        return 0
+    cursor.execute(
+        f"""
+        INSERT INTO {HASH_TABLE} (table_name, id, row_hash)
+        SELECT %s, e.id, md5(e::text)::uuid FROM {table_name} e
+        """,
+        [table_name],
+    )
+    if cursor.rowcount:
+        log.info(f"Hashed {cursor.rowcount} existing rows of {table_name}")
+    return cursor.rowcount
+
+
+def diff(cursor, table_name, staging_table, diff_table, complete=True):
+    """
+    Creates the temporary table ``diff_table`` with the ids of the staged rows
+    that are new or changed, and of the rows that are no longer staged.
+
+    :param complete: the staging table holds all rows. Otherwise only added or
+        changed rows are staged and deletions are not detected.
+    :return: dict action -> number of rows
+    """
+    bootstrap(cursor, table_name)
+    cursor.execute(f"DROP TABLE IF EXISTS {diff_table}")
+    join = "FULL JOIN" if complete else "LEFT JOIN"
+    cursor.execute(
+        f"""
+        CREATE TEMPORARY TABLE {diff_table} AS
+        SELECT
+            coalesce(s.id, h.id) AS id,
+            CASE
+                WHEN h.id IS NULL THEN '{INSERT}'
+                WHEN s.id IS NULL THEN '{DELETE}'
+                ELSE '{UPDATE}'
+            END AS action,
+            s.row_hash
+        FROM (SELECT t.id, md5(t::text)::uuid AS row_hash FROM {staging_table} t) s
+        {join} (SELECT id, row_hash FROM {HASH_TABLE} WHERE table_name = %s) h
+            ON s.id = h.id
+        WHERE h.id IS NULL OR s.id IS NULL OR s.row_hash <> h.row_hash
+        """,
+        [table_name],
+    )
+    cursor.execute(f"CREATE INDEX ON {diff_table}(id)")
+    cursor.execute(f"ANALYZE {diff_table}")
+    cursor.execute(f"SELECT action, count(*) FROM {diff_table} GROUP BY action")
+    counts = {INSERT: 0, UPDATE: 0, DELETE: 0}
+    counts.update(cursor.fetchall())
+    return counts
+
+
+def merge(cursor, table_name, staging_table, diff_table, columns):
+    """
+    Inserts and updates the rows of ``diff_table`` from the staging table, and
+    records their hashes. Deleted rows are left alone.
+
+    :param columns: the columns to update
+    """
+    cursor.execute(
+        f"""
+        INSERT INTO {table_name}
+        SELECT t.* FROM {staging_table} t
+        JOIN {diff_table} d ON d.id = t.id AND d.action = '{INSERT}'
+        """
+    )
+    log.info(f"Inserted into {table_name} : {cursor.rowcount}")
+    setters = ", ".join(f"{column} = t.{column}" for column in columns)
+    cursor.execute(
+        f"""
+        UPDATE {table_name} e SET {setters}
+        FROM {staging_table} t
+        JOIN {diff_table} d ON d.id = t.id AND d.action = '{UPDATE}'
+        WHERE e.id = t.id
+        """
+    )
+    log.info(f"Updated {table_name} : {cursor.rowcount}")
+    save_hashes(cursor, table_name, diff_table)
+
+
+def save_hashes(cursor, table_name, diff_table):
+    """Records the hashes of the inserted and updated rows of ``diff_table``"""
+    cursor.execute(
+        f"""
+        INSERT INTO {HASH_TABLE} (table_name, id, row_hash)
+        SELECT %s, id, row_hash FROM {diff_table} WHERE action <> '{DELETE}'
+        ON CONFLICT (table_name, id) DO UPDATE SET row_hash = EXCLUDED.row_hash
+        """,
+        [table_name],
+    )
@@ -0,0 +1,155 @@
+"""
+Building of indexes and constraints after a bulk load.
+
+For a full load the secondary indexes and foreign keys of the target tables
+are dropped before loading and rebuilt afterwards, which is much faster than
+maintaining them row by row. The definitions are kept in
+``import_deferred_index`` until they are rebuilt, so they survive a failed
+import and are rebuilt by the next one.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.db import connection
+
+log = logging.getLogger(__name__)
+
+DEFERRED_TABLE = "import_deferred_index"
+
+INDEX = "index"
+FOREIGN_KEY = "foreign_key"
+
+
+def create_table(cursor):
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {DEFERRED_TABLE}
+        (
+            table_name text NOT NULL,
+            name text NOT NULL,
+            kind text NOT NULL,
+            definition text NOT NULL,
+            PRIMARY KEY (table_name, name)
+        )
+        """
+    )
+
+
+@contextmanager
+def using_maintenance_work_mem(cursor, maintenance_work_mem):
+    """Sets maintenance_work_mem on the connection of ``cursor``, and resets it afterwards"""
+    if not maintenance_work_mem:
+        yield
+        return
+    cursor.execute("SELECT set_config('maintenance_work_mem', %s, false)", [maintenance_work_mem])
+    try:
+        yield
+    finally:
+        cursor.execute("RESET maintenance_work_mem")
+
+
+def build(cursor, statement, description=None):
+    """Executes an index or constraint statement; returns the time it took"""
+    start = time.perf_counter()
+    cursor.execute(statement)
+    elapsed = time.perf_counter() - start
+    log.info(f"Built {description or statement} in {elapsed:.1f}s")
+    return elapsed
+
+
+def defer(cursor, tables):
+    """
+    Drops the secondary indexes (not those of primary keys or other constraints)
+    and the foreign keys of the tables, after recording them for ``rebuild``
+    """
+    # Left by a failed import of tables that have been recreated since
+    cursor.execute(f"DELETE FROM {DEFERRED_TABLE} WHERE table_name = ANY(%s)", [tables])
+    cursor.execute(
+        f"""
+        INSERT INTO {DEFERRED_TABLE} (table_name, name, kind, definition)
+        SELECT conrelid::regclass::text, conname, '{FOREIGN_KEY}', pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE contype = 'f'
+        AND conrelid IN (SELECT to_regclass(t) FROM unnest(%s::text[]) t)
+        RETURNING table_name, name
+        """,
+        [tables],
+    )
+    foreign_keys = cursor.fetchall()
+    for table, name in foreign_keys:
+        cursor.execute(f"ALTER TABLE {table} DROP CONSTRAINT {name}")
+    cursor.execute(
+        f"""
+        INSERT INTO {DEFERRED_TABLE} (table_name, name, kind, definition)
+        SELECT x.indrelid::regclass::text, i.relname, '{INDEX}', pg_get_indexdef(x.indexrelid)
+        FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid IN (SELECT to_regclass(t) FROM unnest(%s::text[]) t)
+        AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid)
+        RETURNING name
+        """,
+        [tables],
+    )
+    index_names = [name for (name,) in cursor.fetchall()]
+    for name in index_names:
+        cursor.execute(f"DROP INDEX {name}")
+    log.info(f"Deferred {len(index_names)} indexes and {len(foreign_keys)} foreign keys")
+
+
+def pending(cursor):
+    """Returns the deferred ``(table_name, name, kind, definition)``"""
+    cursor.execute(
+        f"SELECT table_name, name, kind, definition FROM {DEFERRED_TABLE} ORDER BY table_name, name"
+    )
+    return cursor.fetchall()
+
+
+def _rebuild(cursor, table, name, kind, definition):
+    if kind == FOREIGN_KEY:
+        statement = f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}"
+    else:
+        statement = definition
+    elapsed = build(cursor, statement, f"{table}.{name}")
+    cursor.execute(
+        f"DELETE FROM {DEFERRED_TABLE} WHERE table_name = %s AND name = %s", [table, name]
+    )
+    return table, name, elapsed
+
+
+def _rebuild_in_thread(row, maintenance_work_mem):
+    """Rebuilds on the connection of the current (worker) thread, which is closed afterwards"""
+    try:
+        with connection.cursor() as cursor:
+            with using_maintenance_work_mem(cursor, maintenance_work_mem):
+                return _rebuild(cursor, *row)
+    finally:
+        connection.close()
+
+
+def rebuild(workers=1, maintenance_work_mem=None):
+    """
+    Rebuilds the deferred indexes, ``workers`` at the same time, each on its
+    own connection. The foreign keys follow one by one, as adding one locks
+    both tables. Returns a list of ``(table_name, name, seconds)``.
+    """
+    with connection.cursor() as cursor:
+        deferred = pending(cursor)
+    if not deferred:
+        return []
+    log.info(f"Rebuilding {len(deferred)} indexes and foreign keys")
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        timings = list(
+            executor.map(
+                lambda row: _rebuild_in_thread(row, maintenance_work_mem),
+                [row for row in deferred if row[2] == INDEX],
+            )
+        )
+    with connection.cursor() as cursor, using_maintenance_work_mem(cursor, maintenance_work_mem):
+        for row in deferred:
+            if row[2] == FOREIGN_KEY:
+                timings.append(_rebuild(cursor, *row))
+    log.info("Rebuild times:")
+    for table, name, elapsed in sorted(timings, key=lambda t: -t[2]):
+        log.info(f"  {table}.{name}: {elapsed:.1f}s")
+    return timings
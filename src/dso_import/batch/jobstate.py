@@ -0,0 +1,109 @@
+"""
+Persistent state of a running job, to resume it after an interruption.
+
+``import_job_state`` has a row per task of a job. A finished task is marked
+``done``; a task that loads a file in checkpoints records the byte offset up to
+which the rows are committed, and the number of rows. The state of a job is
+removed when the job has finished.
+"""
+import logging
+from collections import namedtuple
+
+from django.db import connection
+
+log = logging.getLogger(__name__)
+
+STATE_TABLE = "import_job_state"
+
+RUNNING = "running"
+DONE = "done"
+
+TaskState = namedtuple("TaskState", "task status source_version byte_offset row_count updated_at")
+
+
+def create_table(cursor):
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE}
+        (
+            job text NOT NULL,
+            task text NOT NULL,
+            status text NOT NULL,
+            source_version text,
+            byte_offset bigint,
+            row_count bigint NOT NULL DEFAULT 0,
+            updated_at timestamp with time zone NOT NULL DEFAULT now(),
+            PRIMARY KEY (job, task)
+        )
+        """
+    )
+
+
+class JobState:
+    """
+    State of the tasks of one job. Every method uses the connection of the
+    calling thread, so a checkpoint is committed with the rows of its batch
+    when it is saved in the same transaction.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        with connection.cursor() as cursor:
+            create_table(cursor)
+
+    def finished_tasks(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT task FROM {STATE_TABLE} WHERE job = %s AND status = %s", [self.job, DONE]
+            )
+            return {task for (task,) in cursor.fetchall()}
+
+    def get(self, task):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT task, status, source_version, byte_offset, row_count, updated_at
+                FROM {STATE_TABLE} WHERE job = %s AND task = %s
+                """,
+                [self.job, task],
+            )
+            row = cursor.fetchone()
+        return TaskState(*row) if row else None
+
+    def start(self, task, source_version=None):
+        """Records that a task (re)starts from the beginning"""
+        self._save(task, RUNNING, source_version, None, 0)
+
+    def checkpoint(self, task, byte_offset, row_count):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {STATE_TABLE} SET byte_offset = %s, row_count = %s, updated_at = now()
+                WHERE job = %s AND task = %s
+                """,
+                [byte_offset, row_count, self.job, task],
+            )
+
+    def finish(self, task):
+        self._save(task, DONE, None, None, 0)
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {STATE_TABLE} WHERE job = %s", [self.job])
+
+    def _save(self, task, status, source_version, byte_offset, row_count):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {STATE_TABLE}
+                    (job, task, status, source_version, byte_offset, row_count, updated_at)
+                VALUES (%s, %s, %s, %s, %s, %s, now())
+                ON CONFLICT (job, task) DO UPDATE SET
+                    status = EXCLUDED.status,
+                    source_version = EXCLUDED.source_version,
+                    byte_offset = EXCLUDED.byte_offset,
+                    row_count = EXCLUDED.row_count,
+                    updated_at = EXCLUDED.updated_at
+                """,
+                [self.job, task, status, source_version, byte_offset, row_count],
+            )
@@ -0,0 +1,150 @@
+"""
+Import ledger: remembers per source file what was imported the last time.
+
+``import_ledger`` holds the checksum, size, row count and object store etag
+of every source file and the time of its last successful import. ``import_ledger_row`` holds a hash
+of the raw values of every imported row, so a changed file can be compared
+with the previous version row by row.
+"""
+import hashlib
+import logging
+from collections import namedtuple
+
+from dso_import.batch import pgcopy
+
+log = logging.getLogger(__name__)
+
+LEDGER_TABLE = "import_ledger"
+LEDGER_ROW_TABLE = "import_ledger_row"
+
+# Hashed for a missing value (None, e.g. a short CSV row), which differs from an empty value
+NULL_VALUE = "\x00"
+
+LedgerEntry = namedtuple(
+    "LedgerEntry", "file_name checksum size row_count imported_at etag"
+)
+
+
+def create_tables(cursor):
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {LEDGER_TABLE}
+        (
+            file_name text PRIMARY KEY,
+            checksum character varying(64) NOT NULL,
+            size bigint NOT NULL,
+            row_count integer NOT NULL,
+            imported_at timestamp with time zone NOT NULL
+        )
+        """
+    )
+    cursor.execute(f"ALTER TABLE {LEDGER_TABLE} ADD COLUMN IF NOT EXISTS etag text")
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {LEDGER_ROW_TABLE}
+        (
+            file_name text NOT NULL,
+            id text NOT NULL,
+            row_hash bigint NOT NULL,
+            PRIMARY KEY (file_name, id)
+        )
+        """
+    )
+
+
+def clear(cursor):
+    """Forget all imports, e.g. because the target tables are recreated"""
+    cursor.execute(f"TRUNCATE {LEDGER_TABLE}, {LEDGER_ROW_TABLE}")
+
+
+def file_checksum(source, block_size=1024 * 1024):
+    """Returns the sha256 hex digest and the size of a file"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(source, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+
+def row_hash(row):
+    """
+    64-bit hash of the raw values of a CSV row (a dict, or a sequence of the values).
+    The extra values of a row with too many columns (``csv.DictReader`` puts them
+    in a list under the key None) are ignored, like the columnar reader does.
+    """
+    values = (v for k, v in row.items() if k is not None) if isinstance(row, dict) else row
+    text = "\x1f".join(NULL_VALUE if value is None else value for value in values)
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8)
+    return int.from_bytes(digest.digest(), "big", signed=True)
+
+
+def get_entry(cursor, file_name):
+    cursor.execute(
+        f"""
+        SELECT file_name, checksum, size, row_count, imported_at, etag
+        FROM {LEDGER_TABLE} WHERE file_name = %s
+        """,
+        [file_name],
+    )
+    row = cursor.fetchone()
+    return LedgerEntry(*row) if row else None
+
+
+def get_row_hashes(cursor, file_name):
+    """Returns a dict id -> row hash of the last import of a file"""
+    cursor.execute(
+        f"SELECT id, row_hash FROM {LEDGER_ROW_TABLE} WHERE file_name = %s",
+        [file_name],
+    )
+    return dict(cursor.fetchall())
+
+
+def save(
+    cursor,
+    file_name,
+    checksum,
+    size,
+    row_count,
+    row_hashes,
+    deleted_ids=(),
+    replace=False,
+    etag=None,
+):
+    """
+    Records a successful import of a file
+
+    :param row_hashes: dict id -> row hash of the rows that were added or changed
+    :param deleted_ids: ids that are no longer in the file
+    :param replace: ``row_hashes`` holds all rows of the file
+    :param etag: etag of the downloaded object, see ``objectstore.downloaded_etag``
+    """
+    cursor.execute(
+        f"""
+        INSERT INTO {LEDGER_TABLE} (file_name, checksum, size, row_count, imported_at, etag)
+        VALUES (%s, %s, %s, %s, now(), %s)
+        ON CONFLICT (file_name) DO UPDATE SET
+            checksum = EXCLUDED.checksum,
+            size = EXCLUDED.size,
+            row_count = EXCLUDED.row_count,
+            imported_at = EXCLUDED.imported_at,
+            etag = EXCLUDED.etag
+        """,
+        [file_name, checksum, size, row_count, etag],
+    )
+    stale_ids = list(row_hashes.keys()) + list(deleted_ids)
+    if replace:
+        cursor.execute(f"DELETE FROM {LEDGER_ROW_TABLE} WHERE file_name = %s", [file_name])
+    elif stale_ids:
+        cursor.execute(
+            f"DELETE FROM {LEDGER_ROW_TABLE} WHERE file_name = %s AND id = ANY(%s)",
+            [file_name, stale_ids],
+        )
+    pgcopy.copy_rows(
+        cursor,
+        LEDGER_ROW_TABLE,
+        ["file_name", "id", "row_hash"],
+        ((file_name, id, h) for id, h in row_hashes.items()),
+    )
+    log.info(f"Ledger {file_name}: {row_count} rows, {len(row_hashes)} added or changed")
@@ -0,0 +1,251 @@
+"""
+Performance metrics of the tasks of a job.
+
+Every task gets a ``TaskMetrics``, that keeps the time spent per stage (e.g.
+download, parse, transform, write), the number of rows, bytes read and
+rejected rows, and the memory use of the process at the end of the task. Stages nest:
+time is counted for the innermost running stage only, so the time of a write
+stage does not include the time spent producing the rows it writes. Every
+thread has its own running stages; the times of stages that run in threads
+at the same time (see ``pipeline``) add up.
+
+At the end of a job ``report`` combines them; it can be written as JSON and in
+the Prometheus textfile format (for the node exporter textfile collector).
+The peak memory use is a job metric: the high-water mark of the process
+covers all tasks that ran before or at the same time.
+"""
+import json
+import os
+import resource
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+METRIC_PREFIX = "dso_import"
+
+
+def peak_rss():
+    """Peak resident set size in bytes, of this process and of its (finished) child processes"""
+    # ru_maxrss is in kilobytes on Linux
+    return 1024 * max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+
+
+def current_rss():
+    """Resident set size in bytes of this process, None when it is unknown (not on Linux)"""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * resource.getpagesize()
+
+
+class TaskMetrics:
+    def __init__(self, task):
+        self.task = task
+        self.seconds = defaultdict(float)
+        self.elapsed = 0.0
+        self.rows = 0
+        self.bytes_read = 0
+        self.rejected = 0
+        self.rss = None
+        # Functions with the most own time, when the task was profiled
+        self.hotspots = None
+        self.batches = 0
+        self.batch_rows = 0
+        self.batch_bytes = 0
+        self.batch_seconds = 0.0
+        self.batch_rows_max = 0
+        self.started = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def _stack(self):
+        """The running stages of this thread"""
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def start(self, stage):
+        now = time.perf_counter()
+        stack = self._stack
+        if stack:
+            outer = stack[-1]
+            with self._lock:
+                self.seconds[outer[0]] += now - outer[1]
+        stack.append([stage, now])
+
+    def stop(self):
+        now = time.perf_counter()
+        stack = self._stack
+        stage, started = stack.pop()
+        with self._lock:
+            self.seconds[stage] += now - started
+        if stack:
+            stack[-1][1] = now
+
+    @contextmanager
+    def stage(self, stage):
+        self.start(stage)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    @contextmanager
+    def task_timer(self):
+        self.started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.elapsed = self.running_seconds()
+            self.rss = current_rss()
+
+    def running_seconds(self):
+        return time.perf_counter() - self.started
+
+    def timed(self, iterable, stage):
+        """Iterates over ``iterable``, counting the time spent in it for ``stage``"""
+        iterator = iter(iterable)
+        while True:
+            self.start(stage)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.stop()
+            yield item
+
+    def add_batch(self, rows, nbytes, seconds):
+        """Records a batch of rows written to the database"""
+        self.batches += 1
+        self.batch_rows += rows
+        self.batch_bytes += nbytes
+        self.batch_seconds += seconds
+        self.batch_rows_max = max(self.batch_rows_max, rows)
+
+    def reset(self):
+        """Forgets the stage times and the running stages, e.g. in a forked process"""
+        self.seconds.clear()
+        self._stack.clear()
+
+    def pop_seconds(self):
+        """Returns and resets the stage times, e.g. those of a worker process"""
+        with self._lock:
+            seconds = dict(self.seconds)
+            self.seconds.clear()
+        return seconds
+
+    def add_seconds(self, seconds):
+        with self._lock:
+            for stage, value in seconds.items():
+                self.seconds[stage] += value
+
+    def as_dict(self):
+        stages = {stage: round(value, 3) for stage, value in sorted(self.seconds.items())}
+        result = {
+            "task": self.task,
+            "seconds": round(self.elapsed, 3),
+            "stages": stages,
+            "rows": self.rows,
+            "rows_per_second": round(self.rows / self.elapsed, 1) if self.elapsed else 0.0,
+            "bytes_read": self.bytes_read,
+            "rejected_rows": self.rejected,
+            "rss_bytes": self.rss,
+            "batches": self.batches,
+        }
+        if self.batches:
+            result["batch"] = {
+                "mean_rows": round(self.batch_rows / self.batches),
+                "max_rows": self.batch_rows_max,
+                "mean_bytes": round(self.batch_bytes / self.batches),
+                "mean_seconds": round(self.batch_seconds / self.batches, 3),
+            }
+        if self.hotspots is not None:
+            result["hotspots"] = self.hotspots
+        return result
+
+
+def report(job, task_metrics, elapsed, status):
+    return {
+        "job": job,
+        "status": status,
+        "finished_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "seconds": round(elapsed, 3),
+        "peak_rss_bytes": peak_rss(),
+        "tasks": [metrics.as_dict() for metrics in task_metrics],
+    }
+
+
+def _write(path, text):
+    """Writes through a temporary file, so a reader never sees a partial file"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+def write_json(report, path):
+    _write(path, json.dumps(report, indent=2) + "\n")
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Metric name, report key and help text of the per-task gauges
+TASK_GAUGES = [
+    ("task_rows", "rows", "Rows processed by a task"),
+    ("task_rows_per_second", "rows_per_second", "Rows processed per second of a task"),
+    ("task_bytes_read", "bytes_read", "Bytes of source data read by a task"),
+    ("task_rejected_rows", "rejected_rows", "Rows rejected by a task"),
+    ("task_rss_bytes", "rss_bytes", "Resident memory of the process at the end of a task"),
+    ("task_batches", "batches", "Batches of rows written by a task"),
+]
+
+
+def _gauge(name, help, samples):
+    lines = [f"# HELP {METRIC_PREFIX}_{name} {help}", f"# TYPE {METRIC_PREFIX}_{name} gauge"]
+    lines.extend(f"{METRIC_PREFIX}_{name}{{{labels}}} {value}" for labels, value in samples)
+    return lines
+
+
+def textfile(report):
+    """The report in the Prometheus text exposition format"""
+    job = f'job="{_label(report["job"])}"'
+    tasks = [(f'{job},task="{_label(task["task"])}"', task) for task in report["tasks"]]
+    seconds = []
+    for labels, task in tasks:
+        seconds.append((f'{labels},stage="total"', task["seconds"]))
+        seconds.extend(
+            (f'{labels},stage="{_label(stage)}"', value) for stage, value in task["stages"].items()
+        )
+    lines = _gauge("task_seconds", "Time spent in a task, per stage", seconds)
+    for name, key, help in TASK_GAUGES:
+        samples = [(labels, task[key]) for labels, task in tasks if task[key] is not None]
+        lines += _gauge(name, help, samples)
+    lines += _gauge("job_seconds", "Duration of the job", [(job, report["seconds"])])
+    lines += _gauge(
+        "job_success",
+        "1 when the job finished, 0 when it failed",
+        [(job, int(report["status"] == "finished"))],
+    )
+    lines += _gauge(
+        "job_peak_rss_bytes", "Peak resident memory of the job", [(job, report["peak_rss_bytes"])]
+    )
+    lines += _gauge(
+        "job_last_run_timestamp_seconds", "Time the job ended", [(job, int(time.time()))]
+    )
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(report, path):
+    _write(path, textfile(report))
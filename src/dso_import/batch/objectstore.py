@@ -1,10 +1,17 @@
+import glob
+import hashlib
+import json
 import logging
 import os
+import threading
 import time
-from functools import lru_cache
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from requests.exceptions import RequestException
 from swiftclient.client import Connection
+from swiftclient.exceptions import ClientException
 
 from dso_import import settings
 
@@ -16,6 +23,9 @@ logging.getLogger("swiftclient").setLevel(logging.WARNING)
 
 container = os.getenv("GOB_OBJECTSTORE_ENV", "productie")
 
+CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_RETRIES = 5
+
 connection = {
     "auth_version": "2.0",
     "authurl": "https://identity.stack.cloudvps.com/v2.0",
@@ -29,10 +39,15 @@ connection = {
 }
 
 
-@lru_cache(maxsize=None)
+_local = threading.local()
+
+
 def get_conn():
-    assert os.getenv("GOB_OBJECTSTORE_PASSWORD")
-    return Connection(**connection)
+    """Returns a connection per thread, a swift Connection is not thread safe"""
+    if not hasattr(_local, "conn"):
+        assert os.getenv("GOB_OBJECTSTORE_PASSWORD")
+        _local.conn = Connection(**connection)
+    return _local.conn
 
 
 def file_exists(target):
@@ -40,30 +55,212 @@ def file_exists(target):
     return target.is_file()
 
 
+_file_locks = defaultdict(threading.Lock)
+_file_locks_lock = threading.Lock()
+
+
+def _file_lock(target):
+    """Lock per target file, so a file is never downloaded by two threads at once"""
+    with _file_locks_lock:
+        return _file_locks[target]
+
+
+class Manifest:
+    """
+    Local record of the downloaded objects: etag, last-modified and size
+    per target file, stored as json in DOWNLOAD_MANIFEST.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._entries = None
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            try:
+                with open(self.path) as f:
+                    self._entries = json.load(f)
+            except FileNotFoundError:
+                self._entries = {}
+        return self._entries
+
+    def get(self, target):
+        """Returns the entry of a downloaded file, or None"""
+        with self.lock:
+            return self.entries.get(os.path.abspath(target))
+
+    def update(self, target, object_path, meta):
+        with self.lock:
+            self.entries[os.path.abspath(target)] = {
+                "object": object_path,
+                "etag": meta["etag"].strip('"'),
+                "last_modified": meta.get("last-modified"),
+                "size": int(meta["content-length"]),
+                # To tell whether the file was replaced since it was downloaded
+                "mtime_ns": os.stat(target).st_mtime_ns,
+                "downloaded_at": time.time(),
+            }
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+manifest = Manifest(settings.DOWNLOAD_MANIFEST)
+
+
+def downloaded_etag(file_path, target_path=None, target_root=settings.DATA_DIR):
+    """
+    Returns the etag of the object a file was downloaded from, or None when
+    it was not downloaded or changed since, e.g. it was replaced by hand
+    """
+    target = _target_file(file_path, target_path, target_root)
+    entry = manifest.get(target)
+    if entry is None or not file_exists(target):
+        return None
+    stat = os.stat(target)
+    if stat.st_size != entry["size"] or stat.st_mtime_ns != entry.get("mtime_ns"):
+        return None
+    return entry["etag"]
+
+
+def _is_up_to_date(newfilename, meta):
+    entry = manifest.get(newfilename)
+    return (
+        entry is not None
+        and file_exists(newfilename)
+        and entry["etag"] == meta["etag"].strip('"')
+        and os.path.getsize(newfilename) == int(meta["content-length"])
+    )
+
+
+def _is_md5_etag(etag):
+    return len(etag) == 32 and "-" not in etag
+
+
+def _is_segmented(meta):
+    """
+    Large objects (dynamic or static) consist of segments; their etag is not
+    the md5 of the content, for a static one it is the md5 of the segment etags
+    """
+    return "x-object-manifest" in meta or "x-static-large-object" in meta
+
+
+def _part_file(newfilename, etag):
+    # The etag is in the name, so a download is only resumed for the same object version
+    return f"{newfilename}.{etag}.part"
+
+
+def _remove_stale_parts(newfilename, part_file):
+    for stale in glob.glob(f"{glob.escape(newfilename)}.*.part"):
+        if stale != part_file:
+            log.info(f"Remove partial download of another version: {stale}")
+            os.remove(stale)
+
+
+def _download(file_path, newfilename, meta):
+    """
+    Streams an object to ``<newfilename>.<etag>.part`` and renames it when complete.
+
+    An existing partial file of the same etag is resumed with a range request.
+    The result is verified against the size and, unless the object is
+    segmented, the etag (md5) of the object.
+    """
+    size = int(meta["content-length"])
+    etag = meta["etag"].strip('"')
+    part_file = _part_file(newfilename, etag)
+    _remove_stale_parts(newfilename, part_file)
+    verify_md5 = _is_md5_etag(etag) and not _is_segmented(meta)
+
+    offset = os.path.getsize(part_file) if file_exists(part_file) else 0
+    if offset > size:
+        os.remove(part_file)
+        offset = 0
+    md5 = hashlib.md5()
+    if offset and verify_md5:
+        with open(part_file, "rb") as f:
+            for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+                md5.update(block)
+
+    if offset < size:
+        headers = {"If-Match": meta["etag"]}
+        if offset:
+            log.info(f"Resume download of {file_path} at {offset} of {size} bytes")
+            headers["Range"] = f"bytes={offset}-"
+        _, body = get_conn().get_object(
+            container, file_path, resp_chunk_size=CHUNK_SIZE, headers=headers
+        )
+        with open(part_file, "ab") as f:
+            for chunk in body:
+                f.write(chunk)
+                if verify_md5:
+                    md5.update(chunk)
+
+    downloaded = os.path.getsize(part_file)
+    if downloaded != size or (verify_md5 and md5.hexdigest() != etag):
+        os.remove(part_file)
+        raise ValueError(f"Download of {file_path} is corrupt; removed partial file")
+    os.replace(part_file, newfilename)
+
+
 def download_file(
     file_path, target_path=None, target_root=settings.DATA_DIR, file_last_modified=None,
 ):
+    newfilename = _target_file(file_path, target_path, target_root)
+    with _file_lock(newfilename):
+        _download_file(file_path, newfilename, target_root, file_last_modified)
+
+
+def _target_file(file_path, target_path, target_root):
+    if target_path:
+        return "{}/{}".format(target_root, target_path)
+    return "{}/{}".format(target_root, file_path.split("/")[-1])
+
+
+def _download_file(file_path, newfilename, target_root, file_last_modified):
     path = file_path.split("/")
 
     file_name = path[-1]
     log.info(f"Create file {file_name} in {target_root}")
-    file_name = path[-1]
 
-    if target_path:
-        newfilename = "{}/{}".format(target_root, target_path)
-    else:
-        newfilename = "{}/{}".format(target_root, file_name)
-
-    if file_exists(newfilename):
-        st = os.stat(newfilename)
-        age_seconds = time.time() - st.st_mtime
-        if age_seconds < 24 * 60 * 60:  # If not older then a day skip download
-            log.debug("Recent file exists: %s - Skipped download", newfilename)
+    meta = get_conn().head_object(container, file_path)
+    if _is_up_to_date(newfilename, meta):
+        log.debug("Unchanged file exists: %s - Skipped download", newfilename)
         return
 
-    with open(newfilename, "wb") as newfile:
-        data = get_conn().get_object(container, file_path)[1]
-        newfile.write(data)
+    for attempt in range(1, DOWNLOAD_RETRIES + 1):
+        try:
+            if attempt > 1:
+                meta = get_conn().head_object(container, file_path)
+            _download(file_path, newfilename, meta)
+            break
+        except (ClientException, RequestException, OSError, ValueError) as e:
+            if attempt == DOWNLOAD_RETRIES:
+                raise
+            log.warning(f"Download of {file_path} failed ({e}); retry {attempt}")
+            time.sleep(2 ** attempt)
     if file_last_modified:
         epoch_modified = file_last_modified.timestamp()
         os.utime(newfilename, (epoch_modified, epoch_modified))
+    manifest.update(newfilename, file_path, meta)
+
+
+def prefetch(file_paths, workers, target_root=settings.DATA_DIR):
+    """
+    Starts downloading files in background threads and returns immediately.
+    A later ``download_file`` of the same file waits until it is downloaded.
+    """
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+
+    def download(file_path):
+        try:
+            download_file(file_path, target_root=target_root)
+        except Exception:  # noqa the task that needs the file retries and reports
+            log.exception(f"Prefetch of {file_path} failed")
+
+    for file_path in file_paths:
+        executor.submit(download, file_path)
+    executor.shutdown(wait=False)
+    return executor
@@ -0,0 +1,240 @@
+"""
+Streaming of rows into PostgreSQL with ``COPY ... FROM STDIN``.
+
+Rows are plain tuples ordered like the given column list. Geometries are
+passed as EWKB ``bytes``; in text format those are written as hex, which is
+what the PostGIS geometry input function expects.
+"""
+import io
+import struct
+from datetime import date, datetime, timedelta
+
+COPY_TEXT = "text"
+COPY_BINARY = "binary"
+
+_PG_EPOCH_DATE = date(2000, 1, 1)
+_PG_EPOCH = datetime(2000, 1, 1)
+_BINARY_HEADER = b"PGCOPY\n\377\r\n\0" + struct.pack(">ii", 0, 0)
+_BINARY_TRAILER = struct.pack(">h", -1)
+_NULL = struct.pack(">i", -1)
+
+_TEXT_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+_ARRAY_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"'})
+
+
+class _RowStream(io.RawIOBase):
+    """
+    Read-only file object on top of a generator of encoded chunks,
+    so ``cursor.copy_expert`` can pull the data without materialising it.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.buffer = b""
+        # Number of bytes read
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        result, self.buffer = self.buffer[:size], self.buffer[size:]
+        self.size += len(result)
+        return result
+
+
+def get_column_types(cursor, table):
+    """
+    Returns a dict ``column -> (type name, element type name, element type oid)``.
+    The element type is only set for array columns.
+    """
+    cursor.execute(
+        """
+        SELECT a.attname, t.typname, et.typname, et.oid
+        FROM pg_attribute a
+        JOIN pg_type t ON t.oid = a.atttypid
+        LEFT JOIN pg_type et ON et.oid = t.typelem AND t.typcategory = 'A'
+        WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+        """,
+        [table],
+    )
+    return {name: (typname, elemname, elemoid) for name, typname, elemname, elemoid in cursor.fetchall()}
+
+
+def _text_array(values):
+    elements = (
+        "NULL" if v is None else '"' + str(v).translate(_ARRAY_ESCAPES) + '"' for v in values
+    )
+    return "{" + ",".join(elements) + "}"
+
+
+def text_value(value):
+    """Encodes a single value for the COPY text format"""
+    if value is None:
+        return "\\N"
+    if value is True:
+        return "t"
+    if value is False:
+        return "f"
+    if isinstance(value, str):
+        return value.translate(_TEXT_ESCAPES)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, (list, tuple)):
+        return _text_array(value).translate(_TEXT_ESCAPES)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def text_line(row):
+    return ("\t".join([text_value(v) for v in row]) + "\n").encode("utf-8")
+
+
+def _encode_text(value):
+    return str(value).encode("utf-8")
+
+
+def _encode_date(value):
+    if isinstance(value, datetime):
+        value = value.date()
+    return struct.pack(">i", (value - _PG_EPOCH_DATE).days)
+
+
+def _microseconds(delta: timedelta):
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _encode_timestamp(value):
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    return struct.pack(">q", _microseconds(value - _PG_EPOCH))
+
+
+def _timestamptz_encoder(timezone):
+    def encode(value):
+        if not isinstance(value, datetime):
+            value = datetime(value.year, value.month, value.day)
+        if value.tzinfo is None:
+            if timezone is None:
+                raise ValueError("Naive datetime requires a timezone for binary COPY")
+            if hasattr(timezone, "localize"):
+                value = timezone.localize(value)
+            else:
+                value = value.replace(tzinfo=timezone)
+        utc = value.replace(tzinfo=None) - value.utcoffset()
+        return struct.pack(">q", _microseconds(utc - _PG_EPOCH))
+
+    return encode
+
+
+def _array_encoder(element_oid, element_encoder):
+    def encode(values):
+        if not values:
+            return struct.pack(">iii", 0, 0, element_oid)
+        has_null = any(v is None for v in values)
+        parts = [struct.pack(">iiiii", 1, has_null, element_oid, len(values), 1)]
+        for v in values:
+            if v is None:
+                parts.append(_NULL)
+            else:
+                data = element_encoder(v)
+                parts.append(struct.pack(">i", len(data)))
+                parts.append(data)
+        return b"".join(parts)
+
+    return encode
+
+
+_SCALAR_ENCODERS = {
+    "bool": lambda v: struct.pack(">?", v),
+    "int2": lambda v: struct.pack(">h", v),
+    "int4": lambda v: struct.pack(">i", v),
+    "int8": lambda v: struct.pack(">q", v),
+    "float8": lambda v: struct.pack(">d", v),
+    "text": _encode_text,
+    "varchar": _encode_text,
+    "bpchar": _encode_text,
+    "date": _encode_date,
+    "timestamp": _encode_timestamp,
+    "geometry": bytes,
+}
+
+
+def _binary_encoder(column_type, timezone):
+    typname, elemname, elemoid = column_type
+    if elemname:
+        return _array_encoder(elemoid, _binary_encoder((elemname, None, None), timezone))
+    if typname == "timestamptz":
+        return _timestamptz_encoder(timezone)
+    try:
+        return _SCALAR_ENCODERS[typname]
+    except KeyError:
+        raise ValueError(f"Binary COPY does not support column type {typname}")
+
+
+def _binary_chunks(rows, encoders, counter):
+    yield _BINARY_HEADER
+    field_count = struct.pack(">h", len(encoders))
+    for row in rows:
+        parts = [field_count]
+        for value, encode in zip(row, encoders):
+            if value is None:
+                parts.append(_NULL)
+            else:
+                data = encode(value)
+                parts.append(struct.pack(">i", len(data)))
+                parts.append(data)
+        counter[0] += 1
+        yield b"".join(parts)
+    yield _BINARY_TRAILER
+
+
+def _text_chunks(rows, counter):
+    for row in rows:
+        counter[0] += 1
+        yield text_line(row)
+
+
+def copy_rows(
+    cursor, table, columns, rows, format=COPY_TEXT, column_types=None, timezone=None, stats=None,
+):
+    """
+    Streams ``rows`` into ``table`` with one COPY statement
+
+    :param cursor: database cursor (psycopg2 or a Django cursor wrapper)
+    :param table: name of the target table
+    :param columns: column names, in the order of the values in each row
+    :param rows: iterable of tuples
+    :param format: ``COPY_TEXT`` or ``COPY_BINARY``
+    :param column_types: result of ``get_column_types``; looked up when not given
+    :param timezone: timezone for naive datetimes in timestamptz columns (binary only)
+    :param stats: dict that gets the number of ``bytes`` sent
+    :return: number of rows copied
+    """
+    counter = [0]
+    column_list = ", ".join(columns)
+    if format == COPY_BINARY:
+        if column_types is None:
+            column_types = get_column_types(cursor, table)
+        encoders = [_binary_encoder(column_types[c], timezone) for c in columns]
+        chunks = _binary_chunks(rows, encoders, counter)
+        options = "FORMAT binary"
+    elif format == COPY_TEXT:
+        chunks = _text_chunks(rows, counter)
+        options = "FORMAT text"
+    else:
+        raise ValueError(f"Unknown COPY format: {format}")
+
+    stream = _RowStream(chunks)
+    cursor.copy_expert(f"COPY {table} ({column_list}) FROM STDIN WITH ({options})", stream)
+    if stats is not None:
+        stats["bytes"] = stream.size
+    return counter[0]
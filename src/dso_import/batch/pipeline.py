@@ -0,0 +1,98 @@
+"""
+Overlapping the stages of an import: download, parse and write.
+
+- download: ``ImportBagHJob.prepare`` starts downloading the source files of
+  all tasks, in task order, in ``IMPORT_PREFETCH_WORKERS`` threads (see
+  ``objectstore.prefetch``). The file of the next task is downloaded while the
+  current task parses and writes; at most that many files are in flight. A task
+  whose file is still being downloaded waits for it in its stage ``download``.
+- parse: ``pipelined`` runs the parsing and transforming of the rows in a
+  thread and hands its items to the consumer through a bounded queue. The
+  producer works ahead at most ``depth`` items and then waits for the consumer,
+  so memory does not grow when the database is slower than the parsing.
+- write: the consumer writes the rows on the connection of the task, in its
+  transaction. psycopg2 releases the GIL while it waits for the database, so
+  the producer runs meanwhile. The stage ``wait`` is the time it waited for
+  the producer.
+
+These are threads, not an asyncio runner with an async PostgreSQL driver:
+the rows are written through psycopg2 on the Django connection, and a
+checkpoint is committed in the same transaction as the rows of its range.
+A second driver would write outside that transaction, and the tasks and the
+schematools models are synchronous.
+"""
+import queue
+import threading
+
+# Rows per item when a stream of rows is pipelined, see ``chunks``
+CHUNK_ROWS = 5000
+# Seconds between checks whether the consumer stopped, while the queue is full
+POLL_SECONDS = 0.1
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def chunks(iterable, size=CHUNK_ROWS):
+    """Lists of ``size`` items of ``iterable``; the queue would be slow per single row"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def pipelined(items, depth, name="pipeline"):
+    """
+    Yields the items of ``items``, which are produced in a thread. An
+    exception of the producer is raised here; when the consumer stops early
+    the producer stops after its current item.
+
+    :param depth: number of produced items that may wait for the consumer
+    """
+    produced = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                produced.put(item, timeout=POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except BaseException as e:  # noqa raised again in the consumer
+            put(_Failure(e))
+            return
+        finally:
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+        put(_DONE)
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = produced.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
@@ -0,0 +1,143 @@
+"""
+Profiling of tasks, to see where the time of a slow task goes.
+
+Two modes:
+
+* ``cprofile``: the deterministic profiler of the standard library. Exact call
+  counts and times, but every function call is slower. Writes ``<task>.prof``,
+  to be read with ``pstats`` (or e.g. snakeviz).
+* ``sample``: a thread that samples the stack of the task every few
+  milliseconds; the task itself runs at full speed. Writes ``<task>.collapsed``,
+  the collapsed stacks format of flamegraph.pl and speedscope.
+
+Only the thread of the task is profiled, not the worker processes of
+``--processes``. The top functions by own time are added to the metrics of
+the task as ``hotspots``.
+"""
+import cProfile
+import logging
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+PROFILE_CPROFILE = "cprofile"
+PROFILE_SAMPLE = "sample"
+
+SAMPLE_INTERVAL = 0.005
+TOP = 10
+
+# Only one deterministic profiler can be active in a process
+_cprofile_lock = threading.Lock()
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class _Sampler(threading.Thread):
+    """Counts the stacks of a thread, sampled every ``interval`` seconds"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def hotspots(self, top):
+        own = Counter()
+        for stack, count in self.stacks.items():
+            own[stack.rsplit(";", 1)[-1]] += count
+        return [
+            {"function": function, "seconds": round(count * self.interval, 3), "samples": count}
+            for function, count in own.most_common(top)
+        ]
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+
+def _cprofile_hotspots(profile, top):
+    stats = pstats.Stats(profile).stats
+    functions = sorted(stats.items(), key=lambda item: -item[1][2])[:top]
+    functions = [(function, stat) for function, stat in functions if round(stat[2], 3) > 0]
+    return [
+        {
+            "function": f"{name} ({os.path.basename(file_name)}:{line})",
+            "seconds": round(own_time, 3),
+            "calls": calls,
+        }
+        for (file_name, line, name), (_, calls, own_time, _, _) in functions
+    ]
+
+
+class Profiler:
+    """
+    :param mode: ``PROFILE_CPROFILE`` or ``PROFILE_SAMPLE``
+    :param directory: directory for the profile files
+    :param tasks: names of the tasks to profile; all tasks when empty
+    """
+
+    def __init__(self, mode, directory, tasks=None, top=TOP, interval=SAMPLE_INTERVAL):
+        if mode not in (PROFILE_CPROFILE, PROFILE_SAMPLE):
+            raise ValueError(f"Unknown profile mode: {mode}")
+        self.mode = mode
+        self.directory = directory
+        self.tasks = set(tasks or [])
+        self.top = top
+        self.interval = interval
+
+    def profiles(self, task_name):
+        return not self.tasks or task_name in self.tasks
+
+    @contextmanager
+    def profile(self, task_name, task_metrics):
+        """Profiles the block; writes the profile and sets the hotspots of ``task_metrics``"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, task_name)
+        if self.mode == PROFILE_CPROFILE and _cprofile_lock.acquire(blocking=False):
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                _cprofile_lock.release()
+                profile.dump_stats(f"{path}.prof")
+                task_metrics.hotspots = _cprofile_hotspots(profile, self.top)
+                log.info(f"Wrote profile of {task_name} to {path}.prof")
+        else:
+            if self.mode == PROFILE_CPROFILE:
+                log.warning(f"Another task is being profiled; sampling {task_name} instead")
+            sampler = _Sampler(threading.get_ident(), self.interval)
+            sampler.start()
+            try:
+                yield
+            finally:
+                sampler.stop()
+                sampler.write(f"{path}.collapsed")
+                task_metrics.hotspots = sampler.hotspots(self.top)
+                log.info(f"Wrote sampled stacks of {task_name} to {path}.collapsed")
+        for hotspot in task_metrics.hotspots:
+            log.info(f"  {task_name}: {hotspot['seconds']:>8.2f}s {hotspot['function']}")
@@ -0,0 +1,127 @@
+"""
+Compact index of the ids of a table, used to validate references.
+
+An id ``<identificatie>_<volgnummer>`` is packed in one 64-bit integer
+``identificatie * 1000 + volgnummer``; the keys are kept in a sorted numpy
+array, which takes 8 bytes per id instead of the ~100 bytes of a string in a set.
+"""
+import numpy as np
+
+VOLGNUMMER_FACTOR = 1000
+MAX_WIDTH = 16  # 10**16 * 1000 still fits in an unsigned 64-bit integer
+FETCH_SIZE = 50000
+
+
+def _split_id(id):
+    identificatie, _, volgnummer = id.rpartition("_")
+    return identificatie, int(volgnummer)
+
+
+class ReferenceIndex:
+    """
+    Set of ids with vectorized membership tests.
+
+    All identificaties of a table have the same width, so the packed key is
+    unambiguous. Ids that can not be packed (other width, not numeric, volgnummer
+    of 1000 or more) are kept as strings in ``overflow``.
+    """
+
+    def __init__(self, keys=None, width=None, overflow=()):
+        self.keys = np.empty(0, dtype=np.uint64) if keys is None else np.unique(keys)
+        self.width = width
+        self.overflow = set(overflow)
+
+    @classmethod
+    def from_pairs(cls, chunks):
+        """
+        Builds an index from chunks (lists) of ``(identificatie, volgnummer)`` tuples
+        """
+        index = cls()
+        parts = []
+        for chunk in chunks:
+            if not chunk:
+                continue
+            identificaties, volgnummers = zip(*chunk)
+            if index.width is None:
+                index.width = len(identificaties[0])
+            keys, mask = index._pack_many(identificaties, volgnummers)
+            parts.append(keys)
+            index.overflow.update(
+                f"{identificaties[i]}_{volgnummers[i]:03}" for i in np.flatnonzero(~mask)
+            )
+        if parts:
+            index.keys = np.unique(np.concatenate(parts))
+        return index
+
+    @classmethod
+    def load(cls, cursor, table, fetch_size=FETCH_SIZE):
+        """
+        Loads the ids of a table. Use a server side cursor
+        (``connection.chunked_cursor()``), so the rows are fetched in chunks.
+        """
+        cursor.execute(f"SELECT identificatie, volgnummer FROM {table}")
+        return cls.from_pairs(iter(lambda: cursor.fetchmany(fetch_size), []))
+
+    def _pack_many(self, identificaties, volgnummers):
+        """Returns the packed keys and a mask of the positions that could be packed"""
+        volgnummers = np.asarray(volgnummers, dtype=np.int64)
+        width = self.width
+        mask = np.zeros(len(volgnummers), dtype=bool)
+        if width is None or width > MAX_WIDTH or not len(volgnummers):
+            return np.empty(0, dtype=np.uint64), mask
+        try:
+            # One extra byte per value: it is zero when the value is not too long
+            raw = np.asarray(identificaties, dtype=f"S{width + 1}")
+        except UnicodeEncodeError:
+            # Non ascii values can not be packed
+            identificaties = [i if i.isascii() else "" for i in identificaties]
+            raw = np.asarray(identificaties, dtype=f"S{width + 1}")
+        digits = raw.view(np.uint8).reshape(len(raw), width + 1)[:, :width]
+        mask = (
+            ((digits >= ord("0")) & (digits <= ord("9"))).all(axis=1)
+            & (raw.view(np.uint8).reshape(len(raw), width + 1)[:, width] == 0)
+            & (volgnummers >= 0)
+            & (volgnummers < VOLGNUMMER_FACTOR)
+        )
+        powers = np.uint64(10) ** np.arange(width - 1, -1, -1, dtype=np.uint64)
+        keys = (digits[mask] - np.uint8(ord("0"))).astype(np.uint64) @ powers
+        return keys * np.uint64(VOLGNUMMER_FACTOR) + volgnummers[mask].astype(np.uint64), mask
+
+    def contains(self, identificatie, volgnummer):
+        if (
+            len(identificatie) == self.width
+            and self.width <= MAX_WIDTH
+            and identificatie.isdigit()
+            and 0 <= volgnummer < VOLGNUMMER_FACTOR
+        ):
+            key = np.uint64(int(identificatie) * VOLGNUMMER_FACTOR + volgnummer)
+            i = self.keys.searchsorted(key)
+            if i < len(self.keys) and self.keys[i] == key:
+                return True
+        return bool(self.overflow) and f"{identificatie}_{volgnummer:03}" in self.overflow
+
+    def contains_many(self, identificaties, volgnummers):
+        """Vectorized membership test; returns a boolean array"""
+        keys, mask = self._pack_many(identificaties, volgnummers)
+        result = np.zeros(len(mask), dtype=bool)
+        if len(self.keys) and len(keys):
+            positions = self.keys.searchsorted(keys).clip(max=len(self.keys) - 1)
+            result[mask] = self.keys[positions] == keys
+        if self.overflow:
+            for i in np.flatnonzero(~result):
+                result[i] = f"{identificaties[i]}_{int(volgnummers[i]):03}" in self.overflow
+        return result
+
+    def __contains__(self, id):
+        return self.contains(*_split_id(id))
+
+    def __len__(self):
+        return len(self.keys) + len(self.overflow)
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes
+
+    def clear(self):
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.overflow = set()
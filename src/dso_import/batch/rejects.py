@@ -0,0 +1,55 @@
+"""
+Set based validation of references in a staging table.
+
+Rows are loaded without checks; afterwards rows that refer to a non existing
+row are deleted with an anti-join and recorded in ``import_reject``,
+together with the reason.
+"""
+REJECT_TABLE = "import_reject"
+
+
+def create_table(cursor):
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {REJECT_TABLE}
+        (
+            table_name text NOT NULL,
+            id text NOT NULL,
+            reason text NOT NULL,
+            rejected_at timestamp with time zone NOT NULL DEFAULT now()
+        )
+        """
+    )
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {REJECT_TABLE}_table_name ON {REJECT_TABLE}(table_name)"
+    )
+
+
+def clear(cursor, table_name):
+    """Removes the rejects of the previous import of a table"""
+    cursor.execute(f"DELETE FROM {REJECT_TABLE} WHERE table_name = %s", [table_name])
+
+
+def reject_orphans(cursor, table_name, staging_table, column, referenced_table):
+    """
+    Deletes the rows of ``staging_table`` whose ``column`` refers to an id that
+    does not exist in ``referenced_table``.
+
+    :param table_name: table name to record in the reject table
+    :return: list of the ids of the rejected rows
+    """
+    cursor.execute(
+        f"""
+        WITH rejected AS (
+            DELETE FROM {staging_table} t
+            WHERE t.{column} IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM {referenced_table} r WHERE r.id = t.{column})
+            RETURNING t.id, t.{column} AS ref_id
+        )
+        INSERT INTO {REJECT_TABLE} (table_name, id, reason)
+        SELECT %s, id, 'invalid {column} ' || ref_id FROM rejected
+        RETURNING id
+        """,
+        [table_name],
+    )
+    return [id for (id,) in cursor.fetchall()]
@@ -0,0 +1,57 @@
+"""
+Streaming output of N-N relation tables, e.g. verblijfsobject - pand.
+
+A ``RelationSink`` buffers ``(from id, to id)`` pairs and writes them with
+COPY once a batch of pairs is buffered (see ``batching.BatchSize``), so its
+memory use does not grow with the size of the file. The rows get the id
+``<from id>_<to id>``.
+
+The pairs are added while the rows they belong to are produced, which is
+during the COPY of those rows. Nothing is written then: ``flush_full`` is
+called between the batches of the rows (``TableWriter`` ``on_batch``).
+"""
+from contextlib import nullcontext
+
+from dso_import.batch.writer import TableWriter
+
+
+class RelationSink:
+    """
+    :param table: table to write to, with the columns ``id``, ``from_column`` and ``to_column``
+    :param auto_flush: write in ``flush_full`` when the buffer is full. Off in worker
+        processes, and when the rows have to be committed together with other rows (see ``flush``).
+    :param metrics: ``TaskMetrics`` to count the writes, as the stage ``write`` and as batches
+    """
+
+    def __init__(self, table, from_column, to_column, auto_flush=True, metrics=None):
+        self.writer = TableWriter(table, ["id", from_column, to_column], metrics=metrics)
+        self.auto_flush = auto_flush
+        self.metrics = metrics
+        self.rows = []
+        self.count = 0
+
+    def add(self, from_id, to_id):
+        self.rows.append((f"{from_id}_{to_id}", from_id, to_id))
+
+    def flush_full(self):
+        """Writes the buffered rows when a batch is full; not while a statement runs"""
+        if self.auto_flush and len(self.rows) >= self.writer.batch_size.rows:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered rows, on the connection (and in the transaction) of this thread"""
+        if not self.rows:
+            return
+        stage = self.metrics.stage("write") if self.metrics else nullcontext()
+        with stage:
+            self.count += self.writer.write(self.rows)
+        self.rows = []
+
+    def pop(self):
+        """Returns and forgets the buffered rows, e.g. those of a worker process"""
+        rows, self.rows = self.rows, []
+        return rows
+
+    def extend(self, rows):
+        """Adds rows returned by ``pop``"""
+        self.rows.extend(rows)
@@ -0,0 +1,120 @@
+"""
+The tables of a dataset, without building its models.
+
+Building the models of all tables of a dataset from its Amsterdam schema
+takes a good part of the startup of an import, also when only one table is
+imported. The importer needs only the names and columns of the tables:
+``DatasetModels`` keeps those in a JSON file per dataset. The file is used as
+long as the checksum of the schema in the database is unchanged.
+"""
+import json
+import logging
+import os
+import threading
+from collections import namedtuple
+
+from django.db import connection
+
+log = logging.getLogger(__name__)
+
+# fields: (attname, column) of the concrete fields
+Table = namedtuple("Table", "name db_table fields pk srid")
+
+
+def describe(model):
+    fields = model._meta.concrete_fields
+    return {
+        "db_table": model._meta.db_table,
+        "fields": [(field.attname, field.column) for field in fields],
+        "pk": model._meta.pk.attname,
+        "srid": next((f.srid for f in fields if f.attname == "geometrie"), None),
+    }
+
+
+def _table(name, description):
+    fields = [tuple(field) for field in description["fields"]]
+    return Table(name, description["db_table"], fields, description["pk"], description["srid"])
+
+
+class Models(dict):
+    """Models that are given up front, e.g. in a benchmark, like ``DatasetModels``"""
+
+    def table(self, name):
+        return _table(name, describe(self[name]))
+
+    def tables(self):
+        return [self.table(name) for name in self]
+
+
+def _write(path, description):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(description, f)
+    os.replace(temp_path, path)
+
+
+class DatasetModels:
+    """
+    The ``Table`` of every model of a dataset, by model name. The database is
+    read on first use, not when this is created.
+
+    :param cache_dir: directory for the description of the tables; empty: not cached
+    """
+
+    def __init__(self, dataset, cache_dir=None):
+        self.dataset = dataset
+        self.cache_path = os.path.join(cache_dir, f"{dataset}.json") if cache_dir else None
+        self._description = None
+        # Tasks run in threads
+        self._lock = threading.RLock()
+
+    @property
+    def description(self):
+        with self._lock:
+            if self._description is None:
+                self._description = self._load()
+            return self._description
+
+    def _load(self):
+        from schematools.contrib.django.models import Dataset
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT md5(schema_data::text) FROM {Dataset._meta.db_table} WHERE name = %s",
+                [self.dataset],
+            )
+            row = cursor.fetchone()
+        if row is None:
+            raise Dataset.DoesNotExist(f"Dataset {self.dataset} does not exist")
+        (checksum,) = row
+        cached = self._read_cache()
+        if cached is not None and cached["checksum"] == checksum:
+            return cached
+
+        log.info(f"Building the models of dataset {self.dataset}")
+        dataset = Dataset.objects.get(name=self.dataset)
+        models = dataset.create_models()
+        description = {
+            "checksum": checksum,
+            "tables": {model._meta.model_name: describe(model) for model in models},
+        }
+        if self.cache_path:
+            _write(self.cache_path, description)
+        return description
+
+    def _read_cache(self):
+        if not self.cache_path:
+            return None
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def table(self, name):
+        """The ``Table`` of a model, without building the model"""
+        return _table(name, self.description["tables"][name])
+
+    def tables(self):
+        return [self.table(name) for name in self.description["tables"]]
@@ -0,0 +1,45 @@
+"""
+Loading a single large file in shards, each in its own process.
+
+The rows of a file are partitioned by a hash of a key column, e.g.
+identificatie, so all versions of an object are in the same shard. Every
+shard is staged by its own worker process, on its own connection, in its
+own unlogged table (``shard_table``); the shards are combined afterwards.
+"""
+import multiprocessing
+import threading
+import zlib
+
+# State for the worker processes of ``run``, inherited by fork
+_worker = {}
+_fork_lock = threading.Lock()
+
+
+def shard_of(value, shards):
+    """The shard of a key value; the same in every process, unlike ``hash``"""
+    return zlib.crc32(value.encode()) % shards
+
+
+def shard_table(table, shard):
+    return f"{table}_shard{shard}"
+
+
+def _load_shard(shard):
+    return _worker["load_shard"](shard)
+
+
+def run(load_shard, shards):
+    """
+    Calls ``load_shard(shard)`` for every shard in a forked worker process and
+    returns the results (which must be picklable), in the order of the shards.
+
+    The processes share the state of the parent at the moment they are forked,
+    including its database connections: the caller closes its connection
+    first, ``load_shard`` opens (and closes) its own.
+    """
+    context = multiprocessing.get_context("fork")
+    with _fork_lock:
+        _worker.update(load_shard=load_shard)
+        pool = context.Pool(shards)
+    with pool:
+        return pool.map(_load_shard, range(shards), chunksize=1)
@@ -0,0 +1,184 @@
+"""
+Publication of a table by swapping in a completely built copy.
+
+The new table is created like the live table, filled, indexed and analyzed
+while the live table keeps serving reads. Then one short transaction drops
+the live table and renames the new one; indexes and constraints get their
+original names again. Foreign keys, from and to the table, are added back as
+``NOT VALID`` and validated afterwards, which does not block reads or writes.
+
+Views on the table are not recreated; a table with dependent views can not
+be swapped.
+"""
+import logging
+import re
+import time
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+# Maximum time to wait for the lock on the live table
+LOCK_TIMEOUT = "30s"
+
+MAX_NAME_LENGTH = 63
+SUFFIX = "_new"
+
+TableDefinition = namedtuple(
+    "TableDefinition", "table constraints indexes foreign_keys references grants"
+)
+
+_INDEX_DEF = re.compile(r"^(CREATE (?:UNIQUE )?INDEX) \S+ ON (?:ONLY )?\S+ (USING .*)$")
+
+
+def _valid(constraint):
+    """Definition of a constraint without NOT VALID, which ``swap`` adds itself"""
+    return constraint.replace(" NOT VALID", "")
+
+
+def new_name(name):
+    """Temporary name of a table, index or constraint of the new table"""
+    return name[: MAX_NAME_LENGTH - len(SUFFIX)] + SUFFIX
+
+
+def describe(cursor, table):
+    """Reads the indexes, constraints and grants of a table from the catalog"""
+    cursor.execute(
+        """
+        SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'x')
+        ORDER BY contype, conname
+        """,
+        [table],
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(
+        """
+        SELECT i.relname, pg_get_indexdef(x.indexrelid)
+        FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = %s::regclass
+        AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid)
+        ORDER BY i.relname
+        """,
+        [table],
+    )
+    indexes = cursor.fetchall()
+    cursor.execute(
+        """
+        SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype = 'f'
+        ORDER BY conname
+        """,
+        [table],
+    )
+    foreign_keys = [(name, _valid(constraint)) for name, constraint in cursor.fetchall()]
+    cursor.execute(
+        """
+        SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE confrelid = %s::regclass AND conrelid <> confrelid AND contype = 'f'
+        ORDER BY 1, 2
+        """,
+        [table],
+    )
+    references = [
+        (table_name, name, _valid(constraint))
+        for table_name, name, constraint in cursor.fetchall()
+    ]
+    cursor.execute(
+        """
+        SELECT a.grantee::regrole::text, a.privilege_type
+        FROM pg_class c, aclexplode(c.relacl) a
+        WHERE c.oid = %s::regclass AND a.grantee <> c.relowner
+        """,
+        [table],
+    )
+    grants = [
+        ("PUBLIC" if grantee == "-" else grantee, privilege)
+        for grantee, privilege in cursor.fetchall()
+    ]
+    return TableDefinition(table, constraints, indexes, foreign_keys, references, grants)
+
+
+def create_like(cursor, table, new_table):
+    """Creates an empty copy of a table, without indexes and constraints other than checks"""
+    cursor.execute(f"DROP TABLE IF EXISTS {new_table}")
+    cursor.execute(
+        f"""
+        CREATE TABLE {new_table}
+        (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE INCLUDING COMMENTS)
+        """
+    )
+
+
+def fill(cursor, table, new_table, staging_table, key="id", replaced=None, keep_existing=True):
+    """
+    Fills the new table with the staged rows and the rows of the live table
+    that are not replaced
+
+    :param key: column of the live table that identifies replaced rows
+    :param replaced: query of the replaced keys, in a column ``id``; the ids of
+        the staged rows by default
+    :param keep_existing: copy the rows of the live table that are not replaced
+    """
+    if keep_existing:
+        replaced = replaced or f"SELECT id FROM {staging_table}"
+        cursor.execute(
+            f"""
+            INSERT INTO {new_table}
+            SELECT e.* FROM {table} e
+            WHERE NOT EXISTS (SELECT 1 FROM ({replaced}) r WHERE r.id = e.{key})
+            """
+        )
+        log.info(f"Kept from {table} : {cursor.rowcount}")
+    cursor.execute(f"INSERT INTO {new_table} SELECT * FROM {staging_table}")
+    log.info(f"Staged into {new_table} : {cursor.rowcount}")
+
+
+def create_indexes(cursor, definition, new_table):
+    """Creates the constraints and indexes of the live table on the new table, and analyzes it"""
+    for name, constraint in definition.constraints:
+        start = time.perf_counter()
+        cursor.execute(f"ALTER TABLE {new_table} ADD CONSTRAINT {new_name(name)} {constraint}")
+        log.info(f"Created {new_name(name)} in {time.perf_counter() - start:.1f}s")
+    for name, index in definition.indexes:
+        start = time.perf_counter()
+        cursor.execute(_INDEX_DEF.sub(rf"\1 {new_name(name)} ON {new_table} \2", index))
+        log.info(f"Created {new_name(name)} in {time.perf_counter() - start:.1f}s")
+    cursor.execute(f"ANALYZE {new_table}")
+
+
+def swap(cursor, definition, new_table):
+    """
+    Replaces the live table by the new table. Run this in a transaction;
+    afterwards call ``validate_foreign_keys``.
+    """
+    table = definition.table
+    cursor.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+    for referencing_table, name, _ in definition.references:
+        cursor.execute(f"ALTER TABLE {referencing_table} DROP CONSTRAINT {name}")
+    cursor.execute(f"DROP TABLE {table}")
+    cursor.execute(f"ALTER TABLE {new_table} RENAME TO {table}")
+    for name, _ in definition.constraints:
+        cursor.execute(f"ALTER TABLE {table} RENAME CONSTRAINT {new_name(name)} TO {name}")
+    for name, _ in definition.indexes:
+        cursor.execute(f"ALTER INDEX {new_name(name)} RENAME TO {name}")
+    for name, foreign_key in definition.foreign_keys:
+        cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {foreign_key} NOT VALID")
+    for referencing_table, name, foreign_key in definition.references:
+        cursor.execute(
+            f"ALTER TABLE {referencing_table} ADD CONSTRAINT {name} {foreign_key} NOT VALID"
+        )
+    for grantee, privilege in definition.grants:
+        cursor.execute(f"GRANT {privilege} ON {table} TO {grantee}")
+    log.info(f"Swapped {new_table} into {table}")
+
+
+def validate_foreign_keys(cursor, definition):
+    """Validates the foreign keys that ``swap`` added as NOT VALID"""
+    constraints = [(definition.table, name) for name, _ in definition.foreign_keys] + [
+        (referencing_table, name) for referencing_table, name, _ in definition.references
+    ]
+    for table, name in constraints:
+        start = time.perf_counter()
+        cursor.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {name}")
+        log.info(f"Validated {table}.{name} in {time.perf_counter() - start:.1f}s")
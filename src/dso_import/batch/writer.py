@@ -0,0 +1,127 @@
+"""
+Writing rows to a table, without Django models.
+
+A ``TableWriter`` writes plain tuples, in the order of its columns, to a
+named table: a staging table, a reject table or a final table. It holds no
+state outside of itself, so tasks that run at the same time can each write
+to their own table.
+"""
+import time
+from itertools import chain, islice
+
+from django.db import connection
+from django.utils import timezone
+from psycopg2.extras import execute_values
+
+from dso_import.batch import pgcopy
+from dso_import.batch.batching import BatchSize
+
+# Stream the rows with COPY ... FROM STDIN ...
+WRITE_COPY = "copy"
+# ... or insert them with multi-row INSERT statements
+WRITE_INSERT = "insert"
+
+INSERT_PAGE_SIZE = 1000
+# Rows of an INSERT batch whose size is measured, for the average row size
+INSERT_SAMPLE_ROWS = 100
+
+
+class TableWriter:
+    """
+    :param columns: column names, in the order of the values of the rows
+    :param method: ``WRITE_COPY`` or ``WRITE_INSERT``
+    :param copy_format: ``pgcopy.COPY_TEXT`` or ``pgcopy.COPY_BINARY``
+    :param geometry_columns: columns with EWKB values (bytes), for ``WRITE_INSERT``
+    :param batch_size: ``BatchSize`` that sizes the batches; adapts to the rows of this writer by default
+    :param metrics: ``TaskMetrics`` that get the rows, bytes and time of every batch
+    :param on_batch: called after every batch, when no statement runs on the connection;
+        the rows are produced while they are copied, so they cannot write themselves
+    """
+
+    def __init__(
+        self,
+        table,
+        columns,
+        method=WRITE_COPY,
+        copy_format=pgcopy.COPY_TEXT,
+        geometry_columns=(),
+        batch_size=None,
+        metrics=None,
+        on_batch=None,
+    ):
+        if method not in (WRITE_COPY, WRITE_INSERT):
+            raise ValueError(f"Unknown write method: {method}")
+        self.table = table
+        self.columns = list(columns)
+        self.method = method
+        self.copy_format = copy_format
+        self.batch_size = batch_size or BatchSize()
+        self.metrics = metrics
+        self.on_batch = on_batch
+        self.column_types = None
+        self.template = "({})".format(
+            ", ".join(
+                "ST_GeomFromEWKB(%s)" if column in geometry_columns else "%s"
+                for column in self.columns
+            )
+        )
+
+    @classmethod
+    def for_table(cls, table, target=None, **kwargs):
+        """
+        Writer for the columns of a ``schema.Table``
+
+        :param target: table to write to instead, e.g. a staging table with the same columns
+        """
+        columns = [column for _, column in table.fields]
+        geometry_columns = [column for attname, column in table.fields if attname == "geometrie"]
+        return cls(target or table.db_table, columns, geometry_columns=geometry_columns, **kwargs)
+
+    def write(self, rows):
+        """Writes ``rows`` (an iterable of tuples) in batches; returns the number of rows"""
+        rows = iter(rows)
+        count = 0
+        with connection.cursor() as cursor:
+            for first in rows:
+                batch = chain([first], islice(rows, self.batch_size.rows - 1))
+                started = time.perf_counter()
+                if self.method == WRITE_COPY:
+                    written, nbytes = self._copy(cursor, batch)
+                else:
+                    written, nbytes = self._insert(cursor, list(batch))
+                seconds = time.perf_counter() - started
+                self.batch_size.record(written, nbytes, seconds)
+                if self.metrics is not None:
+                    self.metrics.add_batch(written, nbytes, seconds)
+                count += written
+                if self.on_batch is not None:
+                    self.on_batch()
+        return count
+
+    def _copy(self, cursor, rows):
+        if self.copy_format == pgcopy.COPY_BINARY and self.column_types is None:
+            self.column_types = pgcopy.get_column_types(cursor, self.table)
+        stats = {}
+        copied = pgcopy.copy_rows(
+            cursor,
+            self.table,
+            self.columns,
+            rows,
+            format=self.copy_format,
+            column_types=self.column_types,
+            timezone=timezone.get_default_timezone(),
+            stats=stats,
+        )
+        return copied, stats["bytes"]
+
+    def _insert(self, cursor, rows):
+        execute_values(
+            cursor.cursor,
+            f"INSERT INTO {self.table} ({', '.join(self.columns)}) VALUES %s",
+            rows,
+            template=self.template,
+            page_size=INSERT_PAGE_SIZE,
+        )
+        sample = rows[:INSERT_SAMPLE_ROWS]
+        sample_bytes = sum(len(pgcopy.text_line(row)) for row in sample)
+        return len(rows), sample_bytes * len(rows) // len(sample)
@@ -0,0 +1,119 @@
+"""
+Throughput of the row and the columnar transformation of a nummeraanduiding file.
+
+Only the parsing and transformation into COPY rows is measured, no database is
+needed. Run from the src directory::
+
+    python -m dso_import.benchmarks.columnar --size 1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "dso_import.settings")
+django.setup()
+
+from django.contrib.gis.db import models  # noqa: E402
+
+from dso_import.bagh.batch import (  # noqa: E402
+    ENGINE_COLUMNAR,
+    ENGINE_ROWS,
+    LOADER_COPY,
+    NUMMERAANDUIDING_FIELDS,
+    ImportNummeraanduidingTask,
+)
+from dso_import.batch import csv, schema  # noqa: E402
+from dso_import.batch.refindex import ReferenceIndex  # noqa: E402
+from dso_import.benchmarks import gobdata  # noqa: E402
+
+REFERENCES = ["ligplaats", "standplaats", "verblijfsobject", "openbare_ruimte"]
+
+
+class Nummeraanduiding(models.Model):
+    """The columns of bagh_nummeraanduiding, see bagh_create.sql"""
+
+    id = models.CharField(max_length=20, primary_key=True)
+    identificatie = models.CharField(max_length=16)
+    volgnummer = models.SmallIntegerField()
+    registratiedatum = models.DateTimeField(null=True)
+    begin_geldigheid = models.DateField(null=True)
+    eind_geldigheid = models.DateField(null=True)
+    documentdatum = models.DateField(null=True)
+    documentnummer = models.CharField(max_length=100, null=True)
+    aanduiding_in_onderzoek = models.BooleanField(null=True)
+    geconstateerd = models.BooleanField(null=True)
+    huisnummer = models.IntegerField()
+    huisletter = models.CharField(max_length=1, null=True)
+    huisnummer_toevoeging = models.CharField(max_length=4, null=True)
+    postcode = models.CharField(max_length=6, null=True)
+    openbare_ruimte_id = models.CharField(max_length=20, null=True)
+    ligplaats_id = models.CharField(max_length=20, null=True)
+    standplaats_id = models.CharField(max_length=20, null=True)
+    verblijfsobject_id = models.CharField(max_length=20, null=True)
+    type_adres = models.TextField(null=True)
+    status = models.TextField(null=True)
+
+    class Meta:
+        app_label = "dso_import"
+        managed = False
+        db_table = "bagh_nummeraanduiding"
+
+
+def create_task(path, engine, reference_pairs):
+    task = ImportNummeraanduidingTask(
+        path=path,
+        models=schema.Models(nummeraanduiding=Nummeraanduiding),
+        references=REFERENCES,
+        extra_fields=NUMMERAANDUIDING_FIELDS,
+        loader=LOADER_COPY,
+        engine=engine,
+        incremental=False,
+    )
+    for model_name in REFERENCES:
+        task.reference_models[model_name] = ReferenceIndex.from_pairs(
+            [reference_pairs[model_name]]
+        )
+    return task
+
+
+def transform(task):
+    start = time.perf_counter()
+    if task.engine == ENGINE_COLUMNAR:
+        rows = list(csv.process_csv_columns(task.path, task.filename, task.process_batch))
+    else:
+        rows = list(csv.process_csv(task.path, task.filename, task.process_row))
+    return rows, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=1000000)
+    args = parser.parse_args()
+
+    reference_pairs = gobdata.references(args.size)
+    with tempfile.TemporaryDirectory() as path:
+        task = create_task(path, ENGINE_ROWS, reference_pairs)
+        gobdata.write_csv(
+            os.path.join(path, task.filename),
+            gobdata.NUMMERAANDUIDING_HEADER,
+            gobdata.nummeraanduiding_rows(args.size),
+        )
+        results = {}
+        for engine in (ENGINE_ROWS, ENGINE_COLUMNAR):
+            results[engine] = transform(create_task(path, engine, reference_pairs))
+
+    rows, row_time = results[ENGINE_ROWS]
+    columns, column_time = results[ENGINE_COLUMNAR]
+    assert rows == columns, "The engines return different rows"
+
+    print(f"rows: {len(rows)}")
+    print(f"{'engine':<12}{'time (s)':>12}{'rows/s':>14}")
+    for engine, elapsed in ((ENGINE_ROWS, row_time), (ENGINE_COLUMNAR, column_time)):
+        print(f"{engine:<12}{elapsed:>12.2f}{len(rows) / elapsed:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
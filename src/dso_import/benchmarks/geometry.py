@@ -0,0 +1,71 @@
+"""
+Conversion of WKT into EWKB for COPY: GEOS (``geo.get_geotype``) against ``ewkb``.
+
+Run from the src directory::
+
+    python -m dso_import.benchmarks.geometry --size 200000
+"""
+import argparse
+import os
+import random
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "dso_import.settings")
+django.setup()
+
+import numpy as np  # noqa: E402
+
+from dso_import.batch import ewkb, geo  # noqa: E402
+from dso_import.benchmarks import gobdata  # noqa: E402
+
+SRID = 28992
+
+
+def with_geos(wkts, geotype):
+    result = []
+    for wkt in wkts:
+        geometrie = geo.get_geotype(wkt, geotype)
+        geometrie.srid = SRID
+        result.append(bytes(geometrie.ewkb))
+    return result
+
+
+def with_ewkb(wkts, geotype):
+    return [ewkb.from_wkt(wkt, geotype, SRID) for wkt in wkts]
+
+
+def with_ewkb_column(wkts, geotype):
+    return ewkb.from_wkt_column(np.array(wkts, dtype=object), geotype, SRID)[0].tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=200000)
+    parser.add_argument("--points", type=int, default=12)
+    parser.add_argument("--geotype", default="multipolygon", choices=["multipolygon", "polygon"])
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    wkts = [
+        gobdata.polygon_wkt(rnd, args.points, holes=int(i % 4 == 0)) for i in range(args.size)
+    ]
+    results = {}
+    print(f"polygons: {args.size}, points per ring: {args.points + 1}, {args.geotype}")
+    print(f"{'converter':<20}{'time (s)':>12}{'rows/s':>14}")
+    for name, convert in (
+        ("geo.get_geotype", with_geos),
+        ("ewkb.from_wkt", with_ewkb),
+        ("ewkb.from_wkt_column", with_ewkb_column),
+    ):
+        start = time.perf_counter()
+        results[name] = convert(wkts, args.geotype)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<20}{elapsed:>12.2f}{args.size / elapsed:>14.0f}")
+    assert results["geo.get_geotype"] == results["ewkb.from_wkt"], "Different EWKB"
+    assert results["ewkb.from_wkt"] == results["ewkb.from_wkt_column"]
+
+
+if __name__ == "__main__":
+    main()
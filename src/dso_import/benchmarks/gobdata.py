@@ -0,0 +1,538 @@
+"""
+Synthetic GOB CSV files with the layout of the ``ActueelEnHistorie`` exports.
+
+``write_dataset`` writes the files of all tasks of ``ImportBagHJob``, with
+consistent references between them, so a complete import can run against it.
+"""
+import csv
+import math
+import os
+import random
+from datetime import date, timedelta
+
+from dso_import.batch.csv import GOB_CSV_ENCODING
+
+NUMMERAANDUIDING_HEADER = [
+    "identificatie",
+    "volgnummer",
+    "registratiedatum",
+    "beginGeldigheid",
+    "eindGeldigheid",
+    "documentdatum",
+    "documentnummer",
+    "aanduidingInOnderzoek",
+    "geconstateerd",
+    "huisnummer",
+    "huisletter",
+    "huisnummertoevoeging",
+    "postcode",
+    "typeAdres",
+    "status",
+    "ligtAan:BAG.ORE.identificatie",
+    "ligtAan:BAG.ORE.volgnummer",
+    "adresseert:BAG.LPS.identificatie",
+    "adresseert:BAG.LPS.volgnummer",
+    "adresseert:BAG.SPS.identificatie",
+    "adresseert:BAG.SPS.volgnummer",
+    "adresseert:BAG.VOT.identificatie",
+    "adresseert:BAG.VOT.volgnummer",
+]
+
+NUMMERAANDUIDING_PREFIX = 363200000000000
+OPENBARE_RUIMTE_PREFIX = 363300000000000
+VERBLIJFSOBJECT_PREFIX = 363010000000000
+
+
+def _identificatie(prefix, number):
+    return f"{prefix + number:016}"
+
+
+def _versions(number, first_day):
+    """Begin and end dates of the versions of an object, the last one is current"""
+    begin = first_day + timedelta(days=number % 5000)
+    for volgnummer in range(1, number % 3 + 2):
+        end = begin + timedelta(days=30 + number % 700)
+        yield volgnummer, begin, end
+        begin = end
+
+
+def nummeraanduiding_rows(size, first_day=date(2000, 1, 1), seed=0):
+    """
+    Generates ``size`` nummeraanduiding rows (lists in the order of the header)
+    for ``size // 2`` objects with one to three versions. Every nummeraanduiding
+    refers to an openbare ruimte and a verblijfsobject; see ``references``.
+    """
+    rnd = random.Random(seed)
+    count = 0
+    number = 0
+    while count < size:
+        number += 1
+        versions = list(_versions(number, first_day))
+        for volgnummer, begin, end in versions:
+            if count >= size:
+                return
+            current = volgnummer == len(versions)
+            yield [
+                _identificatie(NUMMERAANDUIDING_PREFIX, number),
+                str(volgnummer),
+                f"{begin.isoformat()}T{rnd.randint(0, 23):02}:{rnd.randint(0, 59):02}:00.000000",
+                begin.isoformat(),
+                "" if current else end.isoformat(),
+                begin.isoformat(),
+                f"GV{number:08}",
+                "N",
+                rnd.choice(["J", "N", ""]),
+                str(rnd.randint(1, 500)),
+                rnd.choice(["", "", "A", "B"]),
+                rnd.choice(["", "", "", "1", "H"]),
+                f"10{number % 100:02}{chr(65 + number % 26)}{chr(65 + number // 26 % 26)}",
+                "Hoofdadres",
+                "Naamgeving uitgegeven",
+                _identificatie(OPENBARE_RUIMTE_PREFIX, number % 1000),
+                "1",
+                "",
+                "",
+                "",
+                "",
+                _identificatie(VERBLIJFSOBJECT_PREFIX, number),
+                "1",
+            ]
+            count += 1
+
+
+def polygon_wkt(rnd, points=12, holes=0):
+    """WKT of a random polygon in the Amsterdam area (RD coordinates)"""
+    x = rnd.uniform(110000, 135000)
+    y = rnd.uniform(476000, 494000)
+
+    def ring(cx, cy, radius):
+        coordinates = []
+        for i in range(points):
+            angle = 2 * math.pi * i / points
+            r = radius * rnd.uniform(0.7, 1.0)
+            coordinates.append(f"{cx + r * math.cos(angle):.3f} {cy + r * math.sin(angle):.3f}")
+        coordinates.append(coordinates[0])
+        return "(" + ",".join(coordinates) + ")"
+
+    rings = [ring(x, y, 20)] + [ring(x, y, 2 + i) for i in range(holes)]
+    return "POLYGON(" + ",".join(rings) + ")"
+
+
+def references(size):
+    """The (identificatie, volgnummer) pairs the nummeraanduidingen refer to, per model"""
+    return {
+        "openbare_ruimte": [
+            (_identificatie(OPENBARE_RUIMTE_PREFIX, n), 1) for n in range(min(size, 1000))
+        ],
+        "verblijfsobject": [
+            (_identificatie(VERBLIJFSOBJECT_PREFIX, n), 1) for n in range(1, size + 1)
+        ],
+        "ligplaats": [],
+        "standplaats": [],
+    }
+
+
+def write_csv(file_path, header, rows):
+    with open(file_path, "w", encoding=GOB_CSV_ENCODING, newline="") as f:
+        writer = csv.writer(f, delimiter=";", quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def point_wkt(rnd):
+    return f"POINT({rnd.uniform(110000, 135000):.3f} {rnd.uniform(476000, 494000):.3f})"
+
+
+HISTORY_HEADER = [
+    "identificatie",
+    "volgnummer",
+    "registratiedatum",
+    "beginGeldigheid",
+    "eindGeldigheid",
+]
+DOCUMENT_HEADER = ["documentdatum", "documentnummer"]
+ONDERZOEK_HEADER = ["aanduidingInOnderzoek", "geconstateerd"]
+
+
+def _reference_header(*prefixes):
+    return [f"{prefix}.{name}" for prefix in prefixes for name in ("identificatie", "volgnummer")]
+
+
+# Header of every source file; the column names are those of the GOB exports
+HEADERS = {
+    "woonplaats": HISTORY_HEADER
+    + ONDERZOEK_HEADER
+    + ["naam"]
+    + DOCUMENT_HEADER
+    + ["status", "geometrie"]
+    + _reference_header("ligtIn:BRK.GME"),
+    "stadsdeel": HISTORY_HEADER
+    + ["code", "naam"]
+    + DOCUMENT_HEADER
+    + ["geometrie"]
+    + _reference_header("ligtIn:BRK.GME"),
+    "ggw_gebied": HISTORY_HEADER
+    + ["code", "naam"]
+    + DOCUMENT_HEADER
+    + ["geometrie"]
+    + _reference_header("ligtIn:GBD.SDL"),
+    "ggw_praktijkgebied": HISTORY_HEADER
+    + ["code", "naam"]
+    + DOCUMENT_HEADER
+    + ["geometrie"]
+    + _reference_header("ligtIn:GBD.SDL"),
+    "wijk": HISTORY_HEADER
+    + ["code", "naam", "cbsCode"]
+    + DOCUMENT_HEADER
+    + ["geometrie"]
+    + _reference_header("ligtIn:GBD.SDL", "ligtIn:GBD.GGW"),
+    "buurt": HISTORY_HEADER
+    + ["code", "naam", "cbsCode"]
+    + DOCUMENT_HEADER
+    + ["geometrie"]
+    + _reference_header("ligtIn:GBD.WIJK", "ligtIn:GBD.GGW", "ligtIn:GBD.SDL"),
+    "bouwblok": HISTORY_HEADER + ["code", "geometrie"] + _reference_header("ligtIn:GBD.BRT"),
+    "openbare_ruimte": HISTORY_HEADER
+    + ONDERZOEK_HEADER
+    + ["naam", "naamNEN", "type"]
+    + DOCUMENT_HEADER
+    + ["status", "geometrie"]
+    + _reference_header("ligtIn:BAG.WPS"),
+    "ligplaats": HISTORY_HEADER
+    + ONDERZOEK_HEADER
+    + DOCUMENT_HEADER
+    + ["status", "geometrie"]
+    + _reference_header("heeftIn:BAG.NAG", "ligtIn:GBD.BRT"),
+    "standplaats": HISTORY_HEADER
+    + ONDERZOEK_HEADER
+    + DOCUMENT_HEADER
+    + ["status", "geometrie"]
+    + _reference_header("heeftIn:BAG.NAG", "ligtIn:GBD.BRT"),
+    "pand": HISTORY_HEADER
+    + ONDERZOEK_HEADER
+    + DOCUMENT_HEADER
+    + [
+        "status",
+        "oorspronkelijkBouwjaar",
+        "naam",
+        "ligging",
+        "typeWoonobject",
+        "aantalBouwlagen",
+        "hoogsteBouwlaag",
+        "laagsteBouwlaag",
+        "geometrie",
+    ]
+    + _reference_header("ligtIn:GBD.BBK"),
+    "verblijfsobject": HISTORY_HEADER
+    + ONDERZOEK_HEADER
+    + DOCUMENT_HEADER
+    + [
+        "status",
+        "oppervlakte",
+        "verdiepingToegang",
+        "hoogsteBouwlaag",
+        "laagsteBouwlaag",
+        "aantalKamers",
+        "eigendomsverhouding",
+        "gebruiksdoel",
+        "gebruiksdoelWoonfunctie",
+        "gebruiksdoelGezondheidszorgfunctie",
+        "toegang",
+        "redenopvoer",
+        "heeftIn:BAG.NAG.identificatieHoofdadres",
+        "heeftIn:BAG.NAG.volgnummerHoofdadres",
+        "heeftIn:BAG.NAG.identificatieNevenadres",
+        "heeftIn:BAG.NAG.volgnummerNevenadres",
+        "geometrie",
+    ]
+    + _reference_header("ligtIn:GBD.BRT", "ligtIn:BAG.PND"),
+    "nummeraanduiding": NUMMERAANDUIDING_HEADER,
+}
+
+# Identificatie prefix and width per model
+IDENTIFICATIES = {
+    "woonplaats": (3593, 4),
+    "stadsdeel": (3630000000000, 14),
+    "ggw_gebied": (3630950000000, 14),
+    "ggw_praktijkgebied": (3630960000000, 14),
+    "wijk": (3630010000000, 14),
+    "buurt": (3630020000000, 14),
+    "bouwblok": (3630030000000, 14),
+    "openbare_ruimte": (OPENBARE_RUIMTE_PREFIX, 16),
+    "ligplaats": (363020000000000, 16),
+    "standplaats": (363030000000000, 16),
+    "pand": (363100000000000, 16),
+    "verblijfsobject": (VERBLIJFSOBJECT_PREFIX, 16),
+    "nummeraanduiding": (NUMMERAANDUIDING_PREFIX, 16),
+}
+
+GEMEENTE = "0363"
+
+# Models of the GBD (gebieden) exports, the others are BAG
+GEBIEDEN = {"stadsdeel", "ggw_gebied", "ggw_praktijkgebied", "wijk", "buurt", "bouwblok"}
+
+
+def object_counts(size):
+    """
+    Number of objects per model for ``size`` nummeraanduidingen, in about the
+    proportions of Amsterdam. Every object has one to three versions.
+    """
+    return {
+        "woonplaats": 2,
+        "stadsdeel": 8,
+        "ggw_gebied": 22,
+        "ggw_praktijkgebied": 25,
+        "wijk": max(10, size // 5000),
+        "buurt": max(20, size // 1000),
+        "bouwblok": max(50, size // 100),
+        "openbare_ruimte": max(20, size // 70),
+        "ligplaats": max(5, size // 200),
+        "standplaats": max(5, size // 1000),
+        "pand": max(10, size // 3),
+        "verblijfsobject": max(10, size * 9 // 10),
+        "nummeraanduiding": size,
+    }
+
+
+class _Dataset:
+    """Generates the rows (dicts) of the source files, see ``write_dataset``"""
+
+    def __init__(self, counts, first_day, seed):
+        self.counts = counts
+        self.first_day = first_day
+        self.rnd = random.Random(seed)
+
+    def identificatie(self, model_name, number):
+        prefix, width = IDENTIFICATIES[model_name]
+        return f"{prefix + number:0{width}}"
+
+    def reference(self, prefix, model_name, number):
+        """Columns of a reference to an object of ``model_name``, ``number`` wraps around"""
+        number = (number - 1) % self.counts[model_name] + 1
+        return {
+            f"{prefix}.identificatie": self.identificatie(model_name, number),
+            f"{prefix}.volgnummer": "1",
+        }
+
+    def document(self, number):
+        return {"documentdatum": self.first_day.isoformat(), "documentnummer": f"GV{number:08}"}
+
+    def onderzoek(self):
+        return {"aanduidingInOnderzoek": "N", "geconstateerd": self.rnd.choice(["J", "N", ""])}
+
+    def rows(self, model_name):
+        columns = getattr(self, model_name)
+        for number in range(1, self.counts[model_name] + 1):
+            versions = list(_versions(number, self.first_day))
+            for volgnummer, begin, end in versions:
+                row = {
+                    "identificatie": self.identificatie(model_name, number),
+                    "volgnummer": str(volgnummer),
+                    "registratiedatum": f"{begin.isoformat()}T{self.rnd.randint(0, 23):02}"
+                    f":{self.rnd.randint(0, 59):02}:00.000000",
+                    "beginGeldigheid": begin.isoformat(),
+                    "eindGeldigheid": "" if volgnummer == len(versions) else end.isoformat(),
+                }
+                row.update(columns(number))
+                yield row
+
+    def woonplaats(self, number):
+        return {
+            **self.onderzoek(),
+            "naam": ["Amsterdam", "Weesp"][(number - 1) % 2],
+            **self.document(number),
+            "status": "Woonplaats aangewezen",
+            "geometrie": polygon_wkt(self.rnd, points=64),
+            "ligtIn:BRK.GME.identificatie": GEMEENTE,
+            "ligtIn:BRK.GME.volgnummer": "1",
+        }
+
+    def gebied(self, number, code, naam):
+        return {
+            "code": code,
+            "naam": naam,
+            **self.document(number),
+            "geometrie": polygon_wkt(self.rnd, points=48),
+        }
+
+    def stadsdeel(self, number):
+        return {
+            **self.gebied(number, chr(64 + number), f"Stadsdeel {number}"),
+            "ligtIn:BRK.GME.identificatie": GEMEENTE,
+            "ligtIn:BRK.GME.volgnummer": "1",
+        }
+
+    def ggw_gebied(self, number):
+        return {
+            **self.gebied(number, f"DX{number:02}", f"Gebied {number}"),
+            **self.reference("ligtIn:GBD.SDL", "stadsdeel", number),
+        }
+
+    def ggw_praktijkgebied(self, number):
+        return {
+            **self.gebied(number, f"PX{number:02}", f"Praktijkgebied {number}"),
+            **self.reference("ligtIn:GBD.SDL", "stadsdeel", number),
+        }
+
+    def wijk(self, number):
+        return {
+            **self.gebied(
+                number, f"{chr(65 + number // 100 % 26)}{number % 100:02}", f"Wijk {number}"
+            ),
+            "cbsCode": f"WK0363{number % 1000:03}",
+            **self.reference("ligtIn:GBD.SDL", "stadsdeel", number),
+            **self.reference("ligtIn:GBD.GGW", "ggw_gebied", number),
+        }
+
+    def buurt(self, number):
+        return {
+            **self.gebied(
+                number,
+                f"{chr(65 + number // 2600 % 26)}{number // 26 % 100:02}{chr(97 + number % 26)}",
+                f"Buurt {number}",
+            ),
+            "cbsCode": f"BU0363{number:04}",
+            **self.reference("ligtIn:GBD.WIJK", "wijk", number),
+            **self.reference("ligtIn:GBD.GGW", "ggw_gebied", number),
+            **self.reference("ligtIn:GBD.SDL", "stadsdeel", number),
+        }
+
+    def bouwblok(self, number):
+        return {
+            "code": f"{chr(65 + number // 2600 % 26)}{chr(65 + number // 100 % 26)}"
+            f"{number % 100:02}",
+            "geometrie": polygon_wkt(self.rnd, points=16),
+            **self.reference("ligtIn:GBD.BRT", "buurt", number),
+        }
+
+    def openbare_ruimte(self, number):
+        naam = f"Straat {number}"
+        return {
+            **self.onderzoek(),
+            "naam": naam,
+            "naamNEN": naam,
+            "type": "Weg",
+            **self.document(number),
+            "status": "Naamgeving uitgegeven",
+            "geometrie": polygon_wkt(self.rnd, points=24),
+            **self.reference("ligtIn:BAG.WPS", "woonplaats", number),
+        }
+
+    def plaats(self, number):
+        return {
+            **self.onderzoek(),
+            **self.document(number),
+            "status": "Plaats aangewezen",
+            "geometrie": polygon_wkt(self.rnd, points=8),
+            **self.reference("heeftIn:BAG.NAG", "nummeraanduiding", number),
+            **self.reference("ligtIn:GBD.BRT", "buurt", number),
+        }
+
+    def ligplaats(self, number):
+        return self.plaats(number)
+
+    def standplaats(self, number):
+        return self.plaats(number)
+
+    def pand(self, number):
+        return {
+            **self.onderzoek(),
+            **self.document(number),
+            "status": "Pand in gebruik",
+            "oorspronkelijkBouwjaar": str(self.rnd.randint(1600, 2020)),
+            "naam": "",
+            "ligging": self.rnd.choice(["Vrijstaand", "Tussenwoning", "Hoekwoning"]),
+            "typeWoonobject": self.rnd.choice(["", "Eengezinswoning", "Meergezinswoning"]),
+            "aantalBouwlagen": str(self.rnd.randint(1, 12)),
+            "hoogsteBouwlaag": str(self.rnd.randint(0, 11)),
+            "laagsteBouwlaag": "0",
+            "geometrie": polygon_wkt(self.rnd, points=12, holes=int(number % 20 == 0)),
+            **self.reference("ligtIn:GBD.BBK", "bouwblok", number),
+        }
+
+    def verblijfsobject(self, number):
+        # Some have a nevenadres, from the nummeraanduidingen without a verblijfsobject
+        nevenadres = self.counts["verblijfsobject"] + number // 10
+        if number % 10 == 0 and nevenadres <= self.counts["nummeraanduiding"]:
+            nevenadressen = [nevenadres]
+        else:
+            nevenadressen = []
+        panden = self.counts["pand"]
+        pand_numbers = sorted({(number - 1) % panden + 1, (number * 7) % panden + 1})
+        if number % 4:
+            pand_numbers = pand_numbers[:1]
+        return {
+            **self.onderzoek(),
+            **self.document(number),
+            "status": "Verblijfsobject in gebruik",
+            "oppervlakte": str(self.rnd.randint(15, 250)),
+            "verdiepingToegang": str(self.rnd.randint(0, 10)),
+            "hoogsteBouwlaag": str(self.rnd.randint(0, 10)),
+            "laagsteBouwlaag": "0",
+            "aantalKamers": self.rnd.choice(["", "1", "2", "3", "4", "5"]),
+            "eigendomsverhouding": self.rnd.choice(["Huur", "Eigendom", ""]),
+            "gebruiksdoel": self.rnd.choice(["woonfunctie", "woonfunctie|winkelfunctie"]),
+            "gebruiksdoelWoonfunctie": self.rnd.choice(["", "Zelfstandige woning"]),
+            "gebruiksdoelGezondheidszorgfunctie": "",
+            "toegang": self.rnd.choice(["", "Trap", "Lift|Trap"]),
+            "redenopvoer": self.rnd.choice(["", "Nieuwbouw"]),
+            "heeftIn:BAG.NAG.identificatieHoofdadres": self.identificatie(
+                "nummeraanduiding", (number - 1) % self.counts["nummeraanduiding"] + 1
+            ),
+            "heeftIn:BAG.NAG.volgnummerHoofdadres": "1",
+            "heeftIn:BAG.NAG.identificatieNevenadres": "|".join(
+                self.identificatie("nummeraanduiding", n) for n in nevenadressen
+            ),
+            "heeftIn:BAG.NAG.volgnummerNevenadres": "|".join("1" for _ in nevenadressen),
+            "geometrie": point_wkt(self.rnd),
+            **self.reference("ligtIn:GBD.BRT", "buurt", number),
+            "ligtIn:BAG.PND.identificatie": "|".join(
+                self.identificatie("pand", n) for n in pand_numbers
+            ),
+            "ligtIn:BAG.PND.volgnummer": "|".join("1" for _ in pand_numbers),
+        }
+
+    def nummeraanduiding(self, number):
+        row = {
+            **self.document(number),
+            **self.onderzoek(),
+            "huisnummer": str(self.rnd.randint(1, 500)),
+            "huisletter": self.rnd.choice(["", "", "A", "B"]),
+            "huisnummertoevoeging": self.rnd.choice(["", "", "", "1", "H"]),
+            "postcode": f"10{number % 100:02}{chr(65 + number % 26)}{chr(65 + number // 26 % 26)}",
+            "typeAdres": "Hoofdadres",
+            "status": "Naamgeving uitgegeven",
+            **self.reference("ligtAan:BAG.ORE", "openbare_ruimte", number),
+        }
+        # A nummeraanduiding is the address of a ligplaats, a standplaats or a verblijfsobject
+        if number % 200 == 0:
+            row.update(self.reference("adresseert:BAG.LPS", "ligplaats", number // 200))
+        elif number % 1000 == 1:
+            row.update(self.reference("adresseert:BAG.SPS", "standplaats", number // 1000 + 1))
+        else:
+            row.update(self.reference("adresseert:BAG.VOT", "verblijfsobject", number))
+        return row
+
+
+def write_dataset(path, size, first_day=date(2000, 1, 1), seed=0):
+    """
+    Writes the source files of all tasks of ``ImportBagHJob`` to ``path``, for
+    ``size`` nummeraanduidingen (see ``object_counts``). Returns the number of
+    rows per model.
+    """
+    dataset = _Dataset(object_counts(size), first_day, seed)
+    rows = {}
+    for model_name, header in HEADERS.items():
+        gob_id = "GBD" if model_name in GEBIEDEN else "BAG"
+        file_path = os.path.join(path, f"{gob_id}_{model_name}_ActueelEnHistorie.csv")
+        with open(file_path, "w", encoding=GOB_CSV_ENCODING, newline="") as f:
+            writer = csv.DictWriter(
+                f, header, delimiter=";", quotechar='"', quoting=csv.QUOTE_MINIMAL
+            )
+            writer.writeheader()
+            count = 0
+            for row in dataset.rows(model_name):
+                writer.writerow(row)
+                count += 1
+        rows[model_name] = count
+    return rows
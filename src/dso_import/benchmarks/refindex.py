@@ -0,0 +1,79 @@
+"""
+Memory benchmark of the reference index against a set of id strings.
+
+Run from the src directory::
+
+    python -m dso_import.benchmarks.refindex --size 500000
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from dso_import.batch.refindex import ReferenceIndex
+
+
+def synthetic_pairs(size, versions=3):
+    """(identificatie, volgnummer) pairs like BAG ids, with a few versions each"""
+    pairs = []
+    identificatie = 363010000000000
+    while len(pairs) < size:
+        identificatie += random.randint(1, 20)
+        for volgnummer in range(1, random.randint(1, versions) + 1):
+            pairs.append((f"{identificatie:016}", volgnummer))
+    return pairs[:size]
+
+
+def measure(build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def lookup_time(contains, pairs):
+    start = time.perf_counter()
+    for identificatie, volgnummer in pairs:
+        contains(identificatie, volgnummer)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=500000)
+    parser.add_argument("--chunk", type=int, default=50000)
+    args = parser.parse_args()
+
+    pairs = synthetic_pairs(args.size)
+    ids = [f"{i}_{v:03}" for i, v in pairs]
+    probes = random.sample(pairs, min(len(pairs), 100000))
+
+    id_set, set_bytes, set_time = measure(lambda: set(f"{i}_{v:03}" for i, v in pairs))
+    index, index_bytes, index_time = measure(
+        lambda: ReferenceIndex.from_pairs(
+            pairs[i:i + args.chunk] for i in range(0, len(pairs), args.chunk)
+        )
+    )
+    assert len(index) == len(id_set) == len(set(ids))
+
+    set_lookup = lookup_time(lambda i, v: f"{i}_{v:03}" in id_set, probes)
+    index_lookup = lookup_time(index.contains, probes)
+    start = time.perf_counter()
+    assert index.contains_many(*zip(*probes)).all()
+    index_batch_lookup = time.perf_counter() - start
+
+    print(f"ids: {len(id_set)}, lookups: {len(probes)}")
+    print(f"{'':<16}{'memory (MB)':>14}{'build (s)':>12}{'lookups (s)':>14}")
+    print(f"{'set of str':<16}{set_bytes / 2**20:>14.1f}{set_time:>12.2f}{set_lookup:>14.3f}")
+    print(
+        f"{'ReferenceIndex':<16}{index_bytes / 2**20:>14.1f}{index_time:>12.2f}"
+        f"{index_lookup:>14.3f}"
+    )
+    print(f"{'  contains_many':<42}{index_batch_lookup:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from django.core.management import BaseCommand
+
+from dso_import import settings
+from dso_import.bagh.batch import ImportBagHJob
+from dso_import.batch import batch, metrics
+from dso_import.benchmarks import gobdata
+
+log = logging.getLogger(__name__)
+
+STAGES = ["cache", "parse", "transform", "wait", "write", "validate", "date_checks", "merge"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a synthetic BAG/GBD dataset and report the throughput per task. "
+        "Recreates the bagh tables: run it against a local database only."
+    )
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            type=int,
+            default=100000,
+            help="Number of nummeraanduidingen; the other objects are in proportion",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the generated data")
+        parser.add_argument(
+            "--data-dir",
+            help="Directory for the generated files, which are kept (default: a temporary directory)",
+        )
+        parser.add_argument(
+            "--skip-generate",
+            action="store_true",
+            help="Use the files that are already in --data-dir",
+        )
+        parser.add_argument("--workers", type=int, default=settings.IMPORT_WORKERS)
+        parser.add_argument("--processes", type=int, default=settings.IMPORT_PROCESSES)
+        parser.add_argument("--shards", type=int, default=settings.IMPORT_SHARDS)
+        parser.add_argument("--loader", choices=["copy", "insert"], default=settings.IMPORT_LOADER)
+        parser.add_argument(
+            "--copy-format", choices=["text", "binary"], default=settings.IMPORT_COPY_FORMAT
+        )
+        parser.add_argument(
+            "--validation", choices=["memory", "database"], default=settings.IMPORT_VALIDATION
+        )
+        parser.add_argument("--engine", choices=["rows", "columnar"], default=settings.IMPORT_ENGINE)
+        parser.add_argument("--publish", choices=["merge", "swap"], default=settings.IMPORT_PUBLISH)
+        parser.add_argument(
+            "--column-cache",
+            action="store_true",
+            help="Cache the parsed columns in --data-dir/cache; a second run with --skip-generate reads them",
+        )
+        parser.add_argument("--pipeline-depth", type=int, default=settings.IMPORT_PIPELINE_DEPTH)
+        parser.add_argument("--output", help="Write the report as JSON")
+        parser.add_argument(
+            "--metrics-textfile", help="Write the metrics in the Prometheus textfile format"
+        )
+        parser.add_argument(
+            "--baseline", help="Report of an earlier run (--output) to compare the throughput with"
+        )
+
+    def handle(self, *args, **options):
+        if options["skip_generate"] and not options["data_dir"]:
+            self.stderr.write("--skip-generate needs --data-dir")
+            return
+        data_dir = options["data_dir"] or tempfile.mkdtemp(prefix="dso_import_benchmark_")
+        try:
+            report = self.run(data_dir, options)
+        finally:
+            if not options["data_dir"]:
+                shutil.rmtree(data_dir)
+
+        if options["output"]:
+            metrics.write_json(report, options["output"])
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = {task["task"]: task for task in json.load(f)["tasks"]}
+        self.print_report(report, baseline)
+
+    def run(self, data_dir, options):
+        if options["skip_generate"]:
+            rows = None
+        else:
+            log.info(f"Generating {options['size']} nummeraanduidingen in {data_dir}")
+            rows = gobdata.write_dataset(data_dir, options["size"], seed=options["seed"])
+        job_options = {
+            name: options[name]
+            for name in (
+                "processes",
+                "shards",
+                "loader",
+                "copy_format",
+                "validation",
+                "engine",
+                "publish",
+                "column_cache",
+                "pipeline_depth",
+            )
+        }
+        job = ImportBagHJob(
+            data_dir=data_dir,
+            download=False,
+            prefetch_workers=0,
+            incremental=False,
+            column_cache_dir=os.path.join(data_dir, "cache"),
+            **job_options,
+        )
+        report = batch.execute(
+            job,
+            "create_tables",
+            workers=options["workers"],
+            metrics_textfile=options["metrics_textfile"],
+        )
+        parameters = {
+            "size": options["size"],
+            "seed": options["seed"],
+            "workers": options["workers"],
+            **job_options,
+        }
+        report["benchmark"] = {"parameters": parameters, "rows": rows}
+        return report
+
+    def print_report(self, report, baseline):
+        header = f"{'task':<20}{'rows':>10}{'seconds':>10}{'rows/s':>10}"
+        header += "".join(f"{stage:>12}" for stage in STAGES)
+        if baseline:
+            header += f"{'vs baseline':>13}"
+        self.stdout.write(header)
+        for task in report["tasks"]:
+            line = f"{task['task']:<20}{task['rows']:>10}{task['seconds']:>10.1f}"
+            line += f"{task['rows_per_second']:>10.0f}"
+            line += "".join(f"{task['stages'].get(stage, 0.0):>12.2f}" for stage in STAGES)
+            previous = baseline.get(task["task"]) if baseline else None
+            if previous and previous["rows_per_second"]:
+                change = task["rows_per_second"] / previous["rows_per_second"] - 1
+                line += f"{change:>+13.1%}"
+            self.stdout.write(line)
+        self.stdout.write(
+            f"total {report['seconds']:.1f}s, peak RSS {report['peak_rss_bytes'] / 2 ** 20:.0f} MB"
+        )
@@ -3,7 +3,8 @@ import sys
 
 from django.core.management import BaseCommand
 
-from dso_import.batch import batch
+from dso_import import settings
+from dso_import.batch import batch, profiling
 from dso_import.bagh.batch import ImportBagHJob
 
 log = logging.getLogger(__name__)
@@ -31,8 +32,133 @@ class Command(BaseCommand):
         parser.add_argument(
             "--bagh_start",
             nargs=1,
-            default=['gemeente'],
-            help="Start task for import",
+            default=None,
+            help="Start task for import; starts fresh instead of resuming an interrupted import",
+        )
+
+        parser.add_argument(
+            "--create",
+            action="store_true",
+            help="Recreate the tables and load everything (starts at create_tables)",
+        )
+
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.IMPORT_WORKERS,
+            help="Number of independent tasks to run at the same time",
+        )
+
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=settings.IMPORT_PROCESSES,
+            help="Number of processes that parse and transform the rows of a file",
+        )
+
+        parser.add_argument(
+            "--shards",
+            type=int,
+            default=settings.IMPORT_SHARDS,
+            help="Number of processes that each stage a part of a file, partitioned by identificatie",
+        )
+
+        parser.add_argument(
+            "--validation",
+            choices=["memory", "database"],
+            default=settings.IMPORT_VALIDATION,
+            help="Validate references per row in memory, or afterwards in the database",
+        )
+
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            default=settings.IMPORT_INCREMENTAL,
+            help="Skip unchanged files and only stage added or changed rows",
+        )
+
+        parser.add_argument(
+            "--engine",
+            choices=["rows", "columnar"],
+            default=settings.IMPORT_ENGINE,
+            help="Transform the rows one by one, or vectorized in batches of columns",
+        )
+
+        parser.add_argument(
+            "--publish",
+            choices=["merge", "swap"],
+            default=settings.IMPORT_PUBLISH,
+            help="Merge changes into the live tables, or build new tables and swap them in",
+        )
+
+        parser.add_argument(
+            "--date-checks",
+            choices=["all", "touched"],
+            default=settings.IMPORT_DATE_CHECKS,
+            help="Check the dates of all rows, or only of identificaties with changed rows",
+        )
+
+        parser.add_argument(
+            "--column-cache",
+            action="store_true",
+            default=settings.IMPORT_COLUMN_CACHE,
+            help="Read the source files from a local Arrow cache (columnar engine; needs pyarrow)",
+        )
+
+        parser.add_argument(
+            "--pipeline-depth",
+            type=int,
+            default=settings.IMPORT_PIPELINE_DEPTH,
+            help="Batches of rows parsed ahead of the writes, in a thread (0: parse and write in turn)",
+        )
+
+        parser.add_argument(
+            "--checkpoint",
+            action="store_true",
+            default=settings.IMPORT_CHECKPOINT,
+            help="Record progress, so running the import again resumes where it was interrupted",
+        )
+
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Discard the progress of an interrupted import instead of resuming it",
+        )
+
+        parser.add_argument(
+            "--skip-download",
+            action="store_true",
+            help="Import the files that are in DATA_DIR, without checking the object store",
+        )
+
+        parser.add_argument(
+            "--metrics-file",
+            default=settings.IMPORT_METRICS_FILE,
+            help="Write the metrics report (timings per task and stage, rows/s, memory) as JSON",
+        )
+
+        parser.add_argument(
+            "--metrics-textfile",
+            default=settings.IMPORT_METRICS_TEXTFILE,
+            help="Write the metrics in the Prometheus textfile format",
+        )
+
+        parser.add_argument(
+            "--profile",
+            choices=[profiling.PROFILE_CPROFILE, profiling.PROFILE_SAMPLE],
+            help="Profile the tasks, deterministically (cprofile) or by sampling the stack",
+        )
+
+        parser.add_argument(
+            "--profile-tasks",
+            nargs="+",
+            help="Names of the tasks to profile (default: all)",
+        )
+
+        parser.add_argument(
+            "--profile-dir",
+            default=settings.IMPORT_PROFILE_DIR,
+            help="Directory for the profile files, one per task",
         )
 
     def handle(self, *args, **options):
@@ -45,7 +171,43 @@ class Command(BaseCommand):
 
         sets = [ds for ds in self.ordered if ds in datasets]  # enforce order
 
-        start_task = options['bagh_start'][0]
+        if options["create"]:
+            start_task = "create_tables"
+        elif options["bagh_start"]:
+            start_task = options["bagh_start"][0]
+        else:
+            start_task = "gemeente"
+        # Without an explicit start, continue where an interrupted checkpointed import stopped
+        resume = options["checkpoint"] and not (
+            options["create"] or options["bagh_start"] or options["restart"]
+        )
+        profiler = None
+        if options["profile"]:
+            profiler = profiling.Profiler(
+                options["profile"], options["profile_dir"], options["profile_tasks"]
+            )
         for one_ds in sets:
             for job_class in self.imports[one_ds]:
-                batch.execute(job_class(), start_task)
+                job = job_class(
+                    processes=options["processes"],
+                    shards=options["shards"],
+                    incremental=options["incremental"],
+                    validation=options["validation"],
+                    engine=options["engine"],
+                    publish=options["publish"],
+                    date_checks=options["date_checks"],
+                    column_cache=options["column_cache"],
+                    pipeline_depth=options["pipeline_depth"],
+                    download=not options["skip_download"],
+                    prefetch_workers=0 if options["skip_download"] else settings.IMPORT_PREFETCH_WORKERS,
+                )
+                batch.execute(
+                    job,
+                    start_task,
+                    workers=options["workers"],
+                    checkpoint=options["checkpoint"],
+                    resume=resume,
+                    metrics_file=options["metrics_file"],
+                    metrics_textfile=options["metrics_textfile"],
+                    profiler=profiler,
+                )
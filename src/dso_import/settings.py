@@ -101,5 +101,59 @@ LOGGING = {
 
 PROJECT_DIR = os.path.abspath(os.path.join(BASE_DIR, ".."))
 DATA_DIR = os.getenv("DATA_DIR", os.path.abspath(os.path.join(PROJECT_DIR, "data")))
+# Etag and last-modified of the downloaded objects
+DOWNLOAD_MANIFEST = os.getenv("DOWNLOAD_MANIFEST", os.path.join(DATA_DIR, ".manifest.json"))
 
 AMSTERDAM_SCHEMA = {"geosearch_disabled_datasets": ["bag"]}
+
+# -- Import
+
+# Loader for the staging tables: "copy" streams rows with COPY FROM STDIN,
+# "insert" uses multi-row INSERT statements ("orm" is its former name).
+IMPORT_LOADER = env.str("IMPORT_LOADER", "copy")
+# COPY format used by the "copy" loader: "text" or "binary"
+IMPORT_COPY_FORMAT = env.str("IMPORT_COPY_FORMAT", "text")
+# Number of tasks that are executed at the same time
+IMPORT_WORKERS = env.int("IMPORT_WORKERS", 1)
+# Number of processes that parse and transform the rows of a single file
+IMPORT_PROCESSES = env.int("IMPORT_PROCESSES", 1)
+# Where references are validated: "memory" (per row) or "database" (anti-joins)
+IMPORT_VALIDATION = env.str("IMPORT_VALIDATION", "memory")
+# Skip unchanged source files and only stage added or changed rows (import ledger)
+IMPORT_INCREMENTAL = env.bool("IMPORT_INCREMENTAL", False)
+# Number of threads that download the source files before and during the import
+IMPORT_PREFETCH_WORKERS = env.int("IMPORT_PREFETCH_WORKERS", 4)
+# How CSV rows are transformed: "rows" (one by one) or "columnar" (vectorized batches)
+IMPORT_ENGINE = env.str("IMPORT_ENGINE", "rows")
+# How changes are published: "merge" (into the live tables) or "swap" (new tables are swapped in)
+IMPORT_PUBLISH = env.str("IMPORT_PUBLISH", "merge")
+# Date checks on "all" staged rows, or only on the identificaties with new or changed rows ("touched")
+IMPORT_DATE_CHECKS = env.str("IMPORT_DATE_CHECKS", "all")
+# Drop secondary indexes and foreign keys when the tables are created and rebuild them after the load
+IMPORT_DEFER_INDEXES = env.bool("IMPORT_DEFER_INDEXES", False)
+# Number of indexes that are rebuilt at the same time, each on its own connection
+IMPORT_INDEX_WORKERS = env.int("IMPORT_INDEX_WORKERS", 4)
+# maintenance_work_mem for building indexes, e.g. "1GB"; empty keeps the server setting
+IMPORT_MAINTENANCE_WORK_MEM = env.str("IMPORT_MAINTENANCE_WORK_MEM", "512MB")
+# Record finished tasks and committed batches in import_job_state, so an interrupted import can resume
+IMPORT_CHECKPOINT = env.bool("IMPORT_CHECKPOINT", False)
+# Write the metrics report of an import (timings per task and stage, rows/s, memory) as JSON
+IMPORT_METRICS_FILE = env.str("IMPORT_METRICS_FILE", "")
+# Write the metrics in the Prometheus textfile format, e.g. for the node exporter textfile collector
+IMPORT_METRICS_TEXTFILE = env.str("IMPORT_METRICS_TEXTFILE", "")
+# Directory for the profiles of run_import --profile
+IMPORT_PROFILE_DIR = env.str("IMPORT_PROFILE_DIR", os.path.join(DATA_DIR, "profiles"))
+# Cache the parsed columns of the source files in the Arrow IPC format, for the columnar engine (needs pyarrow)
+IMPORT_COLUMN_CACHE = env.bool("IMPORT_COLUMN_CACHE", False)
+# Directory of the column cache
+IMPORT_COLUMN_CACHE_DIR = env.str("IMPORT_COLUMN_CACHE_DIR", os.path.join(DATA_DIR, "cache"))
+# Directory for the cached table descriptions of the datasets; empty: the models are built on every run
+IMPORT_SCHEMA_CACHE_DIR = env.str("IMPORT_SCHEMA_CACHE_DIR", os.path.join(DATA_DIR, "schema"))
+# Upper bound for the size of a batch of rows that is written at once, in bytes
+IMPORT_BATCH_BYTES = env.int("IMPORT_BATCH_BYTES", 32 * 1024 * 1024)
+# Time a batch of rows should take to write, in seconds; batches are sized to it
+IMPORT_BATCH_SECONDS = env.float("IMPORT_BATCH_SECONDS", 2.0)
+# Parsed batches of rows that may wait for the database while the next are parsed in a thread; 0: no pipeline
+IMPORT_PIPELINE_DEPTH = env.int("IMPORT_PIPELINE_DEPTH", 0)
+# Number of processes that each stage a part of a source file (partitioned by identificatie) on their own connection; 1: no shards
+IMPORT_SHARDS = env.int("IMPORT_SHARDS", 1)
@@ -0,0 +1,15 @@
+"""
+Settings for running the import commands: only the apps the models need,
+not the apps of the API (DRF, drf_spectacular, gisserver).
+
+    DJANGO_SETTINGS_MODULE=dso_import.settings_import python manage.py run_import bagh
+"""
+from dso_import.settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    "django.contrib.contenttypes",
+    "django.contrib.gis",
+    "django.contrib.postgres",
+    "schematools.contrib.django",
+    "dso_import",
+]
@@ -4,7 +4,7 @@ set -u   # crash on missing env variables
 set -e   # stop on any error
 set -x
 
-DJANGO_SETTINGS_MODULE=dso_import.settings
+export DJANGO_SETTINGS_MODULE=dso_import.settings_import
 DJANGO_DEBUG=false
 
 python -m venv venv
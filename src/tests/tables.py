@@ -0,0 +1,12 @@
+from dso_import.batch import schema
+
+
+class StaticTables:
+    """Descriptions of tables with only the key columns, for tasks that do not write"""
+
+    def table(self, name):
+        fields = [("id", "id"), ("identificatie", "identificatie"), ("volgnummer", "volgnummer")]
+        return schema.Table(name, f"bagh_{name}", fields, "id", 28992)
+
+    def tables(self):
+        return []
@@ -0,0 +1,53 @@
+from dso_import.batch import batching
+from dso_import.batch.batching import BatchSize
+
+
+def batch_size(**kwargs):
+    kwargs.setdefault("budget_bytes", 10_000_000)
+    kwargs.setdefault("target_seconds", 1)
+    return BatchSize(**kwargs)
+
+
+def test_grows_at_most_max_growth():
+    size = batch_size()
+    for expected in (2000, 4000, 8000):
+        # Small, fast rows: only the growth limit applies
+        size.record(size.rows, size.rows * 10, 0.001)
+        assert size.rows == expected
+
+
+def test_within_byte_budget():
+    size = batch_size(budget_bytes=1_000_000, initial_rows=5000)
+    size.record(5000, 5000 * 1000, 0.001)
+    assert size.rows == 1000
+
+
+def test_within_target_seconds():
+    size = batch_size(initial_rows=10000)
+    size.record(10000, 10000 * 10, 4)
+    assert size.rows == 2500
+
+
+def test_shrinks_with_the_moving_average():
+    size = batch_size(initial_rows=10000)
+    size.record(10000, 10000 * 10, 1)
+    assert size.rows == 10000
+    # A slow batch: the average rate drops from 10000 to 7300 rows per second
+    size.record(10000, 10000 * 10, 10)
+    assert size.rows == 7300
+
+
+def test_clamped_to_min_and_max_rows():
+    size = batch_size(min_rows=100, max_rows=5000, initial_rows=4000)
+    size.record(4000, 4000 * 10, 0.001)
+    assert size.rows == 5000
+    size = batch_size(min_rows=100, max_rows=5000, initial_rows=4000)
+    size.record(4000, 4000 * 10, 4000)
+    assert size.rows == 100
+
+
+def test_empty_batch_is_ignored():
+    size = batch_size()
+    size.record(0, 0, 1)
+    assert size.rows == batching.INITIAL_ROWS
+    assert size.row_bytes is None
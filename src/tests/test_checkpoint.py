@@ -0,0 +1,53 @@
+import os
+
+from dso_import.bagh.batch import ImportPandTask
+from dso_import.batch import csv
+from dso_import.benchmarks import gobdata
+
+from .tables import StaticTables
+
+CHUNK_BYTES = 2048
+
+
+def pand_task(path, processes):
+    return ImportPandTask(
+        path=path,
+        models=StaticTables(),
+        download=False,
+        geotype="polygon",
+        processes=processes,
+    )
+
+
+def staged_ranges(task, start=None):
+    """The ``(end offset, count)`` checkpoints of the ranges, like ``process_checkpointed``"""
+    ranges = csv.process_csv_ranges(
+        task.path,
+        task.filename,
+        task.process_row,
+        start=start,
+        processes=task.processes,
+        chunk_bytes=CHUNK_BYTES,
+        init_worker=task.init_worker,
+        pop_state=task.pop_worker_state,
+        merge_state=task.merge_worker_state,
+    )
+    return [(end, task.count) for end, _ in ranges]
+
+
+def test_resume_with_processes_counts_the_staged_rows_once(tmp_path):
+    path = str(tmp_path)
+    rows = gobdata.write_dataset(path, 600)["pand"]
+    checkpoints = staged_ranges(pand_task(path, processes=1))
+    assert len(checkpoints) > 2
+    assert checkpoints[-1][1] == rows
+
+    # An interrupted run resumes at the checkpoint of its second range
+    offset, row_count = checkpoints[1]
+    task = pand_task(path, processes=2)
+    task.count = row_count
+    resumed = staged_ranges(task, start=offset)
+
+    # The last checkpoint counts every row once, like the run without interruption
+    assert resumed[-1] == checkpoints[-1]
+    assert resumed[-1][0] == os.path.getsize(os.path.join(path, task.filename))
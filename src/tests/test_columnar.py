@@ -0,0 +1,58 @@
+import csv as pycsv
+import os
+
+from dso_import.bagh.batch import ImportPandTask
+from dso_import.batch import csv
+from dso_import.benchmarks import gobdata
+
+from .tables import StaticTables
+
+
+class GeometryTables(StaticTables):
+    """``StaticTables`` with the geometry column, to compare the converted geometries"""
+
+    def table(self, name):
+        table = super().table(name)
+        return table._replace(fields=table.fields + [("geometrie", "geometrie")])
+
+
+def pand_task(path):
+    task = ImportPandTask(
+        path=path, models=GeometryTables(), download=False, geotype="polygon"
+    )
+    task.incremental = True
+    return task
+
+
+def write_ragged_rows(path, file_name):
+    """Rewrites the file with some rows cut off before the geometry and some with extra values"""
+    file_path = os.path.join(path, file_name)
+    with open(file_path, encoding=csv.GOB_CSV_ENCODING) as f:
+        rows = list(pycsv.reader(f, delimiter=";"))
+    cut = rows[0].index("geometrie")
+    for i, row in enumerate(rows[1:], 1):
+        if i % 3 == 0:
+            rows[i] = row[:cut]
+        elif i % 3 == 1:
+            rows[i] = row + ["extra", "waarden"]
+    with open(file_path, "w", encoding=csv.GOB_CSV_ENCODING, newline="") as f:
+        pycsv.writer(f, delimiter=";").writerows(rows)
+
+
+def test_row_and_columnar_engines_agree_on_ragged_rows(tmp_path):
+    path = str(tmp_path)
+    gobdata.write_dataset(path, 60)
+    row_task = pand_task(path)
+    write_ragged_rows(path, row_task.filename)
+
+    rows = list(csv.process_csv(path, row_task.filename, row_task.process_row))
+    column_task = pand_task(path)
+    columns = list(
+        csv.process_csv_columns(path, column_task.filename, column_task.process_batch)
+    )
+
+    assert columns == rows
+    assert any(row[-1] is None for row in rows)
+    assert any(row[-1] is not None for row in rows)
+    assert column_task.row_hashes == row_task.row_hashes
+    assert len(row_task.row_hashes) == len(rows)
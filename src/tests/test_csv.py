@@ -0,0 +1,70 @@
+import pytest
+
+from dso_import.batch import csv
+
+ROWS = [
+    ("1", "een", "2020-01-01"),
+    ("2", '"twee\nregels"', ""),
+    ("3", '"met ""quotes"" en ;"', "2020-01-03"),
+    ("4", "", ""),
+    ("5", '"\n"', "2020-01-05"),
+] + [(str(i), f"rij {i}", "") for i in range(6, 60)]
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    lines = ["id;naam;datum"] + [";".join(row) for row in ROWS]
+    path = tmp_path / "test.csv"
+    path.write_bytes(("\n".join(lines) + "\n").encode("utf-8-sig"))
+    return path
+
+
+def read_rows(path):
+    return list(csv.process_csv(str(path.parent), path.name, lambda row: row))
+
+
+def test_row_ranges_end_on_row_boundaries(csv_file):
+    data = csv_file.read_bytes()
+    header_end = data.index(b"\n") + 1
+    ranges = list(csv.row_ranges(str(csv_file), chunk_bytes=16))
+    assert len(ranges) > 1
+    assert ranges[0][0] == header_end
+    assert ranges[-1][1] == len(data)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+    for start, end in ranges:
+        assert data[end - 1:end] == b"\n"
+        assert data.count(b'"', start, end) % 2 == 0
+
+
+def test_row_ranges_stop(csv_file):
+    ranges = list(csv.row_ranges(str(csv_file), chunk_bytes=16))
+    stop = ranges[2][1]
+    assert list(csv.row_ranges(str(csv_file), chunk_bytes=16, stop=stop)) == ranges[:3]
+
+
+@pytest.mark.parametrize("chunk_bytes", [1, 16, 100, 1 << 20])
+def test_process_csv_ranges_same_rows_as_process_csv(csv_file, chunk_bytes):
+    ranges = csv.process_csv_ranges(
+        str(csv_file.parent), csv_file.name, lambda row: row, chunk_bytes=chunk_bytes
+    )
+    assert [row for _, rows in ranges for row in rows] == read_rows(csv_file)
+
+
+def test_process_csv_ranges_resume(csv_file):
+    path, name = str(csv_file.parent), csv_file.name
+    ranges = list(csv.process_csv_ranges(path, name, lambda row: row, chunk_bytes=32))
+    assert len(ranges) > 2
+    resume_at, done = ranges[1][0], ranges[0][1] + ranges[1][1]
+    resumed = csv.process_csv_ranges(path, name, lambda row: row, start=resume_at, chunk_bytes=32)
+    assert done + [row for _, rows in resumed for row in rows] == read_rows(csv_file)
+
+
+def test_process_csv_ranges_columnar(csv_file):
+    def columns_to_rows(columns):
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+    ranges = csv.process_csv_ranges(
+        str(csv_file.parent), csv_file.name, columns_to_rows, columnar=True, chunk_bytes=16
+    )
+    assert [row for _, rows in ranges for row in rows] == read_rows(csv_file)
@@ -0,0 +1,104 @@
+import struct
+
+import numpy as np
+import pytest
+
+from dso_import.batch import ewkb
+
+SRID = 28992
+POINT = 1
+LINESTRING = 2
+POLYGON = 3
+MULTIPOLYGON = 6
+SRID_FLAG = 0x20000000
+Z_FLAG = 0x80000000
+
+SQUARE = [(0, 0), (1, 0), (1, 1), (0, 0)]
+
+
+def header(wkb_type, srid=SRID):
+    if srid is None:
+        return struct.pack("<BI", 1, wkb_type)
+    return struct.pack("<BII", 1, wkb_type | SRID_FLAG, srid)
+
+
+def ring(points):
+    return struct.pack("<I", len(points)) + b"".join(struct.pack("<2d", *p) for p in points)
+
+
+def test_point():
+    assert ewkb.from_wkt("POINT (1 2)", "point", SRID) == header(POINT) + struct.pack("<2d", 1, 2)
+    # As bytes(GEOSGeometry("SRID=28992;POINT (1 2)").ewkb)
+    assert ewkb.from_wkt("SRID=28992;POINT(1 2)").hex() == (
+        "010100002040710000000000000000f03f0000000000000040"
+    )
+
+
+def test_polygon():
+    wkt = "POLYGON ((0 0, 1 0, 1 1, 0 0))"
+    expected = header(POLYGON) + struct.pack("<I", 1) + ring(SQUARE)
+    assert ewkb.from_wkt(wkt, "polygon", SRID) == expected
+
+
+def test_polygon_with_a_hole():
+    wkt = "POLYGON ((0 0, 4 0, 4 4, 0 0), (1 1, 2 1, 2 2, 1 1))"
+    outer = [(0, 0), (4, 0), (4, 4), (0, 0)]
+    inner = [(1, 1), (2, 1), (2, 2), (1, 1)]
+    expected = header(POLYGON, None) + struct.pack("<I", 2) + ring(outer) + ring(inner)
+    assert ewkb.from_wkt(wkt) == expected
+
+
+def test_polygon_is_promoted_to_multipolygon():
+    polygon = header(POLYGON, None) + struct.pack("<I", 1) + ring(SQUARE)
+    expected = header(MULTIPOLYGON) + struct.pack("<I", 1) + polygon
+    assert ewkb.from_wkt("POLYGON ((0 0, 1 0, 1 1, 0 0))", "multipolygon", SRID) == expected
+    assert ewkb.from_wkt("MULTIPOLYGON (((0 0, 1 0, 1 1, 0 0)))", "multipolygon", SRID) == expected
+
+
+def test_z():
+    expected = header(POINT | Z_FLAG) + struct.pack("<3d", 1, 2, 3)
+    assert ewkb.from_wkt("POINT Z (1 2 3)", "point", SRID) == expected
+    # A third coordinate without the Z keyword
+    assert ewkb.from_wkt("POINT (1 2 3)", "point", SRID) == expected
+
+
+def test_srid_of_the_text_is_overridden():
+    expected = ewkb.from_wkt("POINT (1 2)", srid=SRID)
+    assert ewkb.from_wkt("SRID=4326;POINT (1 2)", srid=SRID) == expected
+
+
+@pytest.mark.parametrize(
+    "wkt",
+    [
+        "",
+        "POINT EMPTY",
+        "LINESTRING (0 0, 1 1)",
+        "GEOMETRYCOLLECTION (POINT (1 2))",
+        "POINT (1 2",
+        "POINT (1 x)",
+        "POLYGON ((0 0, 1 0, 1 1))) ",
+        "not wkt",
+    ],
+)
+def test_no_ewkb_for_empty_other_or_invalid_wkt(wkt):
+    assert ewkb.from_wkt(wkt, "point", SRID) is None
+
+
+def test_from_wkt_column():
+    column = np.array(["POINT (1 2)", "", "LINESTRING (0 0, 1 1)", "POINT (3 4)"], dtype=object)
+    result, rejected = ewkb.from_wkt_column(column, "point", SRID)
+    assert result.tolist() == [ewkb.from_wkt(wkt, "point", SRID) or None for wkt in column]
+    assert rejected.tolist() == [False, False, True, False]
+
+    mask = np.array([True, True, True, False])
+    result, rejected = ewkb.from_wkt_column(column, "point", SRID, mask=mask)
+    assert result[3] is None
+    assert not rejected[3]
+
+
+def test_from_wkt_column_missing_value_is_no_geometry():
+    # A short CSV row has None for the columns it lacks
+    column = np.array(["POINT (1 2)", None], dtype=object)
+    result, rejected = ewkb.from_wkt_column(column, "point", SRID)
+    assert result[1] is None
+    assert rejected.tolist() == [False, False]
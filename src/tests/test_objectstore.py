@@ -0,0 +1,44 @@
+import os
+import threading
+import time
+
+from dso_import.batch import objectstore
+
+
+def test_prefetch_downloads_in_the_background_and_download_file_waits(monkeypatch, tmp_path):
+    calls = []
+    started = threading.Event()
+
+    def download(file_path, newfilename, target_root, file_last_modified):
+        started.set()
+        calls.append(("start", threading.current_thread().name))
+        time.sleep(0.2)
+        calls.append(("end", threading.current_thread().name))
+
+    monkeypatch.setattr(objectstore, "_download_file", download)
+    executor = objectstore.prefetch(["bag/a.csv"], 1, target_root=str(tmp_path))
+    # prefetch returns while the file is downloaded
+    assert started.wait(1)
+    assert len(calls) == 1
+
+    # The task that needs the file waits until the prefetch is done
+    objectstore.download_file("bag/a.csv", target_root=str(tmp_path))
+    executor.shutdown()
+    assert [event for event, _ in calls] == ["start", "end", "start", "end"]
+    assert calls[0][1].startswith("prefetch")
+    assert not calls[2][1].startswith("prefetch")
+
+
+def test_downloaded_etag_of_a_replaced_file_is_none(monkeypatch, tmp_path):
+    manifest = objectstore.Manifest(str(tmp_path / "manifest.json"))
+    monkeypatch.setattr(objectstore, "manifest", manifest)
+    target = tmp_path / "a.csv"
+    target.write_text("a;b\n")
+    objectstore.manifest.update(str(target), "bag/a.csv", {"etag": '"abc"', "content-length": "4"})
+    assert objectstore.downloaded_etag("bag/a.csv", target_root=str(tmp_path)) == "abc"
+
+    # Replaced by hand, with the same size
+    target.write_text("c;d\n")
+    os.utime(target, ns=(0, 0))
+    assert objectstore.downloaded_etag("bag/a.csv", target_root=str(tmp_path)) is None
+    assert objectstore.downloaded_etag("bag/b.csv", target_root=str(tmp_path)) is None
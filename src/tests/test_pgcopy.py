@@ -0,0 +1,108 @@
+import struct
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from dso_import.batch import pgcopy
+
+
+class CopyCursor:
+    """Reads the data of ``copy_expert`` like psycopg2, in blocks"""
+
+    def __init__(self):
+        self.sql = None
+        self.data = b""
+
+    def copy_expert(self, sql, file, size=8192):
+        self.sql = sql
+        for block in iter(lambda: file.read(size), b""):
+            self.data += block
+
+
+def copy(rows, format=pgcopy.COPY_TEXT, **kwargs):
+    cursor = CopyCursor()
+    stats = {}
+    count = pgcopy.copy_rows(
+        cursor, "t", ["a", "b"], iter(rows), format=format, stats=stats, **kwargs
+    )
+    assert stats["bytes"] == len(cursor.data)
+    return cursor, count
+
+
+@pytest.mark.parametrize(
+    "value, text",
+    [
+        (None, "\\N"),
+        (True, "t"),
+        (False, "f"),
+        ("plain", "plain"),
+        ("tab\there", "tab\\there"),
+        ("line\nbreak\r", "line\\nbreak\\r"),
+        ("back\\slash", "back\\\\slash"),
+        # Not the NULL marker
+        ("\\N", "\\\\N"),
+        (b"\x01\xff", "01ff"),
+        (12, "12"),
+        (date(2020, 1, 2), "2020-01-02"),
+        (datetime(2020, 1, 2, 3, 4, 5), "2020-01-02T03:04:05"),
+        (["a", None, 'say "hi"'], '{"a",NULL,"say \\\\"hi\\\\""}'),
+        (["back\\slash"], '{"back\\\\\\\\slash"}'),
+    ],
+)
+def test_text_value(value, text):
+    assert pgcopy.text_value(value) == text
+
+
+def test_copy_text():
+    cursor, count = copy([("a\tb", None), ("é", b"\x00")])
+    assert count == 2
+    assert cursor.sql == "COPY t (a, b) FROM STDIN WITH (FORMAT text)"
+    assert cursor.data == "a\\tb\t\\N\né\t00\n".encode("utf-8")
+
+
+def field(data):
+    return struct.pack(">i", len(data)) + data
+
+
+def test_copy_binary():
+    column_types = {"a": ("text", None, None), "b": ("int4", None, None)}
+    rows = [("é\t", 1), (None, -2)]
+    cursor, count = copy(rows, format=pgcopy.COPY_BINARY, column_types=column_types)
+    assert count == 2
+    assert cursor.sql == "COPY t (a, b) FROM STDIN WITH (FORMAT binary)"
+    assert cursor.data == (
+        b"PGCOPY\n\377\r\n\0" + struct.pack(">ii", 0, 0)
+        + struct.pack(">h", 2) + field("é\t".encode("utf-8")) + field(struct.pack(">i", 1))
+        + struct.pack(">h", 2) + struct.pack(">i", -1) + field(struct.pack(">i", -2))
+        + struct.pack(">h", -1)
+    )  # fmt: skip
+
+
+def test_binary_dates_and_timestamps():
+    encode_date = pgcopy._binary_encoder(("date", None, None), None)
+    assert encode_date(date(2000, 1, 2)) == struct.pack(">i", 1)
+    assert encode_date(date(1999, 12, 31)) == struct.pack(">i", -1)
+
+    encode_timestamp = pgcopy._binary_encoder(("timestamp", None, None), None)
+    assert encode_timestamp(datetime(2000, 1, 1, 0, 0, 1, 5)) == struct.pack(">q", 1000005)
+
+    plus_one = timezone(timedelta(hours=1))
+    encode_timestamptz = pgcopy._binary_encoder(("timestamptz", None, None), plus_one)
+    # Naive values are in the given timezone, the result is UTC
+    assert encode_timestamptz(datetime(2000, 1, 1, 1)) == struct.pack(">q", 0)
+    assert encode_timestamptz(datetime(2000, 1, 1, 0, tzinfo=timezone.utc)) == struct.pack(">q", 0)
+    with pytest.raises(ValueError):
+        pgcopy._binary_encoder(("timestamptz", None, None), None)(datetime(2000, 1, 1))
+
+
+def test_binary_array():
+    encode = pgcopy._binary_encoder(("_text", "text", 25), None)
+    assert encode(["a", None]) == (
+        struct.pack(">iiiii", 1, 1, 25, 2, 1) + field(b"a") + struct.pack(">i", -1)
+    )
+    assert encode([]) == struct.pack(">iii", 0, 0, 25)
+
+
+def test_binary_unsupported_type():
+    with pytest.raises(ValueError):
+        pgcopy._binary_encoder(("jsonb", None, None), None)
@@ -0,0 +1,58 @@
+import threading
+import time
+
+import pytest
+
+from dso_import.batch import pipeline
+
+
+def test_chunks():
+    assert list(pipeline.chunks(range(5), size=2)) == [[0, 1], [2, 3], [4]]
+    assert list(pipeline.chunks([], size=2)) == []
+
+
+def test_pipelined_yields_the_items_in_order():
+    assert list(pipeline.pipelined(iter(range(100)), depth=3)) == list(range(100))
+
+
+def test_pipelined_producer_waits_for_the_consumer():
+    produced = []
+
+    def items():
+        for i in range(20):
+            produced.append(i)
+            yield i
+
+    consumed = pipeline.pipelined(items(), depth=2)
+    assert next(consumed) == 0
+    time.sleep(0.2)
+    # The consumed item, ``depth`` in the queue and the one waiting to be put
+    assert len(produced) == 4
+    assert list(consumed) == list(range(1, 20))
+
+
+def test_pipelined_raises_the_error_of_the_producer():
+    def items():
+        yield 1
+        raise KeyError("row")
+
+    consumed = pipeline.pipelined(items(), depth=2)
+    assert next(consumed) == 1
+    with pytest.raises(KeyError):
+        next(consumed)
+
+
+def test_pipelined_stops_the_producer_when_the_consumer_stops():
+    closed = threading.Event()
+
+    def items():
+        try:
+            for i in range(1000):
+                yield i
+        finally:
+            closed.set()
+
+    consumed = pipeline.pipelined(items(), depth=2)
+    assert next(consumed) == 0
+    consumed.close()
+    assert closed.is_set()
@@ -0,0 +1,74 @@
+import numpy as np
+
+from dso_import.batch.refindex import ReferenceIndex
+
+A = "0363100012345678"
+B = "0363100012345679"
+
+
+def test_ids_are_packed_in_sorted_unique_keys():
+    index = ReferenceIndex.from_pairs([[(B, 2), (A, 1)], [], [(A, 1), (A, 999)]])
+    assert index.width == 16
+    assert index.keys.tolist() == [
+        363100012345678 * 1000 + 1,
+        363100012345678 * 1000 + 999,
+        363100012345679 * 1000 + 2,
+    ]
+    assert index.overflow == set()
+    assert len(index) == 3
+    assert index.nbytes == 3 * 8
+
+
+def test_contains():
+    index = ReferenceIndex.from_pairs([[(A, 1), (B, 2)]])
+    assert index.contains(A, 1)
+    assert not index.contains(A, 2)
+    assert not index.contains("0363100012345677", 1)
+    assert f"{B}_2" in index
+    assert f"{B}_1" not in index
+    assert index.contains_many([A, A, B, "x"], [1, 2, 2, 1]).tolist() == [True, False, True, False]
+
+
+def test_ids_that_can_not_be_packed_overflow():
+    pairs = [
+        (A, 1),
+        # Another width
+        ("12345", 1),
+        # Not numeric
+        ("03631000123456AB", 1),
+        # Not ascii
+        ("03631000123456é7", 1),
+        # Volgnummer too large for the packed key
+        (B, 1000),
+    ]
+    index = ReferenceIndex.from_pairs([pairs])
+    assert len(index.keys) == 1
+    assert index.overflow == {
+        "12345_001",
+        "03631000123456AB_001",
+        "03631000123456é7_001",
+        f"{B}_1000",
+    }
+    assert len(index) == 5
+    for identificatie, volgnummer in pairs:
+        assert index.contains(identificatie, volgnummer)
+    identificaties, volgnummers = zip(*pairs)
+    assert index.contains_many(list(identificaties), np.array(volgnummers)).all()
+    assert not index.contains("12345", 2)
+    assert not index.contains_many(["12345", "123456"], [2, 1]).any()
+
+
+def test_identificaties_wider_than_a_key_overflow():
+    wide = "03631000123456789"
+    index = ReferenceIndex.from_pairs([[(wide, 1)]])
+    assert len(index.keys) == 0
+    assert index.overflow == {f"{wide}_001"}
+    assert index.contains(wide, 1)
+    assert index.contains_many([wide], [1]).tolist() == [True]
+
+
+def test_clear():
+    index = ReferenceIndex.from_pairs([[(A, 1), ("12345", 1)]])
+    index.clear()
+    assert len(index) == 0
+    assert not index.contains(A, 1)
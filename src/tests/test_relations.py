@@ -0,0 +1,72 @@
+import pytest
+from django.db import connection
+
+from dso_import.bagh.batch import (
+    LOADER_COPY,
+    VALIDATION_DATABASE,
+    VERBLIJFSOBJECT_FIELDS,
+    CreateBagHTables,
+    ImportVerblijfsobjectTask,
+    create_state_tables,
+)
+from dso_import.batch import schema
+from dso_import.batch.batching import BatchSize
+from dso_import.benchmarks import gobdata
+
+BATCH_ROWS = 50
+
+
+class DatabaseTables:
+    """Descriptions of the bagh tables read from the database, instead of from the schema"""
+
+    def table(self, name):
+        db_table = f"bagh_{name}"
+        with connection.cursor() as cursor:
+            columns = [
+                column.name
+                for column in connection.introspection.get_table_description(cursor, db_table)
+            ]
+        srid = 28992 if "geometrie" in columns else None
+        return schema.Table(name, db_table, [(c, c) for c in columns], "id", srid)
+
+    def tables(self):
+        return []
+
+
+def fixed_batch_size():
+    return BatchSize(min_rows=BATCH_ROWS, max_rows=BATCH_ROWS, initial_rows=BATCH_ROWS)
+
+
+@pytest.mark.django_db
+def test_stage_verblijfsobject_with_relations_in_several_batches(tmp_path):
+    models = DatabaseTables()
+    with connection.cursor() as cursor:
+        create_state_tables(cursor)
+    CreateBagHTables(models=models, defer_indexes=False).process()
+    rows = gobdata.write_dataset(str(tmp_path), 200)
+    task = ImportVerblijfsobjectTask(
+        path=str(tmp_path),
+        models=models,
+        download=False,
+        geotype="point",
+        references=["buurt"],
+        extra_fields=VERBLIJFSOBJECT_FIELDS,
+        loader=LOADER_COPY,
+        # There are no panden to validate the relations against in memory
+        validation=VALIDATION_DATABASE,
+        processes=1,
+        pipeline_depth=0,
+    )
+    task.before()
+    task.writer.batch_size = fixed_batch_size()
+    task.pandrelaties.writer.batch_size = fixed_batch_size()
+    # The relations are written while the verblijfsobjecten are staged, not only at the end
+    task.process()
+    assert task.pandrelaties.count > BATCH_ROWS
+
+    task.save_related()
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) FROM {task.temp_table}")
+        assert cursor.fetchone()[0] == rows["verblijfsobject"]
+        cursor.execute(f"SELECT count(*) FROM {task.pandrelatie_temp_table}")
+        assert cursor.fetchone()[0] == task.pandrelaties.count
@@ -0,0 +1,98 @@
+import threading
+import time
+
+import pytest
+
+from dso_import.batch import batch
+
+
+class Task:
+    def __init__(self, name, depends_on=(), seconds=0.0, log=None, fail=False):
+        self.name = name
+        self.depends_on = None if depends_on is None else list(depends_on)
+        self.seconds = seconds
+        self.log = log
+        self.fail = fail
+
+    def execute(self):
+        self.log.append(("start", self.name))
+        time.sleep(self.seconds)
+        if self.fail:
+            raise RuntimeError(self.name)
+        self.log.append(("end", self.name))
+
+
+def names(tasks, dependencies):
+    return [sorted(tasks[i].name for i in d) for d in dependencies]
+
+
+def test_dependencies():
+    tasks = [
+        Task("create", depends_on=None),
+        Task("gemeente"),
+        Task("buurt", depends_on=["gemeente"]),
+        Task("pand"),
+        Task("verblijfsobject", depends_on=["buurt", "pand", "skipped"]),
+    ]
+    assert names(tasks, batch._dependencies(tasks)) == [
+        [],
+        ["create"],
+        ["create", "gemeente"],
+        ["create"],
+        ["buurt", "create", "pand"],
+    ]
+
+
+def test_a_task_without_depends_on_is_a_barrier():
+    tasks = [Task("a"), Task("b"), Task("rebuild", depends_on=None), Task("c")]
+    assert names(tasks, batch._dependencies(tasks)) == [[], [], ["a", "b"], ["rebuild"]]
+
+
+def test_only_preceding_tasks_are_waited_for():
+    tasks = [Task("a", depends_on=["b"]), Task("b", depends_on=["a"])]
+    assert names(tasks, batch._dependencies(tasks)) == [[], ["a"]]
+
+
+def test_execute_parallel_starts_a_task_when_its_dependencies_are_done():
+    log = []
+    tasks = [
+        Task("slow", seconds=0.3, log=log),
+        Task("fast", seconds=0.05, log=log),
+        Task("after_fast", depends_on=["fast"], log=log),
+        Task("barrier", depends_on=None, log=log),
+        Task("last", log=log),
+    ]
+    batch._execute_parallel(tasks, workers=3)
+    # after_fast does not wait for slow
+    assert log.index(("start", "after_fast")) < log.index(("end", "slow"))
+    assert log.index(("end", "fast")) < log.index(("start", "after_fast"))
+    # The barrier waits for all tasks before it, the last task for the barrier
+    start_barrier = log.index(("start", "barrier"))
+    assert all(log.index(("end", name)) < start_barrier for name in ["slow", "fast", "after_fast"])
+    assert log.index(("end", "barrier")) < log.index(("start", "last"))
+
+
+def test_execute_parallel_runs_at_most_workers_tasks():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    class Counted(Task):
+        def execute(self):
+            with lock:
+                running.append(self.name)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(self.name)
+
+    batch._execute_parallel([Counted(str(i)) for i in range(6)], workers=2)
+    assert max(peak) == 2
+
+
+def test_execute_parallel_stops_scheduling_when_a_task_fails():
+    log = []
+    tasks = [Task("broken", fail=True, log=log), Task("next", depends_on=None, log=log)]
+    with pytest.raises(RuntimeError):
+        batch._execute_parallel(tasks, workers=2)
+    assert ("start", "next") not in log